@@ -53,6 +53,8 @@ from glob import glob
 import random
 import pandas as pd
 import os
+from deep_folding.anatomist_tools.manifest import DatasetManifest
+from deep_folding.anatomist_tools.utils.affine import bucket_to_array
 from deep_folding.anatomist_tools.utils.load_bbox import compute_max_box
 from deep_folding.anatomist_tools.utils.sulcus_side import complete_sulci_name
 
@@ -138,13 +140,12 @@ class Benchmark():
         surface = random.randint(0, len(self.surfaces)-1)
         print(self.surfaces[surface]['label'])
 
-        bck_map = self.surfaces[surface]['aims_ss']
-        for voxel in bck_map[0].keys():
-            self.skel.setValue(0, voxel[0], voxel[1], voxel[2])
-
-        bck_map_bottom = self.surfaces[surface]['aims_bottom']
-        for voxel in bck_map_bottom[0].keys():
-            self.skel.setValue(0, voxel[0], voxel[1], voxel[2])
+        # Voxels are set through a numpy view of the skeleton
+        skel = np.asarray(self.skel)
+        for bck_map in (self.surfaces[surface]['aims_ss'],
+                        self.surfaces[surface]['aims_bottom']):
+            voxels = bucket_to_array(bck_map)
+            skel[voxels[:, 0], voxels[:, 1], voxels[:, 2], 0] = 0
 
         save_subject = sub
         return save_subject
@@ -164,15 +165,14 @@ class Benchmark():
             skel_file = os.path.join(self.data_dir, str(sub_added), self.cpt_skel_1,
                                      self.side + self.cpt_skel_2 + str(sub_added) + self.cpt_skel_3)
             self.skel = aims.read(skel_file)
-            bck_map = self.surfaces[surface]['aims_ss']
-            for voxel in bck_map[0].keys():
-                if self.skel.value(voxel[0], voxel[1], voxel[2])!=11:
-                    self.skel.setValue(60, voxel[0], voxel[1], voxel[2])
-
-            bck_map_bottom = self.surfaces[surface]['aims_bottom']
-            for voxel in bck_map_bottom[0].keys():
-                if self.skel.value(voxel[0], voxel[1], voxel[2])!=11:
-                    self.skel.setValue(60, voxel[0], voxel[1], voxel[2])
+            # Voxels are set through a numpy view of the skeleton
+            skel = np.asarray(self.skel)
+            for bck_map in (self.surfaces[surface]['aims_ss'],
+                            self.surfaces[surface]['aims_bottom']):
+                voxels = bucket_to_array(bck_map)
+                voxels = voxels[skel[voxels[:, 0], voxels[:, 1],
+                                     voxels[:, 2], 0] != 11]
+                skel[voxels[:, 0], voxels[:, 1], voxels[:, 2], 0] = 60
 
         save_subject = sub_added
         return save_subject
@@ -219,9 +219,12 @@ class Benchmark():
         df_givers.to_csv(os.path.join(self.saving_dir, 'givers.csv'))
 
 
-def get_sub_list(subjects_list):
+def get_sub_list(subjects_list, manifest=None):
     """Returns subjects list for which latered skelerons can be created
     Only right handed HCP subjects
+
+    If a manifest file (written by manifest.py) is given, existing subjects
+    are read from it instead of listing the HCP directory
     """
     if subjects_list:
         subjects_list = pd.read_csv(subjects_list)
@@ -231,7 +234,10 @@ def get_sub_list(subjects_list):
         right_handed = pd.read_csv('/neurospin/dico/lguillon/hcp_info/right_handed.csv')
         subjects_list = list(right_handed['Subject'].astype(str))
         # Check whether subjects' files exist
-        hcp_sub = os.listdir('/neurospin/hcp/ANALYSIS/3T_morphologist/')
+        if manifest:
+            hcp_sub = set(DatasetManifest(manifest).subjects)
+        else:
+            hcp_sub = os.listdir('/neurospin/hcp/ANALYSIS/3T_morphologist/')
         subjects_list = [sub for sub in subjects_list if sub in hcp_sub]
 
         random.shuffle(subjects_list)
@@ -241,7 +247,7 @@ def get_sub_list(subjects_list):
 
 def generate(b_num, side, ss_size, sulci_list, mode='suppress', bench_size=150,
              subjects_list=None, saving_dir=_DEFAULT_SAVING_DIR,
-             bbox_dir=_DEFAULT_BBOX_DIR):
+             bbox_dir=_DEFAULT_BBOX_DIR, manifest=None):
     """
     Generates a benchmark
 
@@ -251,12 +257,13 @@ def generate(b_num, side, ss_size, sulci_list, mode='suppress', bench_size=150,
         sulci_list: list of sulcus names
         mode: string giving the type of benchmark to create ('suppress', 'add'
               or 'mix')
+        manifest: manifest file written by manifest.py, or None
     """
     benchmark = Benchmark(b_num, side, ss_size, sulci_list, saving_dir,
                           bbox_dir=bbox_dir)
     abnormality_test = []
     givers = []
-    subjects_list = get_sub_list(subjects_list)
+    subjects_list = get_sub_list(subjects_list, manifest=manifest)
 
     for i, sub in enumerate(subjects_list):
         print(sub)
@@ -44,11 +44,19 @@ from __future__ import division
 from __future__ import print_function
 
 from benchmark_generation import *
+from soma import aims
+from deep_folding.anatomist_tools.utils.gather_cache import GatherMapCache
+from deep_folding.anatomist_tools.utils.normalize_crop import crop_volume
+from deep_folding.anatomist_tools.utils.normalize_crop import \
+    normalize_and_crop
 from deep_folding.anatomist_tools.utils.resample import resample
 from deep_folding.anatomist_tools.utils.sulcus_side import complete_sulci_name
+from deep_folding.anatomist_tools.utils.transform_store import TransformStore
+from deep_folding.anatomist_tools.utils.transform_store import write_trm
 
 import re
 import sys
+import tempfile
 import argparse
 import json
 
@@ -104,6 +112,27 @@ def parse_args(argv):
         "-j", "--subjects_list", type=str, default=_SUBJECT_LIST_DEFAULT,
         help="Subjects list from which create benchmark "
              "Default is : " + str(_SUBJECT_LIST_DEFAULT))
+    parser.add_argument(
+        "-g", "--manifest", type=str, default=None,
+        help="Manifest file written by manifest.py, used to check which "
+             "subjects exist. Default is : None")
+    parser.add_argument(
+        "-f", "--transform_store", type=str, default=None,
+        help="Transform store file written by transform.py. If given, "
+             "transformations are read from it instead of .trm files. "
+             "Default is : None")
+    parser.add_argument(
+        "-e", "--engine", type=str, default=_ENGINE_DEFAULT,
+        choices=('inprocess', 'external'),
+        help="inprocess: normalization and crop are done in memory; "
+             "external: AimsApplyTransform and AimsSubVolume command lines. "
+             "Default is : " + _ENGINE_DEFAULT)
+    parser.add_argument(
+        "-c", "--cache_dir", type=str, default=None,
+        help="With Bastien's resampling, directory where the resampling "
+             "index maps are cached: skeletons sharing a transformation "
+             "are resampled with the numpy method and the maps are reused. "
+             "Default is : None")
 
     args = parser.parse_args(argv)
     tgt_dir = args.tgt_dir  # src_dir is a string
@@ -115,8 +144,12 @@ def parse_args(argv):
     resampling = args.resampling
     bbox_dir = args.bbox_dir
     subjects_list = args.subjects_list
+    manifest = args.manifest
+    transform_store = args.transform_store
+    engine = args.engine
+    cache_dir = args.cache_dir
 
-    return tgt_dir, sulcus, side, ss_size, mode, bench_size, resampling, bbox_dir, subjects_list
+    return tgt_dir, sulcus, side, ss_size, mode, bench_size, resampling, bbox_dir, subjects_list, manifest, transform_store, engine, cache_dir
 
 
 _SS_SIZE_DEFAULT = 1000
@@ -128,9 +161,15 @@ _BENCH_SIZE = 150
 _RESAMPLING_DEFAULT = None
 _BBOX_DIR_DEFAULT = '/neurospin/dico/data/deep_folding/data/bbox'
 _SUBJECT_LIST_DEFAULT = None
+_ENGINE_DEFAULT = 'external'
 
 def main(argv):
-    tgt_dir, sulcus, side, ss_size, mode, bench_size, resampling, bbox_dir, subjects_list = parse_args(argv)
+    tgt_dir, sulcus, side, ss_size, mode, bench_size, resampling, bbox_dir, subjects_list, manifest, transform_store, engine, cache_dir = parse_args(argv)
+    # The transform store is opened once for all skeletons
+    store = TransformStore(transform_store) if transform_store else None
+    # Index maps are shared by the original and altered skeletons
+    cache = GatherMapCache(cache_dir) if cache_dir else None
+    resample_method = 'numpy' if cache else 'aims'
     sulcus = complete_sulci_name(sulcus, side)
     b_num = len(next(os.walk(tgt_dir))[1]) + 1
     tgt_dir = os.path.join(tgt_dir, 'benchmark'+str(b_num))
@@ -146,7 +185,7 @@ def main(argv):
     print('=================== Selection and possible alteration of benchmark skeletons ===================')
     generate(b_num, side, ss_size, sulci_list=sulcus, saving_dir=tgt_dir,
              mode=mode, bench_size=bench_size, subjects_list=subjects_list,
-             bbox_dir=bbox_dir)
+             bbox_dir=bbox_dir, manifest=manifest)
 
     bbox = compute_max_box(sulcus, side, src_dir=bbox_dir)
     print(bbox)
@@ -166,18 +205,7 @@ def main(argv):
             file_skeleton = tgt_dir + '/' + img
             file_cropped = tgt_dir + '/' + img[:-7] + "_normalized.nii.gz"
 
-            if resampling:
-                resample(file_skeleton, file_cropped, output_vs=(2, 2, 2),
-                         transformation=dir_m)
-            else:
-                cmd_normalize = "AimsApplyTransform -i " + tgt_dir +'/' + img + \
-                                " -o " + tgt_dir + '/' + img[:-7] + \
-                                "_normalized.nii.gz -m " + dir_m + " -r " + \
-                                dir_r + " -t nearest"
-                os.system(cmd_normalize)
-
-            # Crop of the images
-            file = os.path.join(tgt_dir, img[:-7] + '_normalized.nii.gz')
+            # Coordinates of the crop
             if mode == 'random':
                 # 42 instead of 0 in order to avoid crops with only black voxels
                 # Int 108 and 91 depend on downsampling and normalization
@@ -186,6 +214,8 @@ def main(argv):
                 random_z = random.randint(0, 91-box_size[2]-1)
                 print(random_x, random_y, random_z)
                 xmax, ymax, zmax = random_x + box_size[0], random_y + box_size[1], random_z + box_size[2]
+                crop_min = [random_x, random_y, random_z]
+                crop_max = [xmax, ymax, zmax]
                 cmd_bounding_box = ' -x ' + str(random_x) + ' -y ' + str(random_y) + \
                                    ' -z ' + str(random_z) + ' -X '+ str(xmax) + ' -Y ' + str(ymax) + ' -Z ' + str(zmax)
                 print(cmd_bounding_box)
@@ -196,18 +226,66 @@ def main(argv):
                     xmin, ymin, zmin = '52', '50', '12'
                     xmax, ymax, zmax = '74', '86', '47'
 
+                crop_min = [int(xmin), int(ymin), int(zmin)]
+                crop_max = [int(xmax), int(ymax), int(zmax)]
                 cmd_bounding_box = ' -x ' + xmin + ' -y ' + ymin + ' -z ' + zmin + ' -X '+ xmax + ' -Y ' + ymax + ' -Z ' + zmax
 
-            cmd_crop = "AimsSubVolume -i " + file + " -o " + file + cmd_bounding_box
-            os.system(cmd_crop)
+            file = os.path.join(tgt_dir, img[:-7] + '_normalized.nii.gz')
+            transformation = store.matrix(sub) if store else dir_m
+
+            if engine == 'inprocess':
+                # Normalization and crop in memory, only the crop is written
+                if resampling:
+                    resampled = resample(file_skeleton, None,
+                                         output_vs=(2, 2, 2),
+                                         transformation=transformation,
+                                         method=resample_method,
+                                         cache=cache)
+                    cropped = crop_volume(resampled, crop_min, crop_max)
+                else:
+                    cropped = normalize_and_crop(file_skeleton, None,
+                                                 transformation, dir_r,
+                                                 crop_min, crop_max,
+                                                 interp='nearest')
+                if mode == 'asymmetry':
+                    # Same as AimsFlip -m XX, done in place by swapping
+                    # mirrored x slabs of the numpy view
+                    arr = np.asarray(cropped)
+                    nx = arr.shape[0]
+                    for x in range(nx // 2):
+                        slab = arr[x].copy()
+                        arr[x] = arr[nx - 1 - x]
+                        arr[nx - 1 - x] = slab
+                aims.write(cropped, file_cropped)
+            else:
+                if resampling:
+                    resample(file_skeleton, file_cropped, output_vs=(2, 2, 2),
+                             transformation=transformation,
+                             method=resample_method, cache=cache)
+                else:
+                    if store:
+                        # AimsApplyTransform needs a file
+                        fd, dir_m = tempfile.mkstemp(suffix='.trm')
+                        os.close(fd)
+                        write_trm(dir_m, transformation)
+                    cmd_normalize = "AimsApplyTransform -i " + tgt_dir +'/' + img + \
+                                    " -o " + tgt_dir + '/' + img[:-7] + \
+                                    "_normalized.nii.gz -m " + dir_m + " -r " + \
+                                    dir_r + " -t nearest"
+                    os.system(cmd_normalize)
+                    if store:
+                        os.remove(dir_m)
+
+                # Crop of the images
+                cmd_crop = "AimsSubVolume -i " + file + " -o " + file + cmd_bounding_box
+                os.system(cmd_crop)
 
-            if mode == 'asymmetry':
-                print('ici')
-                cmd_flip = "AimsFlip -i " + file + " -o " + file + " -m XX"
-                os.system(cmd_flip)
+                if mode == 'asymmetry':
+                    cmd_flip = "AimsFlip -i " + file + " -o " + file + " -m XX"
+                    os.system(cmd_flip)
 
     input_dict = {'sulci_list': sulcus, 'simple_surface_min_size': ss_size,
-                  'side': side, 'mode': mode}
+                  'side': side, 'mode': mode, 'engine': engine}
     log_file = open(tgt_dir + "/logs.json", "a+")
     log_file.write(json.dumps(input_dict))
     log_file.close()
@@ -51,13 +51,24 @@ import glob
 import os
 from os.path import join
 import argparse
+import functools
 import six
 
 import numpy as np
 
-from soma import aims
+from deep_folding.anatomist_tools.manifest import DatasetManifest
+from deep_folding.anatomist_tools.manifest import supervised_patterns
+from deep_folding.anatomist_tools.utils.affine import apply_affine
+from deep_folding.anatomist_tools.utils.affine import bucket_to_array
+from deep_folding.anatomist_tools.utils.aims_io import read_header
+from deep_folding.anatomist_tools.utils.aims_io import read_template_transform
+from deep_folding.anatomist_tools.utils.bbox_cache import BoundingBoxCache
 from deep_folding.anatomist_tools.utils.logs import LogJson
+from deep_folding.anatomist_tools.utils.occupancy import OccupancyAccumulator
+from deep_folding.anatomist_tools.utils.parallel import parallel_map
 from deep_folding.anatomist_tools.utils.sulcus_side import complete_sulci_name
+from deep_folding.anatomist_tools.utils.voxel_store import SulcalVoxelStore
+from deep_folding.anatomist_tools.utils.voxel_store import store_file_name
 
 _ALL_SUBJECTS = -1
 
@@ -83,6 +94,28 @@ _IMAGE_NORMALIZED_SPM_DEFAULT = '/neurospin/hcp/' \
                         'ANALYSIS/3T_morphologist/100206/' \
                         't1mri/default_acquisition/normalized_SPM_100206.nii'
 
+# Number of worker processes reading the graphs (1 = serial run)
+_JOBS_DEFAULT = 1
+
+# Hemispheres processed when both sides are requested
+_BOTH_SIDES = ('L', 'R')
+
+# Vertex name that doesn't correspond to any sulcus
+_UNKNOWN_LABEL = 'unknown'
+
+# How boxes are computed from a graph:
+# 'voxel': from all bucket voxels transformed to Talairach space
+# 'vertex': union of per-vertex Tal_boundingbox_min/max attributes,
+#           falling back to 'voxel' when attributes are missing;
+#           these attributes are not the boxes of the bucket voxels
+#           and may differ from 'voxel' boxes by a few millimeters
+# 'verify': 'voxel' boxes, reporting disagreements with 'vertex' boxes
+_BBOX_MODES = ('voxel', 'vertex', 'verify')
+_BBOX_MODE_DEFAULT = 'voxel'
+
+# Coverage boxes are computed on the voxel occupancy or on subject boxes
+_COVERAGE_TYPE_DEFAULT = 'voxels'
+
 
 class BoundingBoxMax:
     """Determines the maximum Bounding Box around given sulci
@@ -96,50 +129,104 @@ class BoundingBoxMax:
                  sulcus=_SULCUS_DEFAULT,
                  side=_SIDE_DEFAULT,
                  image_normalized_spm=_IMAGE_NORMALIZED_SPM_DEFAULT,
-                 out_voxel_size=None):
+                 out_voxel_size=None,
+                 jobs=_JOBS_DEFAULT,
+                 cache_file=None,
+                 bbox_mode=_BBOX_MODE_DEFAULT,
+                 store_dir=None,
+                 coverage=None,
+                 coverage_type=_COVERAGE_TYPE_DEFAULT,
+                 manifest=None):
         """Inits with list of directories and list of sulci
 
         Args:
             src_dir: list of strings naming ful path source directories
             path_to_graph: list of strings naming relative path to labelle graph
             tgt_dir: name of target directory with full path
-            sulcus: sulcus name
+            sulcus: sulcus name; if None, no json file is created at init
+                and boxes are computed with compute_bounding_boxes
             side: hemisphere side (either L for left, or R for right hemisphere)
             image_normalized_spm: string giving file name (with path) of
                 normalized SPM file out of which is extracted the voxel size
+            out_voxel_size: voxel size of the output bounding box
+            jobs: number of worker processes reading the graphs
+            cache_file: json file keeping per-subject boxes between runs;
+                if None, no cache is used
+            bbox_mode: 'voxel', 'vertex' or 'verify' (see _BBOX_MODES)
+            store_dir: directory of voxel stores written by extract_voxels.py;
+                if given, boxes are computed from the stores instead of
+                the graphs (bbox_mode 'voxel' only). Graphs modified
+                since the extraction are read again
+            coverage: if given (for example 0.99), boxes covering this
+                fraction of the voxels or of the subjects are also written
+            coverage_type: 'voxels' or 'subjects'
+            manifest: list of manifest files written by manifest.py,
+                in the same order as src_dir; if given, subjects and
+                graphs are read from the manifests instead of the tree,
+                unless they recorded another path_to_graph
         """
 
         # Transforms input source dir to a list of strings
         self.src_dir = [src_dir] if isinstance(src_dir, str) else src_dir
+        manifest = [manifest] if isinstance(manifest, str) else manifest
+        self.manifest = ([DatasetManifest(m) for m in manifest]
+                         if manifest else None)
 
         # manually labelled graph file relative to the subject directory
         # we use the '*' glob to take into account different naming conventions
         # It must be put in the same order as src_dir
         path_to_graph = ([path_to_graph] if isinstance(path_to_graph, str)
                          else path_to_graph)
+        self.path_to_graph = path_to_graph
         self.graph_file = []
         for path in path_to_graph:
             self.graph_file.append('%(subject)s/' \
                               + path \
                               + '/%(side)s%(subject)s*.arg')
 
-        self.sulcus = sulcus
         self.tgt_dir = tgt_dir
         self.side = side
-        self.sulcus = complete_sulci_name(sulcus, side)
+        self.sulcus = complete_sulci_name(sulcus, side) if sulcus else None
         self.image_normalized_spm = image_normalized_spm
         self.out_voxel_size = out_voxel_size
+        self.jobs = jobs
+        if bbox_mode not in _BBOX_MODES:
+            raise ValueError("bbox_mode must be one of " + str(_BBOX_MODES))
+        if store_dir and bbox_mode != 'voxel':
+            raise ValueError("boxes of the voxel stores are computed "
+                             "from voxels: bbox_mode must be 'voxel'")
+        self.bbox_mode = bbox_mode
+        self.store_dir = store_dir
+        self.coverage = coverage
+        self.coverage_type = coverage_type
+        self.cache = BoundingBoxCache(cache_file) if cache_file else None
+
+        if self.sulcus:
+            self.json = self.create_json(self.sulcus)
+
+    def create_json(self, sulcus):
+        """Creates the json log file of one sulcus
+
+        Json full name is the name of the sulcus + .json
+        and is kept under the subdirectory Left or Right
 
+        Args:
+            sulcus: complete sulcus name (side included)
 
-        # Json full name is the name of the sulcus + .json
-        # and is kept under the subdirectory Left or Right
-        json_file = join(self.tgt_dir, self.side, self.sulcus + '.json')
-        self.json = LogJson(json_file)
+        Returns:
+            json: LogJson object
+        """
+        json_file = join(self.tgt_dir, self.side, sulcus + '.json')
+        return LogJson(json_file)
 
     def list_all_subjects(self):
         """List all subjects from the clean database (directory src_dir).
 
         Subjects are the names of the subdirectories of the root directory.
+        If manifests are given, subjects having a graph of the hemisphere
+        are read from them. A manifest whose graphs have not been recorded
+        with the same path_to_graph is not used: the subjects of its source
+        directory are then listed from the directory.
 
         Parameters:
 
@@ -148,10 +235,31 @@ class BoundingBoxMax:
         """
 
         subjects = []
+        manifests = self.manifest or [None] * len(self.src_dir)
+        key = self.side + 'graph'
 
         # Main loop: list all subjects of the directories
         # listed in self.src_dir
-        for src_dir, graph_file in zip(self.src_dir, self.graph_file):
+        for src_dir, manifest, path, graph_file in zip(self.src_dir,
+                                                       manifests,
+                                                       self.path_to_graph,
+                                                       self.graph_file):
+            if manifest is not None:
+                pattern = supervised_patterns(path)[key]
+                if os.path.normpath(manifest.patterns.get(key, '')) \
+                        == os.path.normpath(pattern):
+                    for subject in manifest.subjects_with(key):
+                        if subject != 'ra':
+                            subject_d = {'subject': subject,
+                                         'side': self.side,
+                                         'dir': src_dir,
+                                         'graph_file': graph_file,
+                                         'graph': manifest.path(subject, key)}
+                            subjects.append(subject_d)
+                    continue
+                print("manifest " + manifest.manifest_file
+                      + " has not recorded the graphs of " + path
+                      + ": subjects are listed from " + src_dir)
             for filename in os.listdir(src_dir):
                 directory = os.path.join(src_dir, filename)
                 if os.path.isdir(directory):
@@ -165,64 +273,457 @@ class BoundingBoxMax:
 
         return subjects
 
-    def get_one_bounding_box(self, graph_filename):
-        """get bounding box of the chosen sulcus for one data graph
+    def get_sulci_bounding_boxes(self, graph_filename, sulci=None):
+        """get bounding boxes of several sulci for one data graph
 
-      Function that outputs the bounding box for the listed sulci
-      for this datagraph. The bounding box is the smallest rectangular box
-      that encompasses the chosen sulcus.
-      It is given in the AIMS Talairch referential, different from the MNI
-      Talairach referential.
+      The graph is read once and the boxes of all requested sulci
+      are collected in the same pass over its vertices.
+      Boxes are given in the AIMS Talairach referential, different from
+      the MNI Talairach referential.
+
+      If a store directory is given, the boxes are computed from the voxel
+      store of the graph, without reading the graph nor importing soma.aims,
+      unless the store is missing or older than the graph.
 
       Parameters:
         graph_filename: string being the name of graph file .arg to analyze:
                         for example: 'Lammon_base2018_manual.arg'
+        sulci: list of complete sulci names; if None, all labels
+               found in the graph (except 'unknown') are kept
 
       Returns:
-        bbox_min: numpy array giving the upper right vertex coordinates
-                of the box in the Talairach space
-        bbox_max: numpy array fiving the lower left vertex coordinates
-                of the box in the Talairach space
+        boxes: dictionary whose keys are sulci names and whose values are
+               tuples (bbox_min, bbox_max) of numpy arrays in the
+               Talairach space. Sulci absent from the graph are not keys.
+      """
+
+        store = self.read_store(graph_filename)
+        if store is not None:
+            return store.bounding_boxes(sulci)
+
+        from soma import aims
+
+        graph = aims.read(graph_filename)
+        return self.get_graph_boxes(graph, graph_filename, sulci)
+
+    def read_store(self, graph_filename):
+        """Returns the voxel store of a graph, if it can be used
+
+      Parameters:
+        graph_filename: string being the name of graph file .arg
+
+      Returns:
+        store: SulcalVoxelStore, or None if no store directory is given,
+            or if the store is missing or older than the graph
+      """
+        if not self.store_dir:
+            return None
+        store_file = store_file_name(self.store_dir, graph_filename)
+        if os.path.isfile(store_file):
+            store = SulcalVoxelStore(store_file)
+            if store.is_up_to_date(graph_filename):
+                return store
+        print("Voxel store of " + graph_filename
+              + " missing or not up-to-date: the graph is read")
+        return None
+
+    def get_graph_boxes(self, graph, graph_filename, sulci=None):
+        """get bounding boxes of several sulci for one graph already read
+
+      Boxes are computed as given by bbox_mode.
+
+      Parameters:
+        graph: aims graph already read
+        graph_filename: string being the name of graph file .arg
+        sulci: list of complete sulci names; if None, all labels
+
+      Returns:
+        boxes: dictionary as returned by get_sulci_bounding_boxes
+      """
+        if self.bbox_mode == 'voxel':
+            return self.get_graph_voxel_boxes(graph, sulci)
+
+        vertex_boxes = self.get_graph_vertex_boxes(graph, sulci)
+        if vertex_boxes is None:
+            print("Tal_boundingbox attributes missing in " + graph_filename
+                  + ": boxes are computed from voxels")
+            return self.get_graph_voxel_boxes(graph, sulci)
+
+        if self.bbox_mode == 'verify':
+            voxel_boxes = self.get_graph_voxel_boxes(graph, sulci)
+            for sulcus, max_diff in self.compare_boxes(voxel_boxes,
+                                                       vertex_boxes):
+                print("Disagreement between voxel and vertex boxes in "
+                      + graph_filename + " for " + sulcus
+                      + ": max difference = " + str(max_diff))
+            return voxel_boxes
+
+        return vertex_boxes
+
+    @staticmethod
+    def get_graph_vertex_boxes(graph, sulci=None):
+        """get bounding boxes of sulci from per-vertex Talairach boxes
+
+      Each vertex of a graph carries the attributes Tal_boundingbox_min
+      and Tal_boundingbox_max; the box of a sulcus is the union of the
+      boxes of its vertices. This costs O(vertices) instead of O(voxels).
+
+      Parameters:
+        graph: aims graph already read
+        sulci: list of complete sulci names; if None, all labels
+
+      Returns:
+        boxes: same dictionary as get_sulci_bounding_boxes, or None if
+               one of the vertices misses the Tal_boundingbox attributes
+      """
+        boxes = {}
+        for vertex in graph.vertices():
+            vname = vertex.get('name')
+            if vname is None or vname == _UNKNOWN_LABEL:
+                continue
+            if sulci is not None and vname not in sulci:
+                continue
+            vertex_min = vertex.get('Tal_boundingbox_min')
+            vertex_max = vertex.get('Tal_boundingbox_max')
+            if vertex_min is None or vertex_max is None:
+                return None
+            vertex_min = np.array(vertex_min, dtype=np.float64)[:3]
+            vertex_max = np.array(vertex_max, dtype=np.float64)[:3]
+            if vname not in boxes:
+                boxes[vname] = (vertex_min, vertex_max)
+            else:
+                bbox_min, bbox_max = boxes[vname]
+                boxes[vname] = (np.minimum(bbox_min, vertex_min),
+                                np.maximum(bbox_max, vertex_max))
+        return boxes
+
+    @staticmethod
+    def compare_boxes(boxes_ref, boxes_test):
+        """Lists sulci whose boxes differ between two box dictionaries
+
+      Parameters:
+        boxes_ref: dictionary of reference boxes (bbox_min, bbox_max)
+        boxes_test: dictionary of boxes to compare
+
+      Returns:
+        disagreements: list of tuples (sulcus, max absolute difference);
+            the difference is inf if the sulcus is absent from one of them
+      """
+        disagreements = []
+        for sulcus in sorted(set(boxes_ref) | set(boxes_test)):
+            if sulcus not in boxes_ref or sulcus not in boxes_test:
+                disagreements.append((sulcus, np.inf))
+                continue
+            max_diff = max(
+                np.max(np.abs(boxes_ref[sulcus][0] - boxes_test[sulcus][0])),
+                np.max(np.abs(boxes_ref[sulcus][1] - boxes_test[sulcus][1])))
+            if max_diff > 0:
+                disagreements.append((sulcus, max_diff))
+        return disagreements
+
+    @staticmethod
+    def get_graph_voxel_boxes(graph, sulci=None):
+        """get bounding boxes of sulci from the voxels of their buckets
+
+      Parameters:
+        graph: aims graph already read
+        sulci: list of complete sulci names; if None, all labels
+
+      Returns:
+        boxes: same dictionary as get_sulci_bounding_boxes
       """
 
-        # Reads the data graph and transforms it to AIMS Talairach referential
+        # Transforms the graph to AIMS Talairach referential
         # Note that this is NOT the MNI Talairach referential
         # This is the Talairach referential used in AIMS
         # There are several Talairach referentials
-        graph = aims.read(graph_filename)
-        voxel_size = graph['voxel_size'][:3]
+        from soma import aims
+
+        voxel_size = np.array(graph['voxel_size'][:3])
         tal_transfo = aims.GraphManip.talairach(graph)
-        bbox_min = None
-        bbox_max = None
+        tal_matrix = tal_transfo.toMatrix()
+        boxes = {}
 
         # Gets the min and max coordinates of the sulci
         # by looping over all the vertices of the graph
+        # Each bucket is transformed at once as a (N,3) array
         for vertex in graph.vertices():
             vname = vertex.get('name')
-            if vname != self.sulcus:
+            if vname is None or vname == _UNKNOWN_LABEL:
+                continue
+            if sulci is not None and vname not in sulci:
                 continue
             for bucket_name in ('aims_ss', 'aims_bottom', 'aims_other'):
                 bucket = vertex.get(bucket_name)
                 if bucket is not None:
-                    voxels = np.asarray(
-                        [tal_transfo.transform(np.array(voxel) * voxel_size)
-                         for voxel in bucket[0].keys()])
-
-                    if voxels.shape == (0,):
+                    voxels = bucket_to_array(bucket)
+                    if voxels.shape[0] == 0:
                         continue
-                    bbox_min = np.min(np.vstack(
-                        ([bbox_min] if bbox_min is not None else [])
-                        + [voxels]), axis=0)
-                    bbox_max = np.max(np.vstack(
-                        ([bbox_max] if bbox_max is not None else [])
-                        + [voxels]), axis=0)
+                    voxels = apply_affine(tal_matrix, voxels * voxel_size)
+
+                    # Updates running min and max without re-stacking
+                    if vname not in boxes:
+                        boxes[vname] = (np.min(voxels, axis=0),
+                                        np.max(voxels, axis=0))
+                    else:
+                        bbox_min, bbox_max = boxes[vname]
+                        boxes[vname] = (
+                            np.minimum(bbox_min, np.min(voxels, axis=0)),
+                            np.maximum(bbox_max, np.max(voxels, axis=0)))
+
+        return boxes
+
+    @staticmethod
+    def get_graph_label_voxels(graph, sulci=None):
+        """get the voxels of the buckets of each label of a graph
+
+      Parameters:
+        graph: aims graph already read
+        sulci: list of complete sulci names; if None, all labels
+
+      Returns:
+        label_voxels: dictionary whose keys are label names and whose values
+            are (N,3) arrays of voxel coordinates (all buckets concatenated)
+      """
+        label_voxels = {}
+        for vertex in graph.vertices():
+            vname = vertex.get('name')
+            if vname is None or vname == _UNKNOWN_LABEL:
+                continue
+            if sulci is not None and vname not in sulci:
+                continue
+            for bucket_name in ('aims_ss', 'aims_bottom', 'aims_other'):
+                bucket = vertex.get(bucket_name)
+                if bucket is not None:
+                    label_voxels.setdefault(vname, []).append(
+                        bucket_to_array(bucket))
+
+        return {label: np.vstack(voxels)
+                for label, voxels in label_voxels.items()}
+
+    def get_sulci_boxes_and_voxels(self, graph_filename, sulci=None):
+        """get the boxes and the voxels of sulci for one data graph
+
+      The graph (or its voxel store) is read once and gives both the boxes,
+      as get_sulci_bounding_boxes, and the voxels of the sulci in the AIMS
+      Talairach space (mm).
+
+      Parameters:
+        graph_filename: string being the name of graph file .arg
+        sulci: list of complete sulci names; if None, all labels
+               found in the graph (except 'unknown') are kept
+
+      Returns:
+        boxes: dictionary as returned by get_sulci_bounding_boxes
+        tal_voxels: dictionary whose keys are sulci names and whose values
+            are (N,3) arrays of Talairach coordinates
+      """
+        store = self.read_store(graph_filename)
+        if store is not None:
+            labels = store.labels if sulci is None \
+                else [sulcus for sulcus in sulci if sulcus in store.labels]
+            return (store.bounding_boxes(sulci),
+                    {sulcus: store.talairach_voxels(sulcus)
+                     for sulcus in labels})
+
+        from soma import aims
+
+        graph = aims.read(graph_filename)
+        voxel_size = np.array(graph['voxel_size'][:3])
+        tal_matrix = aims.GraphManip.talairach(graph).toMatrix()
+        label_voxels = self.get_graph_label_voxels(graph, sulci)
+        return (self.get_graph_boxes(graph, graph_filename, sulci),
+                {sulcus: apply_affine(tal_matrix, voxels * voxel_size)
+                 for sulcus, voxels in label_voxels.items()})
+
+    @staticmethod
+    def add_occupancy(accumulators, tal_voxels, tal_to_normalized_spm,
+                      voxel_size):
+        """Adds the voxels of one subject to the occupancy accumulators
+
+      Parameters:
+        accumulators: dictionary whose keys are sulci names and whose
+            values are OccupancyAccumulator; accumulators of new sulci
+            are created
+        tal_voxels: dictionary whose keys are sulci names and whose values
+            are (N,3) arrays of Talairach coordinates
+        tal_to_normalized_spm: transformation from Talairach space
+                to normalized SPM
+        voxel_size: voxel size (in MNI referential or HCP normalized SPM space)
+      """
+        matrix = tal_to_normalized_spm.toMatrix()
+        voxel_size = np.asarray(voxel_size, dtype=np.float64)
+        for sulcus, voxels in tal_voxels.items():
+            voxels_mni = apply_affine(matrix, voxels)
+            accumulators.setdefault(sulcus, OccupancyAccumulator()).add(
+                np.round(voxels_mni / voxel_size).astype(int))
+
+    def coverage_boxes(self, accumulators):
+        """Returns the boxes covering a fraction of the sulci occupancy
+
+      Parameters:
+        accumulators: dictionary whose keys are sulci names and whose
+            values are OccupancyAccumulator
+
+      Returns:
+        coverage_boxes: dictionary whose keys are sulci names and whose values
+            are tuples (bbmin_vox, bbmax_vox); sulci without any voxel
+            are not keys
+      """
+        return {sulcus: acc.coverage_box(self.coverage, self.coverage_type)
+                for sulcus, acc in accumulators.items()
+                if acc.nb_subjects > 0}
+
+    def coverage_dict(self, coverage_box):
+        """Returns the coverage box entries to write to json
+
+        Args:
+            coverage_box: tuple (bbmin_vox, bbmax_vox)
+        """
+        return {'coverage': self.coverage,
+                'coverage_type': self.coverage_type,
+                'bbmin_voxel_coverage': coverage_box[0].tolist(),
+                'bbmax_voxel_coverage': coverage_box[1].tolist()}
+
+    def get_one_bounding_box(self, graph_filename):
+        """get bounding box of the chosen sulcus for one data graph
+
+      Function that outputs the bounding box for the listed sulci
+      for this datagraph. The bounding box is the smallest rectangular box
+      that encompasses the chosen sulcus.
+      It is given in the AIMS Talairch referential, different from the MNI
+      Talairach referential.
+
+      Parameters:
+        graph_filename: string being the name of graph file .arg to analyze:
+                        for example: 'Lammon_base2018_manual.arg'
+
+      Returns:
+        bbox_min: numpy array giving the upper right vertex coordinates
+                of the box in the Talairach space
+        bbox_max: numpy array fiving the lower left vertex coordinates
+                of the box in the Talairach space
+      """
+
+        boxes = self.get_sulci_bounding_boxes(graph_filename, [self.sulcus])
+        bbox_min, bbox_max = boxes.get(self.sulcus, (None, None))
 
         print('box (AIMS Talairach) min:', bbox_min)
         print('box (AIMS Talairach) max:', bbox_max)
 
         return bbox_min, bbox_max
 
-    def get_bounding_boxes(self, subjects):
+    def get_graph_filenames(self, subjects):
+        """Returns the graph file name of each subject
+
+      Parameters:
+        subjects: list containing all subjects to be analyzed
+
+      Returns:
+        graph_filenames: list of graph file names, in the order of subjects
+      """
+
+        graph_filenames = []
+
+        for sub in subjects:
+            print(sub)
+            if 'graph' in sub:
+                # Graph file name comes from the manifest
+                graph_filenames.append(sub['graph'])
+                continue
+            # Its substitutes 'subject' in graph_file name
+            graph_file = sub['graph_file'] % sub
+            # It looks for a graph file .arg
+            sulci_pattern = glob.glob(join(sub['dir'], graph_file))[0]
+            graph_filenames.append(sulci_pattern % sub)
+
+        return graph_filenames
+
+    def get_subjects_boxes(self, graph_filenames, sulci=None,
+                           accumulators=None, tal_to_normalized_spm=None,
+                           voxel_size=None):
+        """Returns the boxes of the sulci for each graph
+
+      Graphs are read in worker processes if jobs > 1, and results
+      are given in the order of graph_filenames.
+      If a cache is used, only graphs that are new or modified since
+      the last run are read; the boxes of all their labels are then stored
+      in the cache.
+
+      If occupancy accumulators are given, the voxels of the sulci are
+      added to them in the same pass: graphs are then read by chunks of
+      jobs graphs, whose voxels are discarded once added. As the cache
+      only keeps boxes, all graphs are read in this case, once each.
+
+      Parameters:
+        graph_filenames: list of graph file names
+        sulci: list of complete sulci names; if None, all labels
+        accumulators: dictionary whose keys are sulci names and whose
+            values are OccupancyAccumulator, filled in place; None if
+            occupancy is not computed
+        tal_to_normalized_spm: transformation from Talairach space
+                to normalized SPM (needed with accumulators)
+        voxel_size: voxel size of the normalized SPM space
+                (needed with accumulators)
+
+      Returns:
+        subject_boxes: list of dictionaries as returned by
+            get_sulci_bounding_boxes, one per graph
+      """
+
+        # With a cache, boxes of all labels are computed, to be stored
+        read_sulci = sulci if self.cache is None else None
+
+        if accumulators is not None:
+            subject_boxes = []
+            chunk_size = max(self.jobs, 1)
+            for start in range(0, len(graph_filenames), chunk_size):
+                chunk = graph_filenames[start:start + chunk_size]
+                results = parallel_map(
+                    functools.partial(self.get_sulci_boxes_and_voxels,
+                                      sulci=read_sulci),
+                    chunk, jobs=self.jobs)
+                for graph_filename, (boxes, tal_voxels) in zip(chunk,
+                                                              results):
+                    if sulci is not None:
+                        tal_voxels = {sulcus: voxels for sulcus, voxels
+                                      in tal_voxels.items()
+                                      if sulcus in sulci}
+                    self.add_occupancy(accumulators, tal_voxels,
+                                       tal_to_normalized_spm, voxel_size)
+                    if self.cache is not None:
+                        self.cache.set(graph_filename, boxes, self.bbox_mode)
+                    subject_boxes.append(boxes)
+            if self.cache is not None and graph_filenames:
+                self.cache.save()
+        elif self.cache is None:
+            return parallel_map(
+                functools.partial(self.get_sulci_bounding_boxes, sulci=sulci),
+                graph_filenames, jobs=self.jobs)
+        else:
+            # Reads only graphs that are not up-to-date in the cache
+            missing = [graph_filename for graph_filename in graph_filenames
+                       if self.cache.get(graph_filename,
+                                         self.bbox_mode) is None]
+            print("Number of graphs to read (not in cache): ", len(missing))
+            new_boxes = parallel_map(
+                functools.partial(self.get_sulci_bounding_boxes, sulci=None),
+                missing, jobs=self.jobs)
+            for graph_filename, boxes in zip(missing, new_boxes):
+                self.cache.set(graph_filename, boxes, self.bbox_mode)
+            if missing:
+                self.cache.save()
+            subject_boxes = [self.cache.get(graph_filename, self.bbox_mode)
+                             for graph_filename in graph_filenames]
+
+        if sulci is not None:
+            subject_boxes = [{sulcus: box for sulcus, box in boxes.items()
+                              if sulcus in sulci}
+                             for boxes in subject_boxes]
+        return subject_boxes
+
+    def get_bounding_boxes(self, subjects, accumulators=None,
+                           tal_to_normalized_spm=None, voxel_size=None):
         """get bounding boxes of the chosen sulcus for all subjects
 
       Function that outputs the bounding box for the listed sulci on a manually
@@ -235,6 +736,8 @@ class BoundingBoxMax:
 
       Parameters:
         subjects: list containing all subjects to be analyzed
+        accumulators, tal_to_normalized_spm, voxel_size: occupancy
+            accumulators filled in the same pass (see get_subjects_boxes)
 
       Returns:
         list_bbmin: list containing the upper right vertex of the box
@@ -246,16 +749,19 @@ class BoundingBoxMax:
         # Initialization
         list_bbmin = []
         list_bbmax = []
-
-        for sub in subjects:
-            print(sub)
-            # Its substitutes 'subject' in graph_file name
-            graph_file = sub['graph_file'] % sub
-            # It looks for a graph file .arg
-            sulci_pattern = glob.glob(join(sub['dir'], graph_file))[0]
-
-            bbox_min, bbox_max = self.get_one_bounding_box(sulci_pattern % sub)
-
+        graph_filenames = self.get_graph_filenames(subjects)
+
+        # Graphs are read in worker processes if jobs > 1;
+        # boxes come back in the order of subjects
+        subject_boxes = self.get_subjects_boxes(
+            graph_filenames, [self.sulcus], accumulators=accumulators,
+            tal_to_normalized_spm=tal_to_normalized_spm,
+            voxel_size=voxel_size)
+
+        for boxes in subject_boxes:
+            bbox_min, bbox_max = boxes.get(self.sulcus, (None, None))
+            print('box (AIMS Talairach) min:', bbox_min)
+            print('box (AIMS Talairach) max:', bbox_max)
             list_bbmin.append([bbox_min[0], bbox_min[1], bbox_min[2]])
             list_bbmax.append([bbox_max[0], bbox_max[1], bbox_max[2]])
 
@@ -307,20 +813,16 @@ class BoundingBoxMax:
         # Transforms from AIMS Talairach to the true MNI space with the origin
         # at the center
         # It is in /casa/install/share/brainvisa-share-5.0/transformation
-        tal_to_spm_template = aims.read(
-            aims.carto.Paths.findResourceFile(
-                'transformation/talairach_TO_spm_template_novoxels.trm'))
-
-        # Gets a normalized SPM file from the morphologist analysis
-        image_normalized_spm = aims.read(self.image_normalized_spm)
+        # Template transformations are read once per process
+        tal_to_spm_template = read_template_transform(
+            'transformation/talairach_TO_spm_template_novoxels.trm')
 
         # Tranformation from the normalized SPM
         # to the template SPM
         # normalized_spm_to_spm_template = aims.AffineTransformation3d(
         #    image_normalized_spm.header()['transformations'][-1])
-        normalized_spm_to_spm_template = aims.read(
-            aims.carto.Paths.findResourceFile(
-                'transformation/spm_template_TO_spm_template_novoxels.trm'))
+        normalized_spm_to_spm_template = read_template_transform(
+            'transformation/spm_template_TO_spm_template_novoxels.trm')
 
         # Tranformation from the Talairach space to the native space
         tal_to_normalized_spm = normalized_spm_to_spm_template.inverse() \
@@ -328,7 +830,10 @@ class BoundingBoxMax:
         if self.out_voxel_size:
             voxel_size = self.out_voxel_size
         else:
-            voxel_size = image_normalized_spm.header()['voxel_size'][:3]
+            # Gets a normalized SPM file from the morphologist analysis
+            # Only its header is read to get the voxel size
+            header_normalized_spm = read_header(self.image_normalized_spm)
+            voxel_size = header_normalized_spm['voxel_size'][:3]
 
         return tal_to_normalized_spm, voxel_size
 
@@ -373,39 +878,30 @@ class BoundingBoxMax:
         """
 
         if number_subjects:
-            subjects = self.list_all_subjects()
-
             self.json.write_general_info()
 
-            # Gives the possibility to list only the first number_subjects
-            subjects = (
-                subjects
-                if number_subjects == _ALL_SUBJECTS
-                else subjects[:number_subjects])
-
-            # Creates target dir if it doesn't exist
-            if not os.path.exists(self.tgt_dir):
-                os.mkdir(self.tgt_dir)
+            subjects = self.select_subjects(number_subjects)
 
             # Writes number of subjects and directory names to json file
-            dict_to_add = {'nb_subjects': len(subjects),
-                           'src_dir': self.src_dir,
-                           'tgt_dir': self.tgt_dir,
-                           'out_voxel_size': 1 if self.out_voxel_size is None else self.out_voxel_size}
-            self.json.update(dict_to_add=dict_to_add)
+            self.json.update(dict_to_add=self.general_dict(len(subjects)))
+
+            # Computes the transform from the AIMS Talairach space
+            # to normalized SPM space
+            tal_to_normalized_spm, voxel_size = self.tal_to_normalized_spm()
 
             # Determines the box encompassing the sulcus for all subjects
             # The coordinates are determined in AIMS Talairach space
-            list_bbmin, list_bbmax = self.get_bounding_boxes(subjects)
+            # The sulcus occupancy is accumulated in the same pass
+            accumulators = {} if self.coverage else None
+            list_bbmin, list_bbmax = self.get_bounding_boxes(
+                subjects, accumulators=accumulators,
+                tal_to_normalized_spm=tal_to_normalized_spm,
+                voxel_size=voxel_size)
             bbmin_tal, bbmax_tal = self.compute_max_box(list_bbmin, list_bbmax)
 
             dict_to_add = {'bbmin_AIMS_Talairach': bbmin_tal.tolist(),
                            'bbmax_AIMS_Talairach': bbmax_tal.tolist()}
 
-            # Computes the transform from the AIMS Talairach space
-            # to normalized SPM space
-            tal_to_normalized_spm, voxel_size = self.tal_to_normalized_spm()
-
             # Determines the box encompassing the sulcus for all subjects
             # The coordinates are determined in voxels in MNI space
             bbmin_vox, bbmax_vox = self.compute_box_voxel(bbmin_tal,
@@ -417,6 +913,16 @@ class BoundingBoxMax:
                                 'sulcus': self.sulcus,
                                 'bbmin_voxel': bbmin_vox.tolist(),
                                 'bbmax_voxel': bbmax_vox.tolist()})
+
+            # Determines the box covering a fraction of the sulcus occupancy
+            if self.coverage:
+                coverage_boxes = self.coverage_boxes(accumulators)
+                if self.sulcus in coverage_boxes:
+                    dict_to_add.update(
+                        self.coverage_dict(coverage_boxes[self.sulcus]))
+                else:
+                    print("No voxel of sulcus " + self.sulcus
+                          + ": no coverage box")
             self.json.update(dict_to_add=dict_to_add)
             print("box (voxel): min = ", bbmin_vox)
             print("box (voxel): max = ", bbmax_vox)
@@ -426,13 +932,129 @@ class BoundingBoxMax:
 
         return bbmin_vox, bbmax_vox
 
+    def select_subjects(self, number_subjects):
+        """Lists subjects to analyze and creates the target directory
+
+        Args:
+            number_subjects: number_subjects to analyze
+
+        Returns:
+            subjects: a list containing the subjects to be analyzed
+        """
+        subjects = self.list_all_subjects()
+
+        # Gives the possibility to list only the first number_subjects
+        subjects = (
+            subjects
+            if number_subjects == _ALL_SUBJECTS
+            else subjects[:number_subjects])
+
+        # Creates target dir if it doesn't exist
+        if not os.path.exists(self.tgt_dir):
+            os.mkdir(self.tgt_dir)
+
+        return subjects
+
+    def general_dict(self, nb_subjects):
+        """Returns number of subjects and directory names to write to json
+
+        Args:
+            nb_subjects: number of subjects used to compute the box
+        """
+        return {'nb_subjects': nb_subjects,
+                'src_dir': self.src_dir,
+                'tgt_dir': self.tgt_dir,
+                'out_voxel_size': 1 if self.out_voxel_size is None
+                else self.out_voxel_size}
+
+    def compute_bounding_boxes(self, sulci=None,
+                               number_subjects=_ALL_SUBJECTS):
+        """Computes the bounding boxes of several sulci in a single pass
+
+        Each subject graph is read only once, whatever the number of sulci.
+        One json file per sulcus is written at the end, with the same content
+        as the one written by compute_bounding_box.
+        Subjects in which a sulcus is absent are not taken into account
+        for this sulcus.
+
+        Args:
+            sulci: list of sulci names; if None, all labels of the graphs
+            number_subjects: number_subjects to analyze
+
+        Returns:
+            boxes_vox: dictionary whose keys are sulci names and whose values
+                are tuples (bbmin_vox, bbmax_vox)
+        """
+
+        boxes_vox = {}
+        if not number_subjects:
+            return boxes_vox
+
+        if sulci is not None:
+            sulci = complete_sulci_name(list(sulci), self.side)
+
+        subjects = self.select_subjects(number_subjects)
+
+        # Each graph is read once and gives the boxes of all sulci,
+        # and their occupancy if coverage boxes are computed
+        tal_to_normalized_spm, voxel_size = self.tal_to_normalized_spm()
+        accumulators = {} if self.coverage else None
+        graph_filenames = self.get_graph_filenames(subjects)
+        subject_boxes = self.get_subjects_boxes(
+            graph_filenames, sulci, accumulators=accumulators,
+            tal_to_normalized_spm=tal_to_normalized_spm,
+            voxel_size=voxel_size)
+        coverage_boxes = self.coverage_boxes(accumulators) \
+            if self.coverage else {}
+
+        # Gathers boxes sulcus by sulcus, keeping the subject order
+        all_sulci = sorted(set().union(*subject_boxes)) if sulci is None \
+            else sulci
+
+        for sulcus in all_sulci:
+            list_bbmin = [boxes[sulcus][0].tolist()
+                          for boxes in subject_boxes if sulcus in boxes]
+            list_bbmax = [boxes[sulcus][1].tolist()
+                          for boxes in subject_boxes if sulcus in boxes]
+            if not list_bbmin:
+                print("sulcus " + sulcus + " not found in any subject")
+                continue
+            bbmin_tal, bbmax_tal = self.compute_max_box(list_bbmin,
+                                                        list_bbmax)
+            bbmin_vox, bbmax_vox = self.compute_box_voxel(bbmin_tal,
+                                                          bbmax_tal,
+                                                          tal_to_normalized_spm,
+                                                          voxel_size)
+
+            sulcus_json = self.create_json(sulcus)
+            sulcus_json.write_general_info()
+            sulcus_json.update(dict_to_add=self.general_dict(len(list_bbmin)))
+            sulcus_json.update(dict_to_add={
+                'bbmin_AIMS_Talairach': bbmin_tal.tolist(),
+                'bbmax_AIMS_Talairach': bbmax_tal.tolist(),
+                'side': self.side,
+                'sulcus': sulcus,
+                'bbmin_voxel': bbmin_vox.tolist(),
+                'bbmax_voxel': bbmax_vox.tolist()})
+            if sulcus in coverage_boxes:
+                sulcus_json.update(
+                    dict_to_add=self.coverage_dict(coverage_boxes[sulcus]))
+            print(sulcus, "box (voxel): min = ", bbmin_vox,
+                  "max = ", bbmax_vox)
+            boxes_vox[sulcus] = (bbmin_vox, bbmax_vox)
+
+        return boxes_vox
+
 
 def bounding_box(src_dir=_SRC_DIR_DEFAULT, tgt_dir=_TGT_DIR_DEFAULT,
                  path_to_graph=_PATH_TO_GRAPH_DEFAULT,
                  sulcus=_SULCUS_DEFAULT, side=_SIDE_DEFAULT,
                  number_subjects=_ALL_SUBJECTS,
                  image_normalized_spm=_IMAGE_NORMALIZED_SPM_DEFAULT,
-                 out_voxel_size=None):
+                 out_voxel_size=None, jobs=_JOBS_DEFAULT, cache_file=None,
+                 bbox_mode=_BBOX_MODE_DEFAULT, store_dir=None,
+                 coverage=None, coverage_type=_COVERAGE_TYPE_DEFAULT,
+                 manifest=None):
     """ Main program computing the box encompassing the sulcus in all subjects
 
   The programm loops over all subjects
@@ -449,19 +1071,91 @@ def bounding_box(src_dir=_SRC_DIR_DEFAULT, tgt_dir=_TGT_DIR_DEFAULT,
             by default it is set to _ALL_SUBJECTS (-1).
       image_normalized_spm: string giving file name (with path) of normalized
             SPM file out of which is extracted the voxel size
+      out_voxel_size: voxel size of the output bounding box
+      jobs: number of worker processes reading the graphs (1 = serial)
+      cache_file: json file keeping per-subject boxes between runs
+      bbox_mode: 'voxel', 'vertex' (per-vertex Tal_boundingbox attributes)
+            or 'verify' (voxel boxes, reporting disagreements with vertex ones)
+      store_dir: directory of voxel stores written by extract_voxels.py
+      coverage: if given (for example 0.99), the box covering this fraction
+            of the sulcus occupancy is also written to the json file
+      coverage_type: 'voxels' (fraction of the occupancy voxels)
+            or 'subjects' (fraction of the subjects)
+      manifest: list of manifest files written by manifest.py,
+            in the same order as src_dir
   """
 
     box = BoundingBoxMax(src_dir=src_dir, tgt_dir=tgt_dir,
                          path_to_graph=path_to_graph,
                          sulcus=sulcus, side=side,
                          image_normalized_spm=image_normalized_spm,
-                         out_voxel_size=out_voxel_size)
+                         out_voxel_size=out_voxel_size,
+                         jobs=jobs, cache_file=cache_file,
+                         bbox_mode=bbox_mode, store_dir=store_dir,
+                         coverage=coverage, coverage_type=coverage_type,
+                         manifest=manifest)
     bbmin_vox, bbmax_vox = box.compute_bounding_box(
         number_subjects=number_subjects)
 
     return bbmin_vox, bbmax_vox
 
 
+def bounding_boxes(src_dir=_SRC_DIR_DEFAULT, tgt_dir=_TGT_DIR_DEFAULT,
+                   path_to_graph=_PATH_TO_GRAPH_DEFAULT,
+                   sulci=None, sides=_BOTH_SIDES,
+                   number_subjects=_ALL_SUBJECTS,
+                   image_normalized_spm=_IMAGE_NORMALIZED_SPM_DEFAULT,
+                   out_voxel_size=None, jobs=_JOBS_DEFAULT, cache_file=None,
+                   bbox_mode=_BBOX_MODE_DEFAULT, store_dir=None,
+                   coverage=None, coverage_type=_COVERAGE_TYPE_DEFAULT,
+                   manifest=None):
+    """ Computes the boxes of several sulci on one or both hemispheres
+
+  Each subject graph of each hemisphere is read only once. One json file
+  per sulcus is written under tgt_dir/L and tgt_dir/R.
+
+  Args:
+      src_dir: list of strings -> directories of the supervised databases
+      tgt_dir: string giving target directory path
+      path_to_graph: string giving relative path to manually labelled graph
+      sulci: list of sulci names (without side suffix), or None for all
+            labels found in the graphs
+      sides: list of hemisphere sides, among 'L' and 'R'
+      number_subjects: integer giving the number of subjects to analyze,
+            by default it is set to _ALL_SUBJECTS (-1).
+      image_normalized_spm: string giving file name (with path) of normalized
+            SPM file out of which is extracted the voxel size
+      out_voxel_size: voxel size of the output bounding box
+      jobs: number of worker processes reading the graphs (1 = serial)
+      cache_file: json file keeping per-subject boxes between runs
+      bbox_mode: 'voxel', 'vertex' or 'verify' (see bounding_box)
+      store_dir: directory of voxel stores written by extract_voxels.py
+      coverage: fraction covered by the coverage boxes (see bounding_box)
+      coverage_type: 'voxels' or 'subjects' (see bounding_box)
+      manifest: list of manifest files (see bounding_box)
+
+  Returns:
+      boxes_vox: dictionary whose keys are sides and whose values are the
+            dictionaries returned by BoundingBoxMax.compute_bounding_boxes
+  """
+
+    boxes_vox = {}
+    for side in sides:
+        box = BoundingBoxMax(src_dir=src_dir, tgt_dir=tgt_dir,
+                             path_to_graph=path_to_graph,
+                             sulcus=None, side=side,
+                             image_normalized_spm=image_normalized_spm,
+                             out_voxel_size=out_voxel_size,
+                             jobs=jobs, cache_file=cache_file,
+                             bbox_mode=bbox_mode, store_dir=store_dir,
+                             coverage=coverage, coverage_type=coverage_type,
+                             manifest=manifest)
+        boxes_vox[side] = box.compute_bounding_boxes(
+            sulci=sulci, number_subjects=number_subjects)
+
+    return boxes_vox
+
+
 def parse_args(argv):
     """Function parsing command-line arguments
 
@@ -487,12 +1181,18 @@ def parse_args(argv):
         help='Target directory where to store the output transformation files. '
              'Default is : ' + _TGT_DIR_DEFAULT)
     parser.add_argument(
-        "-u", "--sulcus", type=str, default=_SULCUS_DEFAULT,
+        "-u", "--sulcus", type=str, default=_SULCUS_DEFAULT, nargs='+',
         help='Sulcus name around which we determine the bounding box. '
+             'If there are several sulci, add all sulci '
+             'one after the other: each graph is then read only once. '
              'Default is : ' + _SULCUS_DEFAULT)
+    parser.add_argument(
+        "-a", "--all_sulci", action='store_true',
+        help='Computes the boxes of all labels found in the graphs '
+             '(the sulcus argument is then ignored).')
     parser.add_argument(
         "-i", "--side", type=str, default=_SIDE_DEFAULT,
-        help='Hemisphere side. Default is : ' + _SIDE_DEFAULT)
+        help='Hemisphere side (L, R or both). Default is : ' + _SIDE_DEFAULT)
     parser.add_argument(
         "-m", "--image_normalized_SPM", type=str,
         default=_IMAGE_NORMALIZED_SPM_DEFAULT,
@@ -513,6 +1213,45 @@ def parse_args(argv):
         "-v", "--out_voxel_size", type=int, default=None,
         help='Voxel size of of bounding box. '
              'Default is : None')
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=_JOBS_DEFAULT,
+        help='Number of worker processes reading the graphs. '
+             'Default is : ' + str(_JOBS_DEFAULT))
+    parser.add_argument(
+        "-c", "--cache_file", type=str, default=None,
+        help='Json file in which per-subject boxes are kept between runs. '
+             'Only new or modified graphs are then read. '
+             'Default is : None (no cache)')
+    parser.add_argument(
+        "-f", "--bbox_mode", type=str, default=_BBOX_MODE_DEFAULT,
+        choices=_BBOX_MODES,
+        help='How boxes are computed: voxel (all bucket voxels), '
+             'vertex (per-vertex Tal_boundingbox attributes, fast) '
+             'or verify (voxel, reporting disagreements with vertex). '
+             'Default is : ' + _BBOX_MODE_DEFAULT)
+    parser.add_argument(
+        "-d", "--store_dir", type=str, default=None,
+        help='Directory of voxel stores written by extract_voxels.py. '
+             'If given, boxes are computed from the stores '
+             'instead of the graphs (bbox_mode voxel only). '
+             'Default is : None')
+    parser.add_argument(
+        "-k", "--coverage", type=float, default=None,
+        help='If given (for example 0.99), also writes the box covering '
+             'this fraction of the sulcus occupancy '
+             '(bbmin_voxel_coverage, bbmax_voxel_coverage). '
+             'Default is : None')
+    parser.add_argument(
+        "-y", "--coverage_type", type=str, default=_COVERAGE_TYPE_DEFAULT,
+        choices=('voxels', 'subjects'),
+        help='Whether coverage is a fraction of the occupancy voxels '
+             'or of the subjects. Default is : ' + _COVERAGE_TYPE_DEFAULT)
+    parser.add_argument(
+        "-g", "--manifest", type=str, default=None, nargs='+',
+        help='Manifest files written by manifest.py, one per source '
+             'directory and in the same order. If given, subjects and '
+             'graphs are read from them instead of walking the tree. '
+             'Default is : None')
 
     params = {}
 
@@ -521,10 +1260,19 @@ def parse_args(argv):
     params['path_to_graph'] = args.path_to_graph
     params['tgt_dir']= args.tgt_dir # tgt_dir is a string, only one directory
     params['image_normalized_spm'] = args.image_normalized_SPM
-    params['sulcus'] = args.sulcus  # sulcus is a string
+    # sulcus is a list of strings
+    params['sulcus'] = ([args.sulcus] if isinstance(args.sulcus, str)
+                        else args.sulcus)
+    params['all_sulci'] = args.all_sulci
     params['side'] = args.side
     params['out_voxel_size'] = args.out_voxel_size
-
+    params['jobs'] = args.jobs
+    params['cache_file'] = args.cache_file
+    params['bbox_mode'] = args.bbox_mode
+    params['store_dir'] = args.store_dir
+    params['coverage'] = args.coverage
+    params['coverage_type'] = args.coverage_type
+    params['manifest'] = args.manifest
 
     number_subjects = args.nb_subjects
 
@@ -557,12 +1305,42 @@ def main(argv):
         # Parsing arguments
         params = parse_args(argv)
         # Actual API
-        bounding_box(src_dir=params['src_dir'],
-                     path_to_graph=params['path_to_graph'],
-                     tgt_dir=params['tgt_dir'],
-                     sulcus=params['sulcus'], side=params['side'],
-                     number_subjects=params['nb_subjects'],
-                     out_voxel_size=params['out_voxel_size'])
+        if params['all_sulci'] or len(params['sulcus']) > 1 \
+                or params['side'] == 'both':
+            # Single pass over the graphs for all sulci and sides
+            bounding_boxes(src_dir=params['src_dir'],
+                           path_to_graph=params['path_to_graph'],
+                           tgt_dir=params['tgt_dir'],
+                           sulci=(None if params['all_sulci']
+                                  else params['sulcus']),
+                           sides=(_BOTH_SIDES if params['side'] == 'both'
+                                  else [params['side']]),
+                           number_subjects=params['nb_subjects'],
+                           image_normalized_spm=params[
+                               'image_normalized_spm'],
+                           out_voxel_size=params['out_voxel_size'],
+                           jobs=params['jobs'],
+                           cache_file=params['cache_file'],
+                           bbox_mode=params['bbox_mode'],
+                           store_dir=params['store_dir'],
+                           coverage=params['coverage'],
+                           coverage_type=params['coverage_type'],
+                           manifest=params['manifest'])
+        else:
+            bounding_box(src_dir=params['src_dir'],
+                         path_to_graph=params['path_to_graph'],
+                         tgt_dir=params['tgt_dir'],
+                         sulcus=params['sulcus'][0], side=params['side'],
+                         number_subjects=params['nb_subjects'],
+                         image_normalized_spm=params['image_normalized_spm'],
+                         out_voxel_size=params['out_voxel_size'],
+                         jobs=params['jobs'],
+                         cache_file=params['cache_file'],
+                         bbox_mode=params['bbox_mode'],
+                         store_dir=params['store_dir'],
+                         coverage=params['coverage'],
+                         coverage_type=params['coverage_type'],
+                         manifest=params['manifest'])
     except SystemExit as exc:
         if exc.code != 0:
             six.reraise(*sys.exc_info())
@@ -58,22 +58,47 @@ from __future__ import print_function
 import argparse
 import sys
 import os
+import tempfile
 from os import listdir
 from os.path import join
 
 import numpy as np
 
 import six
-
+from soma import aims
+
+from deep_folding.anatomist_tools.manifest import DatasetManifest
+from deep_folding.anatomist_tools.transform import compose_transform
+from deep_folding.anatomist_tools.utils.aims_io import read_header
+from deep_folding.anatomist_tools.utils.completion import CompletionManifest
+from deep_folding.anatomist_tools.utils.completion import completion_entry
+from deep_folding.anatomist_tools.utils.completion import replace_output
+from deep_folding.anatomist_tools.utils.crop_array import compact_crop_array
+from deep_folding.anatomist_tools.utils.crop_array import create_crop_array
+from deep_folding.anatomist_tools.utils.crop_array import write_crop_row
+from deep_folding.anatomist_tools.utils.crop_array import \
+    write_subjects_index
+from deep_folding.anatomist_tools.utils.gather_cache import GatherMapCache
 from deep_folding.anatomist_tools.utils.logs import LogJson
+from deep_folding.anatomist_tools.utils.normalize_crop import crop_volume
+from deep_folding.anatomist_tools.utils.normalize_crop import \
+    read_transformation
+from deep_folding.anatomist_tools.utils.normalize_crop import \
+    normalize_volume
+from deep_folding.anatomist_tools.utils.parallel import parallel_map
 from deep_folding.anatomist_tools.utils.load_bbox import compute_max_box
 from deep_folding.anatomist_tools.utils.resample import resample
 from deep_folding.anatomist_tools.utils.sulcus_side import complete_sulci_name
+from deep_folding.anatomist_tools.utils.transform_store import TransformStore
+from deep_folding.anatomist_tools.utils.transform_store import write_trm
 from deep_folding.anatomist_tools.load_data import fetch_data
 
 _ALL_SUBJECTS = -1
 
-_SIDE_DEFAULT = 'L'  # hemisphere 'L' or 'R'
+_SIDE_DEFAULT = 'L'  # hemisphere 'L', 'R' or 'both'
+
+# Hemispheres processed when side is 'both'
+_BOTH_SIDES = ('L', 'R')
 
 _INTERP_DEFAULT = 'nearest'  # default interpolation for ApplyAimsTransform
 
@@ -81,6 +106,22 @@ _RESAMPLING_DEFAULT = None # if None, resampling method is AimsApplyTransform
 
 _OUT_VOXEL_SIZE = (1, 1, 1) # default output voxel size for Bastien's resampling
 
+# Bastien's resampling is done with aims buckets or vectorized numpy
+_RESAMPLE_METHODS = ('aims', 'numpy')
+_RESAMPLE_METHOD_DEFAULT = 'aims'
+
+# Normalization and crop are done either within the python process,
+# or with the AimsApplyTransform and AimsSubVolume command lines
+_ENGINES = ('inprocess', 'external')
+_ENGINE_DEFAULT = 'external'
+
+# Number of worker processes cropping the files (1 = serial run)
+_JOBS_DEFAULT = 1
+
+# Number of threads of the numpy resampling of one skeleton
+# (0 = all the cores available to the process)
+_THREADS_DEFAULT = 1
+
 # sulcus to encompass:
 # its name depends on the hemisphere side
 _SULCUS_DEFAULT = 'S.T.s.ter.asc.ant.'
@@ -109,6 +150,48 @@ _BBOX_DIR_DEFAULT = '/neurospin/dico/data/deep_folding/data/bbox'
 _TGT_DIR_DEFAULT = '/neurospin/dico/data/deep_folding/test'
 
 
+class CropRegion:
+    """Region cropped from the normalized skeletons and its output dataset
+
+    Each region has its own bounding box, target directory, json log,
+    completion manifest and dataset files.
+    """
+
+    def __init__(self, name, list_sulci, side, tgt_dir):
+        """Inits the output file names of the region
+
+        Args:
+            name: name of the region, None for the single region of a run
+            list_sulci: list of sulcus names encompassed by the region
+            side: hemisphere side (either L for left, or R for right)
+            tgt_dir: target directory of the region dataset
+        """
+        self.name = name
+        self.side = side
+        self.list_sulci = complete_sulci_name(list_sulci, side)
+        self.tgt_dir = tgt_dir
+
+        # Directory where to store cropped files
+        self.cropped_dir = join(self.tgt_dir, self.side + 'crops')
+
+        # Array of all crops, and the subject of each of its rows
+        self.array_file = join(self.tgt_dir, self.side + 'skeleton.npy')
+        self.array_subjects_file = join(self.tgt_dir,
+                                        self.side + 'skeleton_subjects.csv')
+
+        # Completion manifest: inputs, parameters and checksum of each crop
+        self.completion = CompletionManifest(
+            join(self.tgt_dir, self.side + 'completion.json'))
+
+        # Initialization of bounding box coordinates
+        self.bbmin = np.zeros(3)
+        self.bbmax = np.zeros(3)
+
+        # Creates json log class
+        json_file = join(self.tgt_dir, self.side + 'dataset.json')
+        self.json = LogJson(json_file)
+
+
 class DatasetCroppedSkeleton:
     """Generates cropped skeleton files and corresponding pickle file
     """
@@ -122,7 +205,21 @@ class DatasetCroppedSkeleton:
                  side=_SIDE_DEFAULT,
                  interp=_INTERP_DEFAULT,
                  resampling=_RESAMPLING_DEFAULT,
-                 out_voxel_size=_OUT_VOXEL_SIZE):
+                 out_voxel_size=_OUT_VOXEL_SIZE,
+                 resample_method=_RESAMPLE_METHOD_DEFAULT,
+                 manifest=None,
+                 transform_store=None,
+                 compute_transforms=False,
+                 engine=_ENGINE_DEFAULT,
+                 crop_aware=False,
+                 jobs=_JOBS_DEFAULT,
+                 resume=False,
+                 array=False,
+                 nifti=True,
+                 regions=None,
+                 sparse=False,
+                 cache_dir=None,
+                 threads=_THREADS_DEFAULT):
         """Inits with list of directories and list of sulci
 
         Args:
@@ -134,24 +231,109 @@ class DatasetCroppedSkeleton:
             bbox_dir: directory containing bbox json files
                     (generated using bounding_box.py)
             list_sulci: list of sulcus names
-            side: hemisphere side (either L for left, or R for right hemisphere)
+            side: hemisphere side (either L for left, or R for right hemisphere,
+                    or both: each subject is then processed once for
+                    both hemispheres, sharing the transformation)
             interp: string giving interpolation for AimsApplyTransform
+            resample_method: 'aims' or 'numpy' (vectorized nearest
+                    neighbours), method of Bastien's resampling
+            manifest: manifest file written by manifest.py; if given,
+                    subjects and skeletons are read from it
+            transform_store: transform store file written by transform.py;
+                    if given, transformations are read from it
+                    instead of the .trm files of transform_dir
+            compute_transforms: if True, transformations are computed
+                    from the morphologist outputs, without running
+                    transform.py first
+            engine: 'inprocess' (resampling and crop in memory, only the
+                    crop is written) or 'external' (AimsApplyTransform
+                    and AimsSubVolume command lines)
+            crop_aware: if True (inprocess engine), only the voxels inside
+                    the bounding box are resampled
+            jobs: number of worker processes cropping the files
+            resume: if True, subjects whose crop is complete and up to date
+                    in the completion manifest are skipped, and written
+                    crops are recorded in it (checksums are only computed
+                    in this mode)
+            array: if True, crops are written into a single memory-mapped
+                    (N, X, Y, Z) array with a subject-index sidecar file,
+                    instead of the pickle file
+            nifti: if False, per-subject NIfTI crops are not written
+                    (only with array=True)
+            regions: dictionary mapping region names to lists of sulci;
+                    each subject is normalized once and every region
+                    is cropped and written to tgt_dir/<region name>.
+                    If None, the single region is list_sulci,
+                    written to tgt_dir
+            sparse: if True, the pickle file stores the crops as
+                    SparseSkeleton (coordinates and labels of
+                    the nonzero voxels) instead of dense arrays
+            cache_dir: directory of the index map cache of the numpy
+                    resampling, shared between runs; None for no cache
+            threads: number of threads of the numpy resampling of one
+                    skeleton, 0 for all available cores; worker processes
+                    (jobs > 1) use a single thread
         """
 
         self.src_dir = src_dir
         self.side = side
+        self.sides = _BOTH_SIDES if side == 'both' else (side,)
+        self.tgt_dir = tgt_dir
+
         # Transforms sulcus in a list of sulci
-        self.list_sulci = ([list_sulci] if isinstance(list_sulci, str)
-                           else list_sulci)
-        self.list_sulci = complete_sulci_name(self.list_sulci, self.side)
+        if regions:
+            regions = [(name, [sulci] if isinstance(sulci, str) else sulci,
+                        join(self.tgt_dir, name))
+                       for name, sulci in regions.items()]
+        else:
+            regions = [(None,
+                        [list_sulci] if isinstance(list_sulci, str)
+                        else list_sulci,
+                        self.tgt_dir)]
+        if len(self.sides) > 1 and any(
+                'left' in sulcus or 'right' in sulcus
+                for _, sulci, _ in regions for sulcus in sulci):
+            raise ValueError("With both sides, sulci must be given "
+                             "without their side suffix")
+
+        # Regions to crop in each hemisphere, each one with its list of sulci
+        self.regions = [CropRegion(name, sulci, side, region_dir)
+                        for side in self.sides
+                        for name, sulci, region_dir in regions]
 
-        self.tgt_dir = tgt_dir
         self.transform_dir = transform_dir
         self.bbox_dir = bbox_dir
         self.morphologist_dir = morphologist_dir
         self.interp = interp
         self.resampling = resampling
         self.out_voxel_size = out_voxel_size
+        if resample_method not in _RESAMPLE_METHODS:
+            raise ValueError("resample_method must be one of "
+                             + str(_RESAMPLE_METHODS))
+        self.resample_method = resample_method
+        if cache_dir and resample_method != 'numpy':
+            raise ValueError("The index map cache needs the numpy "
+                             "resample_method")
+        self.cache = GatherMapCache(cache_dir) if cache_dir else None
+        self.threads = threads
+        self.manifest = DatasetManifest(manifest) if manifest else None
+        self.transform_store = (TransformStore(transform_store)
+                                if transform_store else None)
+        self.compute_transforms = compute_transforms
+        if engine not in _ENGINES:
+            raise ValueError("engine must be one of " + str(_ENGINES))
+        self.engine = engine
+        self.crop_aware = crop_aware
+        self.jobs = jobs
+        self.resume = resume
+        if not (nifti or array):
+            raise ValueError("Crops must be written either to NIfTI files "
+                             "or to the array")
+        if resume and not nifti:
+            raise ValueError("Resuming a run needs the NIfTI crops")
+        self.array = array
+        self.nifti = nifti
+        self.sparse = sparse
 
         # Morphologist directory
         self.morphologist_dir = join(self.src_dir, self.morphologist_dir)
@@ -160,36 +342,52 @@ class DatasetCroppedSkeleton:
         # (input) name of normalized SPM file
         self.normalized_spm_file = "normalized_SPM_%(subject)s.nii"
 
-        # Directory where to store cropped files
-        self.cropped_dir = join(self.tgt_dir, self.side + 'crops')
-
         # Names of files in function of dictionary: keys -> 'subject' and 'side'
         # Files from morphologist pipeline
         self.normalized_spm_file = 'normalized_SPM_%(subject)s.nii'
         self.skeleton_file = 'default_analysis/segmentation/' \
                              '%(side)sskeleton_%(subject)s.nii.gz'
+        self.to_talairach_MNI_file = 'registration/' \
+            'RawT1-%(subject)s_default_acquisition_TO_Talairach-MNI.trm'
 
         # Names of files in function of dictionary: keys -> 'subject' and 'side'
         self.transform_file = 'natif_to_template_spm_%(subject)s.trm'
         self.cropped_file = '%(subject)s_normalized.nii.gz'
+        # Crops are written under a temporary name, renamed once complete
+        self.partial_file = '%(subject)s_partial.nii.gz'
 
-        # Initialization of bounding box coordinates
-        self.bbmin = np.zeros(3)
-        self.bbmax = np.zeros(3)
+        # Rows of the subjects in the region arrays, set by crop_files
+        self.array_rows = {}
 
-        # Creates json log class
-        json_file = join(self.tgt_dir, self.side + 'dataset.json')
-        self.json = LogJson(json_file)
+    def crop_one_file(self, subject_id, statuses=None, entries=None):
+        """Crops the files of one subject in every region
+
+        The transformation and the normalized SPM header are loaded once
+        for all sides. The skeleton of each side is normalized once and all
+        regions of this side are cropped from the normalized volume.
 
-    def crop_one_file(self, subject_id):
-        """Crops one file
+        A region is 'done' as soon as its crop is in place: if an error
+        occurs afterwards, statuses and entries given as arguments keep
+        the outcome of the regions already processed.
 
         Args:
             subject_id: string giving the subject ID
+            statuses: list filled in place with the status of each region;
+                created if None
+            entries: list filled in place with the completion entry
+                of each region; created if None
+
+        Returns:
+            statuses: list giving for each region 'done', 'skipped'
+                (complete and up to date, in resume mode) or 'missing'
+                (no skeleton, transformation or normalized SPM image)
+            entries: list giving for each region the completion entry
+                of the written crop, None if no crop has been written
+                or if not in resume mode
         """
 
         # Identifies 'subject' in a mapping (for file and directory namings)
-        subject = {'subject': subject_id, 'side': self.side}
+        subject = {'subject': subject_id}
         print(subject_id)
 
         # Names directory where subject analysis files are stored
@@ -202,57 +400,360 @@ class DatasetCroppedSkeleton:
         # Normalized SPM file name
         file_SPM = join(subject_dir, self.normalized_spm_file % subject)
 
-        # Skeleton file name
-        file_skeleton = join(subject_dir, self.skeleton_file % subject)
-        if os.path.exists(file_skeleton) and os.path.exists(file_transform):
-            # Creates output (cropped) file name
-            file_cropped = join(self.cropped_dir, self.cropped_file % subject)
-
-            # Normalization and resampling of skeleton images
-            if self.resampling:
-                resample(file_skeleton,
-                        file_cropped,
-                        output_vs=self.out_voxel_size,
-                        transformation=file_transform)
-
-            else :
-                cmd_normalize = 'AimsApplyTransform' + \
-                                ' -i ' + file_skeleton + \
-                                ' -o ' + file_cropped + \
-                                ' -m ' + file_transform + \
-                                ' -r ' + file_SPM + \
-                                ' -t ' + self.interp
-                os.system(cmd_normalize)
+        # Transformation file from native to Talairach MNI space
+        file_to_talairach_MNI = join(subject_dir,
+                                     self.to_talairach_MNI_file % subject)
+
+        # With a manifest, files exist if they are recorded in it
+        if self.manifest:
+            file_SPM = self.manifest.path(subject_id, 'normalized_spm')
+            file_to_talairach_MNI = self.manifest.path(subject_id,
+                                                       'to_talairach_MNI')
+            has_SPM = file_SPM is not None
+            has_to_talairach_MNI = file_to_talairach_MNI is not None
+        else:
+            has_SPM = os.path.exists(file_SPM)
+            has_to_talairach_MNI = self.compute_transforms \
+                and os.path.exists(file_to_talairach_MNI)
+
+        # The transformation comes from the transform store,
+        # is computed on the fly, or is read from a .trm file
+        if self.transform_store:
+            has_transform = subject_id in self.transform_store
+        elif self.compute_transforms:
+            has_transform = has_to_talairach_MNI and has_SPM
+        else:
+            has_transform = os.path.exists(file_transform)
+
+        if statuses is None:
+            statuses = ['missing'] * len(self.regions)
+        if entries is None:
+            entries = [None] * len(self.regions)
+        # The normalized SPM image gives the output grid, unless resampling
+        if not has_transform or not (has_SPM or self.resampling):
+            return statuses, entries
+
+        matrix = None
+        if self.transform_store:
+            matrix = self.transform_store.matrix(subject_id)
+        elif self.compute_transforms:
+            matrix = compose_transform(file_to_talairach_MNI,
+                                       file_SPM).toMatrix()
+
+        transformation = file_transform if matrix is None else matrix
+        # Loaded once, shared by the normalizations of all sides
+        reference = None
+        if self.engine != 'external':
+            transformation = read_transformation(transformation)
+            if not self.resampling:
+                reference = read_header(file_SPM)
+
+        # Inputs and parameters shared by the crops of all sides
+        common_inputs = {}
+        if has_SPM:
+            common_inputs['normalized_spm'] = file_SPM
+        if matrix is None:
+            common_inputs['transform'] = file_transform
+        elif self.compute_transforms:
+            common_inputs['to_talairach_MNI'] = file_to_talairach_MNI
+
+        for side in self.sides:
+            subject = {'subject': subject_id, 'side': side}
+
+            # Skeleton file name
+            if self.manifest:
+                file_skeleton = self.manifest.path(subject_id,
+                                                   side + 'skeleton')
+                has_skeleton = file_skeleton is not None
+            else:
+                file_skeleton = join(subject_dir, self.skeleton_file % subject)
+                has_skeleton = os.path.exists(file_skeleton)
+            if not has_skeleton:
+                continue
+
+            inputs = dict(common_inputs, skeleton=file_skeleton)
+
+            # Regions whose crop is complete and up to date are skipped
+            regions = []
+            for index, region in enumerate(self.regions):
+                if region.side != side:
+                    continue
+                file_cropped = join(region.cropped_dir,
+                                    self.cropped_file % subject)
+                params = self.crop_parameters(region, matrix)
+                if self.resume and region.completion.is_complete(
+                        subject_id, inputs, params, file_cropped):
+                    statuses[index] = 'skipped'
+                    if self.array:
+                        write_crop_row(region.array_file,
+                                       self.array_rows[subject_id],
+                                       np.asarray(aims.read(file_cropped)))
+                else:
+                    regions.append((index, region, params))
+            if not regions:
+                continue
+
+            # Crops are written to temporary files, renamed once complete
+            files_partial = [join(region.cropped_dir,
+                                  self.partial_file % subject)
+                             for _, region, _ in regions]
+
+            if self.engine == 'external':
+                self.normalize_crop_external(
+                    file_skeleton, files_partial, transformation, file_SPM,
+                    [region for _, region, _ in regions])
+                crops = [aims.read(file_partial) if self.array else None
+                         for file_partial in files_partial]
+                if not self.nifti:
+                    for file_partial in files_partial:
+                        os.remove(file_partial)
+            else:
+                crops = self.normalize_crop(
+                    file_skeleton, transformation, reference,
+                    [region for _, region, _ in regions])
+                if self.nifti:
+                    for cropped, file_partial in zip(crops, files_partial):
+                        aims.write(cropped, file_partial)
+
+            for (index, region, params), cropped, file_partial in \
+                    zip(regions, crops, files_partial):
+                if self.array:
+                    write_crop_row(region.array_file,
+                                   self.array_rows[subject_id],
+                                   np.asarray(cropped))
+                if self.nifti:
+                    file_cropped = join(region.cropped_dir,
+                                        self.cropped_file % subject)
+                    replace_output(file_partial, file_cropped)
+                statuses[index] = 'done'
+                if self.nifti and self.resume:
+                    entries[index] = completion_entry(inputs, params,
+                                                      file_cropped)
+
+        return statuses, entries
+
+    def crop_parameters(self, region, matrix=None):
+        """Returns the parameters on which a crop depends
+
+        Args:
+            region: CropRegion of the crop
+            matrix: transformation matrix if it doesn't come from
+                a .trm file, None otherwise
+
+        Returns:
+            params: dictionary recorded in the completion manifest
+        """
+        return {'bbmin': np.asarray(region.bbmin).tolist(),
+                'bbmax': np.asarray(region.bbmax).tolist(),
+                'interp': self.interp,
+                'resampling': self.resampling,
+                'resample_method': self.resample_method,
+                'out_voxel_size': list(self.out_voxel_size),
+                'engine': self.engine,
+                'crop_aware': self.crop_aware,
+                'transform_matrix': (None if matrix is None
+                                     else np.asarray(matrix).tolist())}
+
+    def normalize_crop(self, file_skeleton, transformation, reference,
+                       regions):
+        """Normalizes one file in memory and crops it in every region
+
+        With crop_aware, only the window encompassing all regions
+        is resampled.
+
+        Args:
+            file_skeleton: skeleton file name
+            transformation: .trm file name, (4,4) matrix or
+                aims.AffineTransformation3d
+            reference: normalized SPM file name or header,
+                giving the output grid
+            regions: list of CropRegion to crop
+
+        Returns:
+            crops: list of cropped aims volumes, one per region
+        """
+        # Window encompassing the bounding boxes of all regions
+        if self.crop_aware:
+            origin = np.min([region.bbmin for region in regions], axis=0)
+            window = (origin,
+                      np.max([region.bbmax for region in regions], axis=0))
+        else:
+            origin = np.zeros(3, dtype=int)
+            window = None
+
+        if self.resampling:
+            # Bastien's resampling
+            normalized = resample(file_skeleton,
+                                  None,
+                                  output_vs=self.out_voxel_size,
+                                  transformation=transformation,
+                                  crop=window,
+                                  method=self.resample_method,
+                                  cache=self.cache,
+                                  threads=self.threads or None)
+        else:
+            # Normalization onto the SPM grid
+            bbmin, bbmax = window if window else (None, None)
+            normalized = normalize_volume(aims.read(file_skeleton),
+                                          transformation, reference,
+                                          interp=self.interp,
+                                          bbmin=bbmin, bbmax=bbmax)
+
+        return [crop_volume(normalized,
+                            np.asarray(region.bbmin) - origin,
+                            np.asarray(region.bbmax) - origin)
+                for region in regions]
+
+    def normalize_crop_external(self, file_skeleton, files_cropped,
+                                transformation, file_SPM, regions):
+        """Normalizes and crops one file with AIMS command lines
+
+        The normalized volume is written to a temporary file,
+        from which every region is cropped.
 
+        Args:
+            file_skeleton: skeleton file name
+            files_cropped: list of output file names, one per region
+            transformation: .trm file name or (4,4) matrix
+            file_SPM: normalized SPM file name, giving the output grid
+            regions: list of CropRegion to crop
+        """
+        file_transform = transformation
+        if not isinstance(transformation, str):
+            # AimsApplyTransform needs a file: writes the matrix
+            # to a local temporary .trm file
+            fd, file_transform = tempfile.mkstemp(suffix='.trm')
+            os.close(fd)
+            write_trm(file_transform, transformation)
+
+        # Normalized volume, removed once all regions are cropped
+        fd, file_normalized = tempfile.mkstemp(suffix='.nii.gz',
+                                               dir=regions[0].cropped_dir)
+        os.close(fd)
+
+        # Normalization and resampling of skeleton images
+        if self.resampling:
+            resample(file_skeleton,
+                    file_normalized,
+                    output_vs=self.out_voxel_size,
+                    transformation=file_transform,
+                    method=self.resample_method,
+                    cache=self.cache,
+                    threads=self.threads or None)
+
+        else :
+            cmd_normalize = 'AimsApplyTransform' + \
+                            ' -i ' + file_skeleton + \
+                            ' -o ' + file_normalized + \
+                            ' -m ' + file_transform + \
+                            ' -r ' + file_SPM + \
+                            ' -t ' + self.interp
+            os.system(cmd_normalize)
+        if file_transform is not transformation:
+            os.remove(file_transform)
+
+        for region, file_cropped in zip(regions, files_cropped):
             # Take the coordinates of the bounding box
-            bbmin = self.bbmin
-            bbmax = self.bbmax
+            bbmin = region.bbmin
+            bbmax = region.bbmax
             xmin, ymin, zmin = str(bbmin[0]), str(bbmin[1]), str(bbmin[2])
             xmax, ymax, zmax = str(bbmax[0]), str(bbmax[1]), str(bbmax[2])
 
             # Crop of the images based on bounding box
-            cmd_bounding_box = ' -x ' + xmin + ' -y ' + ymin + ' -z ' + zmin + \
-                           ' -X ' + xmax + ' -Y ' + ymax + ' -Z ' + zmax
+            cmd_bounding_box = ' -x ' + xmin + ' -y ' + ymin + \
+                               ' -z ' + zmin + ' -X ' + xmax + \
+                               ' -Y ' + ymax + ' -Z ' + zmax
             cmd_crop = 'AimsSubVolume' + \
-                   ' -i ' + file_cropped + \
-                   ' -o ' + file_cropped + cmd_bounding_box
+                       ' -i ' + file_normalized + \
+                       ' -o ' + file_cropped + cmd_bounding_box
             os.system(cmd_crop)
+        os.remove(file_normalized)
+        if os.path.exists(file_normalized + '.minf'):
+            os.remove(file_normalized + '.minf')
+
+    def crop_one_subject(self, subject_id):
+        """Crops the file of one subject, catching errors
+
+        An error on one subject doesn't stop the processing of the others.
+        Regions whose crop is already in place keep their status and
+        completion entry; the other ones are 'failed' and their temporary
+        crops are removed.
+
+        Args:
+            subject_id: string giving the subject ID
+
+        Returns:
+            statuses: list giving for each region 'done', 'skipped',
+                'missing' (missing input) or 'failed'
+            message: error message if failed, empty string otherwise
+            entries: list giving for each region the completion entry
+                of the written crop, None if no crop has been written
+        """
+        statuses = ['missing'] * len(self.regions)
+        entries = [None] * len(self.regions)
+        try:
+            self.crop_one_file(subject_id, statuses, entries)
+        except Exception as exc:
+            print("subject " + subject_id + " failed: " + str(exc))
+            for index, region in enumerate(self.regions):
+                if statuses[index] in ('done', 'skipped'):
+                    continue
+                statuses[index] = 'failed'
+                file_partial = join(region.cropped_dir, self.partial_file
+                                    % {'subject': subject_id,
+                                       'side': region.side})
+                for filename in (file_partial, file_partial + '.minf'):
+                    if os.path.exists(filename):
+                        os.remove(filename)
+            return statuses, str(exc), entries
+        return statuses, '', entries
+
+    def record_completion(self, subject_id, result):
+        """Records the written crops in the completion manifests
+
+        It is called in the main process as soon as a subject is processed,
+        so that an interrupted run can be resumed. Entries are appended to
+        the journal of each manifest, merged at the end of crop_files.
+
+        Args:
+            subject_id: string giving the subject ID
+            result: tuple returned by crop_one_subject
+        """
+        _, _, entries = result
+        for region, entry in zip(self.regions, entries):
+            if entry is not None:
+                region.completion.append(subject_id, entry)
 
     def crop_files(self, number_subjects=_ALL_SUBJECTS):
         """Crop nii files
 
         The programm loops over all subjects from the input (source) directory.
+        Subjects are cropped in worker processes if jobs > 1;
+        they are listed in the same order whatever the number of jobs.
 
         Args:
             number_subjects: integer giving the number of subjects to analyze,
                 by default it is set to _ALL_SUBJECTS (-1).
+
+        Returns:
+            subjects: list giving for each region the list of subjects
+                whose crop has been written
         """
 
+        subjects = [[] for _ in self.regions]
+
         if number_subjects:
 
             # subjects are detected as the directory names under src_dir
-            list_all_subjects = [dI for dI in os.listdir(self.morphologist_dir)\
-             if os.path.isdir(os.path.join(self.morphologist_dir,dI))]
+            # or, with a manifest, as the subjects having a skeleton
+            if self.manifest:
+                list_all_subjects = sorted(set().union(*[
+                    self.manifest.subjects_with(side + 'skeleton')
+                    for side in self.sides]))
+            else:
+                list_all_subjects = sorted(
+                    [dI for dI in os.listdir(self.morphologist_dir)\
+                     if os.path.isdir(os.path.join(self.morphologist_dir,dI))])
 
             # Gives the possibility to list only the first number_subjects
             list_subjects = (
@@ -260,31 +761,91 @@ class DatasetCroppedSkeleton:
                 if number_subjects == _ALL_SUBJECTS
                 else list_all_subjects[:number_subjects])
 
-            # Creates target and cropped directory
-            if not os.path.exists(self.tgt_dir):
-                os.makedirs(self.tgt_dir)
-            if not os.path.exists(self.cropped_dir):
-                os.makedirs(self.cropped_dir)
-
-            # Writes number of subjects and directory names to json file
-            dict_to_add = {'nb_subjects': len(list_subjects),
-                           'src_dir': self.src_dir,
-                           'transform_dir': self.transform_dir,
-                           'bbox_dir': self.bbox_dir,
-                           'side': self.side,
-                           'interp': self.interp,
-                           'list_sulci': self.list_sulci,
-                           'bbmin': self.bbmin.tolist(),
-                           'bbmax': self.bbmax.tolist(),
-                           'tgt_dir': self.tgt_dir,
-                           'cropped_dir': self.cropped_dir,
-                           'resampling_type': 'AimsApplyTransform' if self.resampling is None else 'Bastien',
-                           'out_voxel_size': self.out_voxel_size
-                           }
-            self.json.update(dict_to_add=dict_to_add)
-
-            for subject in list_subjects:
-                self.crop_one_file(subject)
+            self.array_rows = {subject: row for row, subject
+                               in enumerate(list_subjects)}
+            for region in self.regions:
+                # Creates target and cropped directory
+                if not os.path.exists(region.tgt_dir):
+                    os.makedirs(region.tgt_dir)
+                if not os.path.exists(region.cropped_dir):
+                    os.makedirs(region.cropped_dir)
+
+                # Writes number of subjects and directory names to json file
+                dict_to_add = {'nb_subjects': len(list_subjects),
+                               'src_dir': self.src_dir,
+                               'transform_dir': self.transform_dir,
+                               'transform_store': (
+                                   self.transform_store.store_file
+                                   if self.transform_store else None),
+                               'compute_transforms': self.compute_transforms,
+                               'bbox_dir': self.bbox_dir,
+                               'side': region.side,
+                               'interp': self.interp,
+                               'region': region.name,
+                               'list_sulci': region.list_sulci,
+                               'bbmin': np.asarray(region.bbmin).tolist(),
+                               'bbmax': np.asarray(region.bbmax).tolist(),
+                               'tgt_dir': region.tgt_dir,
+                               'cropped_dir': region.cropped_dir,
+                               'resampling_type': 'AimsApplyTransform' if self.resampling is None else 'Bastien',
+                               'out_voxel_size': self.out_voxel_size,
+                               'resample_method': self.resample_method,
+                               'engine': self.engine,
+                               'crop_aware': self.crop_aware
+                               }
+                region.json.update(dict_to_add=dict_to_add)
+
+                # Preallocates the array in which workers write the crops
+                if self.array:
+                    create_crop_array(region.array_file, len(list_subjects),
+                                      np.asarray(region.bbmax) -
+                                      np.asarray(region.bbmin) + 1)
+
+            # Each worker uses a single thread to avoid oversubscription
+            results = parallel_map(self.crop_one_subject, list_subjects,
+                                   jobs=self.jobs,
+                                   threads=1 if self.jobs > 1 else None,
+                                   progress=True,
+                                   callback=self.record_completion)
+            if self.resume:
+                for region in self.regions:
+                    region.completion.save()
+
+            # Writes per-subject outcome of each region to json file
+            for index, region in enumerate(self.regions):
+                failed = {}
+                missing = []
+                skipped = []
+                for subject, (statuses, message, _) in zip(list_subjects,
+                                                           results):
+                    status = statuses[index]
+                    if status in ('done', 'skipped'):
+                        subjects[index].append(subject)
+                        if status == 'skipped':
+                            skipped.append(subject)
+                    elif status == 'missing':
+                        missing.append(subject)
+                    else:
+                        failed[subject] = message
+                region.json.update(dict_to_add={'subjects_skipped': skipped,
+                                                'subjects_missing': missing,
+                                                'subjects_failed': failed})
+                # Keeps only the rows of the cropped subjects
+                if self.array:
+                    compact_crop_array(region.array_file,
+                                       [self.array_rows[subject]
+                                        for subject in subjects[index]])
+                    write_subjects_index(region.array_subjects_file,
+                                         subjects[index])
+
+                print("%s%s: crops written: %d, up to date: %d, "
+                      "missing inputs: %d, failed: %d"
+                      % (region.side,
+                         ' ' + region.name if region.name else '',
+                         len(subjects[index]) - len(skipped), len(skipped),
+                         len(missing), len(failed)))
+
+        return subjects
 
     def dataset_gen_pipe(self, number_subjects=_ALL_SUBJECTS):
         """Main API to create pickle files
@@ -296,21 +857,27 @@ class DatasetCroppedSkeleton:
                 by default it is set to _ALL_SUBJECTS (-1).
         """
 
-        self.json.write_general_info()
+        for region in self.regions:
+            region.json.write_general_info()
 
+            # Determines the bounding box of the region
+            if number_subjects:
+                region.bbmin, region.bbmax = compute_max_box(
+                    sulci_list=region.list_sulci,
+                    side=region.side,
+                    talairach_box=False,
+                    src_dir=self.bbox_dir)
         # Generate cropped files
-        if number_subjects:
-            self.bbmin, self.bbmax = compute_max_box(sulci_list=self.list_sulci,
-                                                     side=self.side,
-                                                     talairach_box=False,
-                                                     src_dir=self.bbox_dir)
-        # Generate cropped files
-        self.crop_files(number_subjects=number_subjects)
+        subjects = self.crop_files(number_subjects=number_subjects)
         # Creation of .pickle file for all subjects
-        if number_subjects:
-            fetch_data(cropped_dir=self.cropped_dir,
-                       tgt_dir=self.tgt_dir,
-                       side=self.side)
+        # (in array mode, the array is the dataset)
+        if number_subjects and not self.array:
+            for region, region_subjects in zip(self.regions, subjects):
+                fetch_data(cropped_dir=region.cropped_dir,
+                           tgt_dir=region.tgt_dir,
+                           side=region.side,
+                           subjects=region_subjects,
+                           sparse=self.sparse)
 
 
 def parse_args(argv):
@@ -356,7 +923,9 @@ def parse_args(argv):
              'Default is : ' + _SULCUS_DEFAULT)
     parser.add_argument(
         "-i", "--side", type=str, default=_SIDE_DEFAULT,
-        help='Hemisphere side (either L or R). Default is : ' + _SIDE_DEFAULT)
+        help='Hemisphere side (either L, R or both). With both, each '
+             'subject is processed once for both hemispheres and '
+             'Lcrops and Rcrops are written. Default is : ' + _SIDE_DEFAULT)
     parser.add_argument(
         "-n", "--nb_subjects", type=str, default="all",
         help='Number of subjects to take into account, or \'all\'. '
@@ -381,6 +950,80 @@ def parse_args(argv):
         "-v", "--out_voxel_size", type=int, nargs='+', default=_OUT_VOXEL_SIZE,
         help='Voxel size of output images'
              'Default is : 1 1 1')
+    parser.add_argument(
+        "-y", "--resample_method", type=str,
+        default=_RESAMPLE_METHOD_DEFAULT, choices=_RESAMPLE_METHODS,
+        help='Implementation of Bastien\'s resampling: aims (one bucket '
+             'per label) or numpy (vectorized nearest neighbours). '
+             'Default is : ' + _RESAMPLE_METHOD_DEFAULT)
+    parser.add_argument(
+        "-d", "--cache_dir", type=str, default=None,
+        help='With the numpy resample method, directory where the '
+             'resampling index maps are cached and reused by the volumes '
+             'sharing a transformation. Default is : None')
+    parser.add_argument(
+        "-q", "--threads", type=int, default=_THREADS_DEFAULT,
+        help='With the numpy resample method, number of threads resampling '
+             'slabs of one skeleton, 0 for all cores. Worker processes '
+             '(--jobs > 1) use a single thread. '
+             'Default is : ' + str(_THREADS_DEFAULT))
+    parser.add_argument(
+        "-g", "--manifest", type=str, default=None,
+        help='Manifest file written by manifest.py. If given, subjects '
+             'and skeletons are read from it instead of walking the tree. '
+             'Default is : None')
+    parser.add_argument(
+        "-f", "--transform_store", type=str, default=None,
+        help='Transform store file written by transform.py. If given, '
+             'transformations are read from it instead of the .trm files '
+             'of the transform directory. Default is : None')
+    parser.add_argument(
+        "-c", "--compute_transforms", action='store_true',
+        help='Computes the transformations to normalized SPM space '
+             'from the morphologist outputs, without running '
+             'transform.py first.')
+    parser.add_argument(
+        "-o", "--engine", type=str, default=_ENGINE_DEFAULT, choices=_ENGINES,
+        help='inprocess: normalization and crop are done in memory and only '
+             'the crop is written; external: AimsApplyTransform and '
+             'AimsSubVolume command lines are used. '
+             'Default is : ' + _ENGINE_DEFAULT)
+    parser.add_argument(
+        "-w", "--crop_aware", action='store_true',
+        help='With the inprocess engine, resamples only the voxels inside '
+             'the bounding box instead of the whole normalized volume.')
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=_JOBS_DEFAULT,
+        help='Number of worker processes cropping the files. '
+             'Default is : ' + str(_JOBS_DEFAULT))
+    parser.add_argument(
+        "-x", "--resume", action='store_true',
+        help='Skips subjects whose crop is complete and whose inputs and '
+             'parameters are unchanged, according to the completion '
+             'manifest Lcompletion.json or Rcompletion.json of tgt_dir. '
+             'Crops are only recorded in the manifest in this mode.')
+    parser.add_argument(
+        "-a", "--array", action='store_true',
+        help='Writes the crops into a single memory-mapped array '
+             'Lskeleton.npy or Rskeleton.npy of shape (N, X, Y, Z), with '
+             'the subject of each row in Lskeleton_subjects.csv or '
+             'Rskeleton_subjects.csv, instead of the pickle file.')
+    parser.add_argument(
+        "-k", "--no_nifti", action='store_true',
+        help='With --array, doesn\'t write the per-subject NIfTI crops.')
+    parser.add_argument(
+        "-l", "--region", type=str, nargs='+', action='append',
+        metavar=('NAME', 'SULCUS'),
+        help='Named region and its list of sulci, cropped in tgt_dir/NAME. '
+             'Can be given several times: each subject is then normalized '
+             'once and cropped in every region. Example: '
+             '-l STs_ant sulcus_1 sulcus_2 -l central sulcus_3. '
+             'If not given, the region is defined by --sulcus.')
+    parser.add_argument(
+        "-z", "--sparse", action='store_true',
+        help='Stores the crops in the pickle file as sparse skeletons '
+             '(coordinates and labels of the nonzero voxels) '
+             'instead of dense arrays.')
 
     params = {}
 
@@ -394,7 +1037,27 @@ def parse_args(argv):
     params['interp'] = args.interp
     params['resampling'] = args.resampling
     params['out_voxel_size'] = tuple(args.out_voxel_size)
+    params['resample_method'] = args.resample_method
+    params['cache_dir'] = args.cache_dir
+    params['threads'] = args.threads
     params['morphologist_dir'] = args.morphologist_dir
+    params['manifest'] = args.manifest
+    params['transform_store'] = args.transform_store
+    params['compute_transforms'] = args.compute_transforms
+    params['engine'] = args.engine
+    params['crop_aware'] = args.crop_aware
+    params['jobs'] = args.jobs
+    params['resume'] = args.resume
+    params['array'] = args.array
+    params['nifti'] = not args.no_nifti
+    params['sparse'] = args.sparse
+    if args.region:
+        for region in args.region:
+            if len(region) < 2:
+                raise ValueError("a region needs a name and at least a sulcus")
+        params['regions'] = {region[0]: region[1:] for region in args.region}
+    else:
+        params['regions'] = None
 
     number_subjects = args.nb_subjects
 
@@ -421,7 +1084,13 @@ def dataset_gen_pipe(src_dir=_SRC_DIR_DEFAULT, tgt_dir=_TGT_DIR_DEFAULT,
                      side=_SIDE_DEFAULT, list_sulci=_SULCUS_DEFAULT,
                      number_subjects=_ALL_SUBJECTS, interp=_INTERP_DEFAULT,
                      resampling=_RESAMPLING_DEFAULT,
-                     out_voxel_size=_OUT_VOXEL_SIZE):
+                     out_voxel_size=_OUT_VOXEL_SIZE,
+                     resample_method=_RESAMPLE_METHOD_DEFAULT,
+                     manifest=None, transform_store=None,
+                     compute_transforms=False, engine=_ENGINE_DEFAULT,
+                     crop_aware=False, jobs=_JOBS_DEFAULT, resume=False,
+                     array=False, nifti=True, regions=None, sparse=False,
+                     cache_dir=None, threads=_THREADS_DEFAULT):
     """Main program generating cropped files and corresponding pickle file
     """
 
@@ -431,7 +1100,20 @@ def dataset_gen_pipe(src_dir=_SRC_DIR_DEFAULT, tgt_dir=_TGT_DIR_DEFAULT,
                                      morphologist_dir=morphologist_dir,
                                      side=side, list_sulci=list_sulci,
                                      interp=interp, resampling=resampling,
-                                     out_voxel_size=out_voxel_size)
+                                     out_voxel_size=out_voxel_size,
+                                     resample_method=resample_method,
+                                     manifest=manifest,
+                                     transform_store=transform_store,
+                                     compute_transforms=compute_transforms,
+                                     engine=engine,
+                                     crop_aware=crop_aware,
+                                     jobs=jobs,
+                                     resume=resume,
+                                     array=array, nifti=nifti,
+                                     regions=regions,
+                                     sparse=sparse,
+                                     cache_dir=cache_dir,
+                                     threads=threads)
     dataset.dataset_gen_pipe(number_subjects=number_subjects)
 
 
@@ -458,7 +1140,21 @@ def main(argv):
                          interp=params['interp'],
                          number_subjects=params['nb_subjects'],
                          resampling=params['resampling'],
-                         out_voxel_size=params['out_voxel_size'])
+                         out_voxel_size=params['out_voxel_size'],
+                         resample_method=params['resample_method'],
+                         manifest=params['manifest'],
+                         transform_store=params['transform_store'],
+                         compute_transforms=params['compute_transforms'],
+                         engine=params['engine'],
+                         crop_aware=params['crop_aware'],
+                         jobs=params['jobs'],
+                         resume=params['resume'],
+                         array=params['array'],
+                         nifti=params['nifti'],
+                         regions=params['regions'],
+                         sparse=params['sparse'],
+                         cache_dir=params['cache_dir'],
+                         threads=params['threads'])
     except SystemExit as exc:
         if exc.code != 0:
             six.reraise(*sys.exc_info())
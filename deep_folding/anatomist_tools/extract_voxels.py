@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+# /usr/bin/env python2.7 + brainvisa compliant env
+#
+#  This software and supporting documentation are distributed by
+#      Institut Federatif de Recherche 49
+#      CEA/NeuroSpin, Batiment 145,
+#      91191 Gif-sur-Yvette cedex
+#      France
+#      France
+#
+# This software is governed by the CeCILL license version 2 under
+# French law and abiding by the rules of distribution of free software.
+# You can  use, modify and/or redistribute the software under the
+# terms of the CeCILL license version 2 as circulated by CEA, CNRS
+# and INRIA at the following URL "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license version 2 and that you accept its terms.
+
+"""
+The aim of this script is to extract, once per subject, the voxels of every
+label of a manually labelled graph into a compact store
+
+For each graph, it writes a compressed .npz file containing, for each label,
+the voxels of all its buckets as int16 coordinates, together with the voxel
+size and the Talairach affine of the graph (see utils/voxel_store.py).
+Bounding boxes can then be computed from the stores without reading the
+graphs again (option --store_dir of bounding_box.py).
+
+Examples:
+        $ python extract_voxels.py -s /path/to/database -t /path/to/store -i both
+        $ python extract_voxels.py --help
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import os
+import argparse
+import six
+
+import numpy as np
+
+from soma import aims
+from deep_folding.anatomist_tools.bounding_box import BoundingBoxMax
+from deep_folding.anatomist_tools.utils.logs import LogJson
+from deep_folding.anatomist_tools.utils.parallel import parallel_map
+from deep_folding.anatomist_tools.utils.voxel_store import SulcalVoxelStore
+from deep_folding.anatomist_tools.utils.voxel_store import store_file_name
+from deep_folding.anatomist_tools.utils.voxel_store import write_voxel_store
+
+_ALL_SUBJECTS = -1
+
+# Default directory in which lies the manually segmented database
+_SRC_DIR_DEFAULT = "/neurospin/lnao/PClean/database_learnclean/all/"
+
+# Default directory to which we write the voxel stores
+_TGT_DIR_DEFAULT = "/neurospin/dico/data/deep_folding/test/voxel_store"
+
+# Gives the relative path to the manually labelled graph .arg
+_PATH_TO_GRAPH_DEFAULT = "t1mri/t1/default_analysis/folds/3.3/base2018_manual"
+
+# hemisphere 'L', 'R' or 'both'
+_SIDE_DEFAULT = 'both'
+
+# Number of worker processes reading the graphs (1 = serial run)
+_JOBS_DEFAULT = 1
+
+
+def extract_graph_voxels(graph_filename):
+    """Extracts the voxels of all labels of a graph
+
+    Args:
+        graph_filename: name of the graph file .arg
+
+    Returns:
+        label_voxels: dictionary whose keys are label names and whose values
+            are (N,3) arrays of voxel coordinates (all buckets concatenated)
+        voxel_size: numpy array giving the voxel size of the graph
+        tal_matrix: (4,4) numpy array from graph space to AIMS Talairach
+    """
+    graph = aims.read(graph_filename)
+    voxel_size = np.array(graph['voxel_size'][:3])
+    tal_matrix = aims.GraphManip.talairach(graph).toMatrix()
+    label_voxels = BoundingBoxMax.get_graph_label_voxels(graph)
+    return label_voxels, voxel_size, tal_matrix
+
+
+class VoxelStoreExtractor:
+    """Writes one voxel store per labelled graph
+
+    Subjects are listed as in bounding_box.py
+    """
+
+    def __init__(self, src_dir=_SRC_DIR_DEFAULT,
+                 path_to_graph=_PATH_TO_GRAPH_DEFAULT,
+                 tgt_dir=_TGT_DIR_DEFAULT,
+                 side='L',
+                 jobs=_JOBS_DEFAULT):
+        """Inits with list of directories
+
+        Args:
+            src_dir: list of strings naming ful path source directories
+            path_to_graph: list of strings naming relative path to labelled
+                graph
+            tgt_dir: name of target directory with full path
+            side: hemisphere side (either L for left, or R for right)
+            jobs: number of worker processes reading the graphs
+        """
+        self.tgt_dir = tgt_dir
+        self.side = side
+        self.jobs = jobs
+        self.box = BoundingBoxMax(src_dir=src_dir,
+                                  path_to_graph=path_to_graph,
+                                  tgt_dir=tgt_dir,
+                                  sulcus=None, side=side)
+
+    def extract_one_graph(self, graph_filename):
+        """Writes the store of one graph, unless it is up-to-date
+
+        Args:
+            graph_filename: name of the graph file .arg
+
+        Returns:
+            store_file: name of the store file
+        """
+        store_file = store_file_name(self.tgt_dir, graph_filename)
+        if os.path.isfile(store_file) \
+                and SulcalVoxelStore(store_file).is_up_to_date(graph_filename):
+            return store_file
+
+        label_voxels, voxel_size, tal_matrix = \
+            extract_graph_voxels(graph_filename)
+        write_voxel_store(store_file, label_voxels, voxel_size, tal_matrix,
+                          graph_filename=graph_filename)
+        return store_file
+
+    def extract_graphs(self, number_subjects=_ALL_SUBJECTS):
+        """Writes the stores of all subjects
+
+        Args:
+            number_subjects: number of subjects to analyze
+
+        Returns:
+            store_files: list of store file names, in the subject order
+        """
+        if not number_subjects:
+            return []
+
+        subjects = self.box.select_subjects(number_subjects)
+        graph_filenames = self.box.get_graph_filenames(subjects)
+        return parallel_map(self.extract_one_graph, graph_filenames,
+                            jobs=self.jobs)
+
+
+def extract_voxels(src_dir=_SRC_DIR_DEFAULT, tgt_dir=_TGT_DIR_DEFAULT,
+                   path_to_graph=_PATH_TO_GRAPH_DEFAULT,
+                   sides=('L', 'R'), number_subjects=_ALL_SUBJECTS,
+                   jobs=_JOBS_DEFAULT):
+    """High-level API function writing the voxel stores
+
+    Args:
+        src_dir: list of strings -> directories of the supervised databases
+        tgt_dir: string giving target directory path
+        path_to_graph: string giving relative path to manually labelled graph
+        sides: list of hemisphere sides, among 'L' and 'R'
+        number_subjects: integer giving the number of subjects to analyze,
+            by default it is set to _ALL_SUBJECTS (-1).
+        jobs: number of worker processes reading the graphs (1 = serial)
+    """
+    json = LogJson(os.path.join(tgt_dir, 'voxel_store.json'))
+    json.write_general_info()
+    json.update(dict_to_add={'src_dir': src_dir,
+                             'tgt_dir': tgt_dir,
+                             'path_to_graph': path_to_graph,
+                             'sides': list(sides)})
+
+    for side in sides:
+        extractor = VoxelStoreExtractor(src_dir=src_dir,
+                                        path_to_graph=path_to_graph,
+                                        tgt_dir=tgt_dir,
+                                        side=side, jobs=jobs)
+        store_files = extractor.extract_graphs(number_subjects=number_subjects)
+        json.update(dict_to_add={'nb_subjects_' + side: len(store_files)})
+
+
+def parse_args(argv):
+    """Function parsing command-line arguments
+
+    Args:
+        argv: a list containing command line arguments
+
+    Returns:
+        params: a dictionary with all arugments as keys
+    """
+
+    # Parse command line arguments
+    parser = argparse.ArgumentParser(
+        prog='extract_voxels.py',
+        description='Extracts the voxels of all labels of labelled graphs')
+    parser.add_argument(
+        "-s", "--src_dir", type=str, default=_SRC_DIR_DEFAULT, nargs='+',
+        help='Source directory where the labelled graphs lie. '
+             'If there are several directories, add all directories '
+             'one after the other. Example: -s DIR_1 DIR_2. '
+             'Default is : ' + _SRC_DIR_DEFAULT)
+    parser.add_argument(
+        "-t", "--tgt_dir", type=str, default=_TGT_DIR_DEFAULT,
+        help='Target directory where to store the voxel stores. '
+             'Default is : ' + _TGT_DIR_DEFAULT)
+    parser.add_argument(
+        "-p", "--path_to_graph", type=str,
+        default=_PATH_TO_GRAPH_DEFAULT,
+        help='Relative path to manually labelled graph. '
+             'Default is ' + _PATH_TO_GRAPH_DEFAULT)
+    parser.add_argument(
+        "-i", "--side", type=str, default=_SIDE_DEFAULT,
+        help='Hemisphere side (L, R or both). Default is : ' + _SIDE_DEFAULT)
+    parser.add_argument(
+        "-n", "--nb_subjects", type=str, default="all",
+        help='Number of subjects to take into account, or \'all\'. '
+             '0 subject is allowed, for debug purpose. '
+             'Default is : all')
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=_JOBS_DEFAULT,
+        help='Number of worker processes reading the graphs. '
+             'Default is : ' + str(_JOBS_DEFAULT))
+
+    params = {}
+
+    args = parser.parse_args(argv)
+    params['src_dir'] = args.src_dir  # src_dir is a list
+    params['tgt_dir'] = args.tgt_dir
+    params['path_to_graph'] = args.path_to_graph
+    params['sides'] = ['L', 'R'] if args.side == 'both' else [args.side]
+    params['jobs'] = args.jobs
+
+    number_subjects = args.nb_subjects
+
+    # Check if nb_subjects is either the string "all" or a positive integer
+    try:
+        if number_subjects == "all":
+            number_subjects = _ALL_SUBJECTS
+        else:
+            number_subjects = int(number_subjects)
+            if number_subjects < 0:
+                raise ValueError
+    except ValueError:
+        raise ValueError("nb_subjects must be either the string \"all\" "
+                         "or an integer")
+    params['nb_subjects'] = number_subjects
+
+    return params
+
+
+def main(argv):
+    """Reads argument line and writes the voxel stores
+
+    Args:
+        argv: a list containing command line arguments
+    """
+
+    # This code permits to catch SystemExit with exit code 0
+    # such as the one raised when "--help" is given as argument
+    try:
+        # Parsing arguments
+        params = parse_args(argv)
+        # Actual API
+        extract_voxels(src_dir=params['src_dir'],
+                       tgt_dir=params['tgt_dir'],
+                       path_to_graph=params['path_to_graph'],
+                       sides=params['sides'],
+                       number_subjects=params['nb_subjects'],
+                       jobs=params['jobs'])
+    except SystemExit as exc:
+        if exc.code != 0:
+            six.reraise(*sys.exc_info())
+
+
+######################################################################
+# Main program
+######################################################################
+
+if __name__ == '__main__':
+    # This permits to call main also from another python program
+    # without having to make system calls
+    main(argv=sys.argv[1:])
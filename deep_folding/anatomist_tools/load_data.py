@@ -5,12 +5,12 @@ images.
 from __future__ import division
 import os
 
-from soma import aims
-
 import pandas as pd
 import numpy as np
 import re
 
+from deep_folding.anatomist_tools.utils.sparse_skeleton import SparseSkeleton
+
 
 def is_file_nii(filename):
     """Tests if file is nii file
@@ -21,14 +21,36 @@ def is_file_nii(filename):
     Returns:
         is_file_nii: boolean stating if file is nii file
     """
+    basename = os.path.basename(filename)
     is_file_nii = os.path.isfile(filename)\
-                  and '.nii' in filename \
-                  and '.minf' not in filename \
-                  and 'normalized' in filename
+                  and '.nii' in basename \
+                  and '.minf' not in basename \
+                  and 'normalized' in basename
     return is_file_nii
 
 
-def fetch_data(cropped_dir, tgt_dir=None, side=None):
+def crop_subject(filename):
+    """Returns the subject of a crop file, or None if it is not a crop
+
+    Only complete crops, whose name ends with <subject>_normalized.nii(.gz),
+    are kept: crops being written (<subject>_partial.nii.gz) and temporary
+    files left in the crop directory are not crops.
+
+    Args:
+        filename: string giving file name with full path
+
+    Returns:
+        subject: string giving the subject id, or None
+    """
+    if not is_file_nii(filename):
+        return None
+    match = re.search(r'(\d{4,12})_normalized\.nii(\.gz)?$',
+                      os.path.basename(filename))
+    return match.group(1) if match else None
+
+
+def fetch_data(cropped_dir, tgt_dir=None, side=None, subjects=None,
+               sparse=False):
     """
     Creates a dataframe of data with a column for each subject and associated
     np.array. Generation a dataframe of "normal" images and a dataframe of
@@ -39,18 +61,34 @@ def fetch_data(cropped_dir, tgt_dir=None, side=None):
         cropped_dir: directory containing cropped images
         tgt_dir: directory where to save the pickle file
         side: hemisphere side, either 'L' for left or 'R' for right hemisphere
+        subjects: if given, list of subjects giving the order of the first
+            columns; other crops of cropped_dir follow, sorted by file name.
+            By default, columns are sorted by file name.
+        sparse: if True, each crop is stored as a SparseSkeleton
+            (coordinates and labels of its nonzero voxels)
+            instead of a dense array
     """
 
+    from soma import aims
+
     data_dict = dict()
 
-    for filename in os.listdir(cropped_dir):
+    for filename in sorted(os.listdir(cropped_dir)):
         file_nii = os.path.join(cropped_dir, filename)
-        if is_file_nii(file_nii):
+        subject = crop_subject(file_nii)
+        if subject is not None:
             aimsvol = aims.read(file_nii)
-            sample = np.asarray(aimsvol)
-            subject = re.search('(\d{4,12})', file_nii).group(1)
+            if sparse:
+                sample = SparseSkeleton.from_volume(aimsvol)
+            else:
+                sample = np.asarray(aimsvol)
             data_dict[subject] = [sample]
 
+    if subjects is not None:
+        order = [subject for subject in subjects if subject in data_dict]
+        order += [subject for subject in data_dict if subject not in order]
+        data_dict = {subject: data_dict[subject] for subject in order}
+
     dataframe = pd.DataFrame.from_dict(data_dict)
 
     file_pickle_basename = side + 'skeleton.pkl'
@@ -0,0 +1,340 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  This software and supporting documentation are distributed by
+#      Institut Federatif de Recherche 49
+#      CEA/NeuroSpin, Batiment 145,
+#      91191 Gif-sur-Yvette cedex
+#      France
+#
+# This software is governed by the CeCILL license version 2 under
+# French law and abiding by the rules of distribution of free software.
+# You can  use, modify and/or redistribute the software under the
+# terms of the CeCILL license version 2 as circulated by CEA, CNRS
+# and INRIA at the following URL "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license version 2 and that you accept its terms.
+
+"""
+The aim of this script is to scan once a database tree and to write a manifest
+of the files used by the per-subject scripts
+
+For each subject directory, the manifest records the paths of the labelled
+graphs, the skeletons, the normalized SPM image and the transformation to
+Talairach MNI, with their sizes and modification times. The tree is scanned
+with os.scandir and a pool of threads, which is much faster than successive
+listdir/isdir/exists calls on a network filesystem. bounding_box.py,
+transform.py, dataset_gen_pipe.py and benchmark_generation.py can then load
+the manifest (option --manifest) instead of walking the tree.
+
+Examples:
+        $ python manifest.py -s /neurospin/hcp/ANALYSIS/3T_morphologist \
+                             -o /path/to/manifest.json
+        $ python manifest.py --help
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from multiprocessing.pool import ThreadPool
+
+import six
+
+_SRC_DIR_DEFAULT = "/neurospin/hcp/ANALYSIS/3T_morphologist"
+_MANIFEST_FILE_DEFAULT = \
+    "/neurospin/dico/data/deep_folding/test/manifest/manifest.json"
+
+# Number of threads scanning subject directories
+_THREADS_DEFAULT = 16
+
+# Files recorded for each subject of a morphologist analysis tree
+# Keys are manifest keys, values are paths relative to the subject directory
+# 'subject' is the ID of the subject; glob wildcards are allowed
+_MORPHOLOGIST_PATTERNS = {
+    'normalized_spm':
+        't1mri/default_acquisition/normalized_SPM_%(subject)s.nii',
+    'to_talairach_MNI':
+        't1mri/default_acquisition/registration/'
+        'RawT1-%(subject)s_default_acquisition_TO_Talairach-MNI.trm',
+    'Lskeleton':
+        't1mri/default_acquisition/default_analysis/segmentation/'
+        'Lskeleton_%(subject)s.nii.gz',
+    'Rskeleton':
+        't1mri/default_acquisition/default_analysis/segmentation/'
+        'Rskeleton_%(subject)s.nii.gz',
+    'Lgraph':
+        't1mri/default_acquisition/default_analysis/folds/3.1/'
+        'default_session_auto/L%(subject)s_default_session_auto.arg',
+    'Rgraph':
+        't1mri/default_acquisition/default_analysis/folds/3.1/'
+        'default_session_auto/R%(subject)s_default_session_auto.arg'}
+
+# Relative path to the manually labelled graphs of a supervised database
+_PATH_TO_GRAPH_DEFAULT = "t1mri/t1/default_analysis/folds/3.3/base2018_manual"
+
+
+def supervised_patterns(path_to_graph=_PATH_TO_GRAPH_DEFAULT):
+    """Returns the patterns of the files of a manually labelled database
+
+    The graph patterns are the ones searched by bounding_box.py
+    for the same path_to_graph.
+
+    Args:
+        path_to_graph: string giving relative path to manually labelled graph
+
+    Returns:
+        patterns: dictionary of manifest keys and relative path patterns
+    """
+    return {side + 'graph': path_to_graph + '/' + side + '%(subject)s*.arg'
+            for side in ('L', 'R')}
+
+
+# Files recorded for each subject of a manually labelled database
+_SUPERVISED_PATTERNS = supervised_patterns()
+
+
+def file_record(filename):
+    """Returns the manifest record of a file, or None if it doesn't exist
+
+    Args:
+        filename: string giving file name with full path
+    """
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    return {'path': filename, 'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+def scan_subject(subject_dir, subject, patterns):
+    """Records the files of one subject
+
+    Args:
+        subject_dir: directory of the subject
+        subject: subject ID
+        patterns: dictionary of manifest keys and relative path patterns
+
+    Returns:
+        records: dictionary whose keys are manifest keys and whose values
+            are file records (None for missing files)
+    """
+    records = {}
+    for key, pattern in patterns.items():
+        filename = os.path.join(subject_dir, pattern % {'subject': subject})
+        if glob.has_magic(filename):
+            matches = sorted(glob.glob(filename))
+            filename = matches[0] if matches else filename
+        records[key] = file_record(filename)
+    return records
+
+
+def build_manifest(src_dir=_SRC_DIR_DEFAULT,
+                   manifest_file=_MANIFEST_FILE_DEFAULT,
+                   patterns=None, threads=_THREADS_DEFAULT):
+    """Scans a database tree and writes its manifest
+
+    Subjects are the subdirectories of src_dir, sorted by name.
+
+    Args:
+        src_dir: root directory containing one subdirectory per subject
+        manifest_file: json file to write
+        patterns: dictionary of manifest keys and relative path patterns;
+            by default, files of the morphologist analysis
+        threads: number of threads scanning subject directories
+
+    Returns:
+        manifest: DatasetManifest object
+    """
+    patterns = _MORPHOLOGIST_PATTERNS if patterns is None else patterns
+
+    subjects = sorted(entry.name for entry in os.scandir(src_dir)
+                      if entry.is_dir())
+
+    pool = ThreadPool(processes=max(threads, 1))
+    try:
+        records = pool.map(
+            lambda subject: scan_subject(os.path.join(src_dir, subject),
+                                         subject, patterns),
+            subjects)
+    finally:
+        pool.close()
+        pool.join()
+
+    content = {'src_dir': src_dir,
+               'timestamp': time.time(),
+               'patterns': patterns,
+               'subjects': dict(zip(subjects, records))}
+
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_file))
+    if not os.path.exists(manifest_dir):
+        os.makedirs(manifest_dir)
+    with open(manifest_file, "w") as f:
+        f.write(json.dumps(content, sort_keys=True, indent=4))
+
+    return DatasetManifest(manifest_file)
+
+
+class DatasetManifest:
+    """Gives access to the content of a manifest file
+
+    Attributes:
+        src_dir: root directory that has been scanned
+        patterns: dictionary of manifest keys and relative path patterns
+            of the recorded files
+        subjects: sorted list of subject IDs
+    """
+
+    def __init__(self, manifest_file):
+        """Loads the manifest file
+
+        Args:
+            manifest_file: json file written by build_manifest
+        """
+        self.manifest_file = manifest_file
+        with open(manifest_file, "r") as f:
+            content = json.load(f)
+        self.src_dir = content['src_dir']
+        self.patterns = content.get('patterns', {})
+        self.records = content['subjects']
+        self.subjects = sorted(self.records)
+
+    def record(self, subject, key):
+        """Returns the file record of a subject, or None if missing
+
+        Args:
+            subject: subject ID
+            key: manifest key, for example 'Lskeleton'
+        """
+        return self.records.get(subject, {}).get(key)
+
+    def path(self, subject, key):
+        """Returns the file path of a subject, or None if missing
+
+        Args:
+            subject: subject ID
+            key: manifest key, for example 'Lskeleton'
+        """
+        record = self.record(subject, key)
+        return None if record is None else record['path']
+
+    def subjects_with(self, *keys):
+        """Returns the sorted list of subjects having all the given files
+
+        Args:
+            keys: manifest keys, for example 'Lskeleton', 'normalized_spm'
+        """
+        return [subject for subject in self.subjects
+                if all(self.record(subject, key) for key in keys)]
+
+
+def parse_args(argv):
+    """Function parsing command-line arguments
+
+    Args:
+        argv: a list containing command line arguments
+
+    Returns:
+        params: dictionary with keys: src_dir, manifest_file, patterns, threads
+    """
+
+    # Parse command line arguments
+    parser = argparse.ArgumentParser(
+        prog='manifest.py',
+        description='Scans a database tree and writes its manifest')
+    parser.add_argument(
+        "-s", "--src_dir", type=str, default=_SRC_DIR_DEFAULT,
+        help='Root directory containing one subdirectory per subject. '
+             'Default is : ' + _SRC_DIR_DEFAULT)
+    parser.add_argument(
+        "-o", "--manifest_file", type=str, default=_MANIFEST_FILE_DEFAULT,
+        help='Manifest json file to write. '
+             'Default is : ' + _MANIFEST_FILE_DEFAULT)
+    parser.add_argument(
+        "-u", "--supervised", action='store_true',
+        help='Records the manually labelled graphs of a supervised '
+             'database instead of the morphologist analysis files.')
+    parser.add_argument(
+        "-g", "--path_to_graph", type=str, default=_PATH_TO_GRAPH_DEFAULT,
+        help='Relative path to manually labelled graph, '
+             'used with --supervised. '
+             'Default is ' + _PATH_TO_GRAPH_DEFAULT)
+    parser.add_argument(
+        "-p", "--pattern", type=str, nargs=2, action='append',
+        metavar=('KEY', 'PATTERN'),
+        help='Adds or replaces a recorded file, given by its manifest key '
+             'and its path relative to the subject directory, '
+             'for example: -p Lgraph "t1mri/%%(subject)s*.arg"')
+    parser.add_argument(
+        "-j", "--threads", type=int, default=_THREADS_DEFAULT,
+        help='Number of threads scanning the subject directories. '
+             'Default is : ' + str(_THREADS_DEFAULT))
+
+    args = parser.parse_args(argv)
+    patterns = dict(supervised_patterns(args.path_to_graph)
+                    if args.supervised else _MORPHOLOGIST_PATTERNS)
+    if args.pattern:
+        patterns.update(dict(args.pattern))
+
+    params = {'src_dir': args.src_dir,
+              'manifest_file': args.manifest_file,
+              'patterns': patterns,
+              'threads': args.threads}
+
+    return params
+
+
+def main(argv):
+    """Reads argument line and writes the manifest
+
+    Args:
+        argv: a list containing command line arguments
+    """
+
+    # This code permits to catch SystemExit with exit code 0
+    # such as the one raised when "--help" is given as argument
+    try:
+        # Parsing arguments
+        params = parse_args(argv)
+        # Actual API
+        manifest = build_manifest(src_dir=params['src_dir'],
+                                  manifest_file=params['manifest_file'],
+                                  patterns=params['patterns'],
+                                  threads=params['threads'])
+        print("Number of subjects in manifest: ", len(manifest.subjects))
+    except SystemExit as exc:
+        if exc.code != 0:
+            six.reraise(*sys.exc_info())
+
+
+######################################################################
+# Main program
+######################################################################
+
+if __name__ == '__main__':
+    # This permits to call main also from another python program
+    # without having to make system calls
+    main(argv=sys.argv[1:])
@@ -58,16 +58,71 @@ import os
 from os import listdir
 from os.path import join
 
+import numpy as np
 import six
 from soma import aims
 
+from deep_folding.anatomist_tools.manifest import DatasetManifest
+from deep_folding.anatomist_tools.utils.aims_io import read_header
 from deep_folding.anatomist_tools.utils.logs import LogJson
+from deep_folding.anatomist_tools.utils.parallel import parallel_map
+from deep_folding.anatomist_tools.utils.transform_store import \
+    _TRANSFORM_STORE_FILE
+from deep_folding.anatomist_tools.utils.transform_store import TransformStore
+from deep_folding.anatomist_tools.utils.transform_store import read_trm
+from deep_folding.anatomist_tools.utils.transform_store import round_as_trm
+from deep_folding.anatomist_tools.utils.transform_store import \
+    write_transform_store
 
 _ALL_SUBJECTS = -1
 
 _SRC_DIR_DEFAULT = "/neurospin/hcp"
 _TGT_DIR_DEFAULT = "/neurospin/dico/data/deep_folding/test/transform"
 
+# Number of worker processes computing the transforms (1 = serial run)
+_JOBS_DEFAULT = 1
+
+
+def compose_transform(to_talairach_MNI_file, normalized_spm_file):
+    """Returns the transformation from native to normalized SPM space
+
+    It is mni_to_normalized_spm * natif_to_mni, computed from the
+    morphologist outputs of a subject. Coefficients are rounded as in
+    .trm files, so that the matrix is the one read back from the .trm file.
+
+    Args:
+        to_talairach_MNI_file: transformation file from native space to
+            Talairach MNI space
+        normalized_spm_file: normalized SPM image of the subject
+
+    Returns:
+        natif_to_normalized_spm: aims.AffineTransformation3d
+    """
+
+    # Reads transformation file that goes from native space to
+    # Talairach MNI space.
+    # The Talairach MNI space has the brain centered, which means
+    # that the coordinates can be negative.
+    # The normalized SPM (or template SPM) has only positive coordinates
+    # and its axes are inverted with respect to Talairach MNI
+    natif_to_mni = aims.read(to_talairach_MNI_file)
+
+    # Fetches template's transformation from Talairach MNI to normalized SPM
+    # The first transformation[0] of the file normalized_spm
+    # is the transformation from normalized SPM to Talairach MNI
+    # The transformation between normalized SPM and Talairach MNI
+    # Only the header is read: the volume itself is not needed
+    normalized_spm_header = read_header(normalized_spm_file)
+    normalized_spm_to_mni = normalized_spm_header['transformations'][0]
+    mni_to_normalized_spm = \
+        aims.AffineTransformation3d(normalized_spm_to_mni).inverse()
+
+    # Combination of transformations
+    natif_to_normalized_spm = mni_to_normalized_spm * natif_to_mni
+
+    return aims.AffineTransformation3d(
+        round_as_trm(natif_to_normalized_spm.toMatrix()))
+
 
 class TransformToSPM:
     """Computes transformation from native to normalized SPM space
@@ -78,7 +133,9 @@ class TransformToSPM:
                 in which the transformations are saved.
     """
 
-    def __init__(self, src_dir=_SRC_DIR_DEFAULT, tgt_dir=_TGT_DIR_DEFAULT):
+    def __init__(self, src_dir=_SRC_DIR_DEFAULT, tgt_dir=_TGT_DIR_DEFAULT,
+                 manifest=None, jobs=_JOBS_DEFAULT, force=False,
+                 trm_files=True):
         """Inits Transform class with source and target directory names
 
         It also creates the target directory if it doesn't exist
@@ -87,9 +144,19 @@ class TransformToSPM:
             src_dir: string naming src directory
             tgt_dir: string naming target directory in which transformtion files
                      are saved
+            manifest: manifest file written by manifest.py; if given,
+                     subjects and input files are read from it
+            jobs: number of worker processes computing the transforms
+            force: if True, transforms are recomputed even if up to date
+            trm_files: if True, one .trm file per subject is written
+                     in addition to the transform store
         """
         self.src_dir = src_dir
         self.tgt_dir = tgt_dir
+        self.manifest = DatasetManifest(manifest) if manifest else None
+        self.jobs = jobs
+        self.force = force
+        self.trm_files = trm_files
 
         # Below are subdirectories and files from the morphologist pipeline
         # Once the database directory (like /neurospin/hcp) is defined,
@@ -111,21 +178,26 @@ class TransformToSPM:
         # 'subject' is the ID of the subject
         self.natif_to_normalized_spm_file = \
             "natif_to_template_spm_%(subject)s.trm"
+        # Store of the transformations of all subjects
+        self.store_file = join(self.tgt_dir, _TRANSFORM_STORE_FILE)
+        self.previous_store = None
 
         # Creates json log class
         json_file = join(self.tgt_dir, 'transform.json')
         self.json = LogJson(json_file)
 
-    def calculate_one_transform(self, subject_id):
-        """Calculates the transformation file of a given subject.
-
-        This transformation enables to go from native space (= MRI space) to
-        normalized SPM space. The normalized SPM space  is
-        a translation + an axis inversion of the Talairach MNI space.
-        The transformation is directly written to the file
+    def subject_files(self, subject_id):
+        """Returns the input and output file names of a given subject
 
         Args:
-            subject_id: id of subject whose transformation file is computed
+            subject_id: id of subject
+
+        Returns:
+            to_talairach_MNI_file: transformation from native space to
+                Talairach MNI space (input)
+            normalized_spm_file: normalized SPM image (input)
+            natif_to_normalized_spm_file: transformation from native space
+                to normalized SPM space (output)
         """
 
         # Identifies 'subject' in a mapping (for file and directory namings)
@@ -135,34 +207,106 @@ class TransformToSPM:
         subject_dir = \
             join(self.morphologist_dir, self.acquisition_dir % subject)
 
-        # Reads transformation file that goes from native space to
-        # Talairach MNI space.
-        # The Talairach MNI space has the brain centered, which means
-        # that the coordinates can be negative.
-        # The normalized SPM (or template SPM) has only positive coordinates
-        # and its axes are inverted with respect to Talairach MNI
         to_talairach_MNI_file = join(subject_dir,
                                      self.to_talairach_MNI_file % subject)
-        natif_to_mni = aims.read(to_talairach_MNI_file)
-
-        # Fetches template's transformation from Talairach MNI to normalized SPM
-        # The first transformation[0] of the file normalized_spm
-        # is the transformation from normalized SPM to Talairach MNI
-        # The transformation between normalized SPM and Talairach MNI
-        normalized_spm = aims.read(
-            join(subject_dir, self.normalized_spm_file % subject))
-        normalized_spm_to_mni = normalized_spm.header()['transformations'][0]
-        mni_to_normalized_spm = \
-            aims.AffineTransformation3d(normalized_spm_to_mni).inverse()
-        # print(template.header()['transformations'][0])
-
-        # Combination of transformations
-        natif_to_normalized_spm = mni_to_normalized_spm * natif_to_mni
-
-        # Saving of transformation files
+        normalized_spm_file = join(subject_dir,
+                                   self.normalized_spm_file % subject)
+        if self.manifest:
+            to_talairach_MNI_file = self.manifest.path(subject_id,
+                                                       'to_talairach_MNI')
+            normalized_spm_file = self.manifest.path(subject_id,
+                                                     'normalized_spm')
         natif_to_normalized_spm_file = join(
             self.tgt_dir, self.natif_to_normalized_spm_file % subject)
-        aims.write(natif_to_normalized_spm, natif_to_normalized_spm_file)
+
+        return (to_talairach_MNI_file, normalized_spm_file,
+                natif_to_normalized_spm_file)
+
+    def is_up_to_date(self, subject_id):
+        """Checks if the transformation file of a subject is up to date
+
+        It is up to date if it exists and is not older than the
+        registration .trm file and the normalized SPM image. Without .trm
+        files, the transform store of the previous run is checked instead.
+
+        Args:
+            subject_id: id of subject
+        """
+        to_talairach_MNI_file, normalized_spm_file, output_file = \
+            self.subject_files(subject_id)
+        if not self.trm_files:
+            if self.previous_store is None \
+                    or subject_id not in self.previous_store:
+                return False
+            output_file = self.store_file
+        if not os.path.exists(output_file):
+            return False
+        return os.path.getmtime(output_file) >= max(
+            os.path.getmtime(to_talairach_MNI_file),
+            os.path.getmtime(normalized_spm_file))
+
+    def calculate_one_transform(self, subject_id):
+        """Calculates the transformation file of a given subject.
+
+        This transformation enables to go from native space (= MRI space) to
+        normalized SPM space. The normalized SPM space  is
+        a translation + an axis inversion of the Talairach MNI space.
+        The transformation is directly written to the file
+
+        Args:
+            subject_id: id of subject whose transformation file is computed
+
+        Returns:
+            matrix: (4,4) array of the transformation
+        """
+
+        to_talairach_MNI_file, normalized_spm_file, \
+            natif_to_normalized_spm_file = self.subject_files(subject_id)
+
+        # Combination of native to Talairach MNI and
+        # Talairach MNI to normalized SPM transformations
+        natif_to_normalized_spm = compose_transform(to_talairach_MNI_file,
+                                                    normalized_spm_file)
+
+        # Saving of transformation files
+        if self.trm_files:
+            aims.write(natif_to_normalized_spm, natif_to_normalized_spm_file)
+
+        return natif_to_normalized_spm.toMatrix()
+
+    def up_to_date_matrix(self, subject_id):
+        """Returns the matrix of a subject whose transform is up to date
+
+        Args:
+            subject_id: id of subject
+        """
+        if self.previous_store is not None \
+                and subject_id in self.previous_store:
+            return self.previous_store.matrix(subject_id)
+        return read_trm(self.subject_files(subject_id)[2])
+
+    def process_one_subject(self, subject_id):
+        """Calculates the transformation of a subject if needed
+
+        Errors are caught so that one bad subject doesn't stop the others.
+
+        Args:
+            subject_id: id of subject
+
+        Returns:
+            status: 'done', 'skipped' (up to date) or 'failed'
+            message: error message if failed, empty string otherwise
+            matrix: (4,4) array of the transformation, None if failed
+        """
+        print("subject : " + subject_id)
+        try:
+            if not self.force and self.is_up_to_date(subject_id):
+                return 'skipped', '', self.up_to_date_matrix(subject_id)
+            matrix = self.calculate_one_transform(subject_id)
+        except Exception as exc:
+            print("subject " + subject_id + " failed: " + str(exc))
+            return 'failed', str(exc), None
+        return 'done', '', matrix
 
     def calculate_transforms(self, number_subjects=_ALL_SUBJECTS):
         """Calculates transformation file for all subjects.
@@ -177,7 +321,12 @@ class TransformToSPM:
 
         if number_subjects:
             # subjects are detected as the directory names under src_dir
-            list_all_subjects = listdir(self.morphologist_dir)
+            # or, with a manifest, as the subjects having the input files
+            if self.manifest:
+                list_all_subjects = self.manifest.subjects_with(
+                    'normalized_spm', 'to_talairach_MNI')
+            else:
+                list_all_subjects = listdir(self.morphologist_dir)
 
             self.json.write_general_info()
 
@@ -197,25 +346,64 @@ class TransformToSPM:
                            'tgt_dir': self.tgt_dir}
             self.json.update(dict_to_add=dict_to_add)
 
+            # Transformations of the previous run
+            if os.path.exists(self.store_file):
+                self.previous_store = TransformStore(self.store_file)
+
             # Computes and saves transformation files for all listed subjects
-            for subject in list_subjects:
-                print("subject : " + subject)
-                self.calculate_one_transform(subject)
+            results = parallel_map(self.process_one_subject, list_subjects,
+                                   jobs=self.jobs)
+
+            # Writes per-subject outcome to json file
+            outcome = {'done': [], 'skipped': [], 'failed': {}}
+            matrices = {}
+            if self.previous_store is not None:
+                matrices = dict(zip(self.previous_store.subjects,
+                                    self.previous_store.matrices))
+            for subject, (status, message, matrix) in zip(list_subjects,
+                                                          results):
+                if status == 'failed':
+                    outcome['failed'][subject] = message
+                    # The matrix of the previous run is stale
+                    matrices.pop(subject, None)
+                else:
+                    outcome[status].append(subject)
+                    matrices[subject] = matrix
+
+            # Writes the store of all transformations in a single file
+            subjects = sorted(matrices)
+            write_transform_store(self.store_file, subjects,
+                                  [matrices[subject] for subject in subjects])
+            self.json.update(dict_to_add={
+                'subjects_done': outcome['done'],
+                'subjects_skipped': outcome['skipped'],
+                'subjects_failed': outcome['failed']})
+            print("transforms computed: %d, up to date: %d, failed: %d"
+                  % (len(outcome['done']), len(outcome['skipped']),
+                     len(outcome['failed'])))
 
 
 def transform_to_spm(src_dir=_SRC_DIR_DEFAULT,
                      tgt_dir=_TGT_DIR_DEFAULT,
-                     number_subjects=_ALL_SUBJECTS):
+                     number_subjects=_ALL_SUBJECTS,
+                     manifest=None, jobs=_JOBS_DEFAULT, force=False,
+                     trm_files=True):
     """High-level API function performing the transform
 
     Args:
         src_dir: source directory name, full path
         tgt_dir: target directory where to save the transformations, full path
         number_subjects: number of subjects to analyze (all=-1 by default)
+        manifest: manifest file written by manifest.py (None by default)
+        jobs: number of worker processes (1 = serial run)
+        force: if True, recomputes transforms that are up to date
+        trm_files: if False, only the transform store is written
     """
 
     # Do the actual transformations
-    transformer = TransformToSPM(src_dir=src_dir, tgt_dir=tgt_dir)
+    transformer = TransformToSPM(src_dir=src_dir, tgt_dir=tgt_dir,
+                                 manifest=manifest, jobs=jobs, force=force,
+                                 trm_files=trm_files)
     transformer.calculate_transforms(number_subjects=number_subjects)
 
 
@@ -229,6 +417,11 @@ def parse_args(argv):
         src_dir: source directory name, full path
         tgt_dir: target directory where to save the transformations, full path
         number_subjects: number of subjects to analyze
+        manifest: manifest file name, or None
+        jobs: number of worker processes
+        force: True if up-to-date transforms are recomputed
+        trm_files: False if only the transform store is written
+        export_trm: True if .trm files are exported from the store
     """
 
     # Parse command line arguments
@@ -248,6 +441,28 @@ def parse_args(argv):
         help='Number of subjects to take into account, or \'all\'.'
              '0 subject is allowed, for debug purpose.'
              'Default is : all')
+    parser.add_argument(
+        "-g", "--manifest", type=str, default=None,
+        help='Manifest file written by manifest.py. If given, subjects '
+             'and input files are read from it instead of walking the tree. '
+             'Default is : None')
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=_JOBS_DEFAULT,
+        help='Number of worker processes computing the transforms. '
+             'Default is : ' + str(_JOBS_DEFAULT))
+    parser.add_argument(
+        "-f", "--force", action='store_true',
+        help='Recomputes all transforms, even the ones that are newer '
+             'than their input files.')
+    parser.add_argument(
+        "-x", "--no_trm_files", action='store_true',
+        help='Writes only the transform store ' + _TRANSFORM_STORE_FILE +
+             ' holding the transformations of all subjects, '
+             'without one .trm file per subject.')
+    parser.add_argument(
+        "-e", "--export_trm", action='store_true',
+        help='Exports one .trm file per subject from the transform store '
+             'of the target directory, without computing transforms.')
 
     args = parser.parse_args(argv)
     src_dir = args.src_dir
@@ -266,7 +481,8 @@ def parse_args(argv):
         raise ValueError(
             "number_subjects must be either the string \"all\" or an integer")
 
-    return src_dir, tgt_dir, number_subjects
+    return (src_dir, tgt_dir, number_subjects, args.manifest,
+            args.jobs, args.force, not args.no_trm_files, args.export_trm)
 
 
 def main(argv):
@@ -282,9 +498,15 @@ def main(argv):
     # such as the one raised when "--help" is given as argument
     try:
         # Parsing arguments
-        src_dir, tgt_dir, number_subjects = parse_args(argv)
+        src_dir, tgt_dir, number_subjects, manifest, jobs, force, \
+            trm_files, export_trm = parse_args(argv)
         # Actual API
-        transform_to_spm(src_dir, tgt_dir, number_subjects)
+        if export_trm:
+            store = TransformStore(join(tgt_dir, _TRANSFORM_STORE_FILE))
+            store.export_trm(tgt_dir)
+        else:
+            transform_to_spm(src_dir, tgt_dir, number_subjects, manifest,
+                             jobs, force, trm_files)
     except SystemExit as exc:
         if exc.code != 0:
             six.reraise(*sys.exc_info())
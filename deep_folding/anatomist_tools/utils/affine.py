@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  This software and supporting documentation are distributed by
+#      Institut Federatif de Recherche 49
+#      CEA/NeuroSpin, Batiment 145,
+#      91191 Gif-sur-Yvette cedex
+#      France
+#
+# This software is governed by the CeCILL license version 2 under
+# French law and abiding by the rules of distribution of free software.
+# You can  use, modify and/or redistribute the software under the
+# terms of the CeCILL license version 2 as circulated by CEA, CNRS
+# and INRIA at the following URL "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license version 2 and that you accept its terms.
+
+"""
+The aim of this script is to apply affine transformations to arrays of points
+in one batched numpy operation, instead of calling the aims transformation
+point by point
+"""
+
+import numpy as np
+
+
+def bucket_to_array(bucket):
+    """Converts the voxels of an aims bucket into a (N,3) numpy array
+
+    The list of voxel coordinates is converted by numpy in a single call,
+    without creating one array per voxel.
+
+    Args:
+        bucket: aims BucketMap; only its first time step bucket[0] is read
+
+    Returns:
+        voxels: (N,3) numpy array of integer voxel coordinates
+    """
+    return np.array(list(bucket[0].keys()), dtype=int).reshape(-1, 3)
+
+
+def apply_affine(matrix, points):
+    """Applies a 4x4 affine matrix to a (N,3) array of points
+
+    The sum is done component by component in the same order as
+    aims.AffineTransformation3d.transform(), so that the result is
+    bit-identical to transforming each point separately.
+
+    Args:
+        matrix: (4,4) numpy array (for example aims transform.toMatrix())
+        points: (N,3) numpy array of point coordinates
+
+    Returns:
+        transformed: (N,3) numpy array of float64 transformed coordinates
+    """
+    matrix = np.asarray(matrix, dtype=np.float64)
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    transformed = np.empty_like(points)
+    for row in range(3):
+        transformed[:, row] = matrix[row, 0] * points[:, 0] \
+                              + matrix[row, 1] * points[:, 1] \
+                              + matrix[row, 2] * points[:, 2] \
+                              + matrix[row, 3]
+    return transformed
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  This software and supporting documentation are distributed by
+#      Institut Federatif de Recherche 49
+#      CEA/NeuroSpin, Batiment 145,
+#      91191 Gif-sur-Yvette cedex
+#      France
+#
+# This software is governed by the CeCILL license version 2 under
+# French law and abiding by the rules of distribution of free software.
+# You can  use, modify and/or redistribute the software under the
+# terms of the CeCILL license version 2 as circulated by CEA, CNRS
+# and INRIA at the following URL "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license version 2 and that you accept its terms.
+
+"""
+The aim of this script is to put together light-weight aims readers:
+header-only reading of images and memoized reading of template transforms
+
+soma.aims is only imported when a reader is called, so that modules using
+these readers can be imported without it.
+"""
+
+# Process-level memo of template transformations, keyed by resource path
+_TEMPLATE_TRANSFORMS = {}
+
+
+def read_header(filename):
+    """Reads only the header of an image file (.nii, .nii.gz...)
+
+    The voxels are not read, which avoids decoding the whole volume
+    when only the voxel size, the dimensions or the transformations
+    are needed.
+
+    Args:
+        filename: string giving image file name with full path
+
+    Returns:
+        header: header of the image, a dictionary-like aims object
+    """
+    from soma import aims
+
+    finder = aims.Finder()
+    if not finder.check(filename):
+        raise IOError("Cannot read header of file " + filename)
+    return finder.header()
+
+
+def read_template_transform(resource):
+    """Reads a transformation from the brainvisa shared resources
+
+    The transformation is read once per process and kept in memory;
+    a copy is returned so that callers can't modify the memoized one.
+
+    Args:
+        resource: resource path relative to brainvisa share directory,
+            for example 'transformation/talairach_TO_spm_template_novoxels.trm'
+
+    Returns:
+        transformation: aims.AffineTransformation3d
+    """
+    from soma import aims
+
+    if resource not in _TEMPLATE_TRANSFORMS:
+        _TEMPLATE_TRANSFORMS[resource] = aims.read(
+            aims.carto.Paths.findResourceFile(resource))
+    return aims.AffineTransformation3d(_TEMPLATE_TRANSFORMS[resource])
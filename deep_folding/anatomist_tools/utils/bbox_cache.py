@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  This software and supporting documentation are distributed by
+#      Institut Federatif de Recherche 49
+#      CEA/NeuroSpin, Batiment 145,
+#      91191 Gif-sur-Yvette cedex
+#      France
+#
+# This software is governed by the CeCILL license version 2 under
+# French law and abiding by the rules of distribution of free software.
+# You can  use, modify and/or redistribute the software under the
+# terms of the CeCILL license version 2 as circulated by CEA, CNRS
+# and INRIA at the following URL "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license version 2 and that you accept its terms.
+
+"""
+The aim of this script is to keep a persistent cache of per-subject bounding
+boxes, so that only new or modified graphs are read again
+"""
+
+import json
+import os
+
+import numpy as np
+
+
+class BoundingBoxCache:
+    """Persistent cache of per-subject and per-sulcus bounding boxes
+
+    Entries are keyed by the graph file name and are valid as long as
+    the size and the modification time of the graph file are unchanged.
+    Each entry contains the AIMS Talairach boxes of all sulci of the graph,
+    together with the mode ('voxel', 'vertex'...) used to compute them.
+    """
+
+    def __init__(self, cache_file):
+        """Loads the cache file if it exists
+
+        Args:
+            cache_file: string giving the path/filename to the json cache file
+        """
+        self.cache_file = cache_file
+        self.entries = {}
+        if os.path.isfile(self.cache_file):
+            with open(self.cache_file, "r") as f:
+                self.entries = json.load(f)
+
+    @staticmethod
+    def file_signature(filename):
+        """Returns the (size, mtime) signature of a file
+
+        Args:
+            filename: string giving file name with full path
+        """
+        stat = os.stat(filename)
+        return stat.st_size, stat.st_mtime
+
+    def get(self, graph_filename, mode=None):
+        """Returns the cached boxes of a graph, or None if not up-to-date
+
+        Args:
+            graph_filename: string giving graph file name with full path
+            mode: string giving how boxes have been computed
+
+        Returns:
+            boxes: dictionary whose keys are sulci names and whose values
+                are tuples (bbox_min, bbox_max) of numpy arrays, or None
+        """
+        entry = self.entries.get(os.path.abspath(graph_filename))
+        if entry is None:
+            return None
+        size, mtime = self.file_signature(graph_filename)
+        if entry['size'] != size or entry['mtime'] != mtime \
+                or entry.get('mode') != mode:
+            return None
+        return {sulcus: (np.array(box[0]), np.array(box[1]))
+                for sulcus, box in entry['boxes'].items()}
+
+    def set(self, graph_filename, boxes, mode=None):
+        """Stores the boxes of a graph
+
+        Args:
+            graph_filename: string giving graph file name with full path
+            boxes: dictionary whose keys are sulci names and whose values
+                are tuples (bbox_min, bbox_max)
+            mode: string giving how boxes have been computed
+        """
+        size, mtime = self.file_signature(graph_filename)
+        self.entries[os.path.abspath(graph_filename)] = {
+            'size': size,
+            'mtime': mtime,
+            'mode': mode,
+            'boxes': {sulcus: [np.asarray(box[0]).tolist(),
+                               np.asarray(box[1]).tolist()]
+                      for sulcus, box in boxes.items()}}
+
+    def save(self):
+        """Writes the cache file
+
+        The file is first written under a temporary name, then renamed,
+        so that an interrupted run never leaves a truncated cache.
+        """
+        cache_dir = os.path.dirname(os.path.abspath(self.cache_file))
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        tmp_file = self.cache_file + '.tmp'
+        with open(tmp_file, "w") as f:
+            f.write(json.dumps(self.entries, sort_keys=True, indent=4))
+        os.replace(tmp_file, self.cache_file)
@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  This software and supporting documentation are distributed by
+#      Institut Federatif de Recherche 49
+#      CEA/NeuroSpin, Batiment 145,
+#      91191 Gif-sur-Yvette cedex
+#      France
+#
+# This software is governed by the CeCILL license version 2 under
+# French law and abiding by the rules of distribution of free software.
+# You can  use, modify and/or redistribute the software under the
+# terms of the CeCILL license version 2 as circulated by CEA, CNRS
+# and INRIA at the following URL "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license version 2 and that you accept its terms.
+
+"""
+The aim of this script is to keep track of the outputs that are complete,
+so that an interrupted run can be resumed
+
+The completion manifest is a json file with one entry per subject. An entry
+holds the signatures (path, mtime, size, sha1) of the input files, the
+parameters used to compute the output and the checksum of the output.
+A subject is complete if its inputs, its parameters and its output
+haven't changed since the entry has been written.
+
+During a run, entries are appended one per line to a journal file next to
+the manifest, so that recording a subject doesn't rewrite the whole
+manifest. The journal is merged into the manifest when it is saved.
+"""
+
+import hashlib
+import json
+import os
+
+# Size of the blocks read to compute checksums
+_BLOCK_SIZE = 1 << 20
+
+# Extension of the journal file appended to the manifest file name
+_JOURNAL_EXTENSION = '.journal'
+
+
+def file_hash(filename):
+    """Returns the sha1 checksum of a file
+
+    Args:
+        filename: string giving file name with full path
+    """
+    sha1 = hashlib.sha1()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(_BLOCK_SIZE), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def file_signature(filename):
+    """Returns path, modification time, size and checksum of a file
+
+    Args:
+        filename: string giving file name with full path
+    """
+    stat = os.stat(filename)
+    return {'path': filename,
+            'mtime': stat.st_mtime,
+            'size': stat.st_size,
+            'sha1': file_hash(filename)}
+
+
+def is_unchanged(signature, filename):
+    """Checks if a file still matches its signature
+
+    The checksum is only computed again if the modification time
+    or the size has changed.
+
+    Args:
+        signature: dictionary returned by file_signature
+        filename: string giving file name with full path
+    """
+    if signature['path'] != filename or not os.path.exists(filename):
+        return False
+    stat = os.stat(filename)
+    if stat.st_mtime == signature['mtime'] \
+            and stat.st_size == signature['size']:
+        return True
+    return file_hash(filename) == signature['sha1']
+
+
+def completion_entry(inputs, params, output_file):
+    """Returns the completion entry of an output that has just been written
+
+    Args:
+        inputs: dictionary whose keys are input names and whose values
+            are input file names
+        params: dictionary of parameters (json serializable)
+        output_file: output file name
+
+    Returns:
+        entry: dictionary to give to CompletionManifest.add
+    """
+    return {'inputs': {key: file_signature(filename)
+                       for key, filename in inputs.items()},
+            'params': json.loads(json.dumps(params)),
+            'output': output_file,
+            'checksum': file_hash(output_file)}
+
+
+def replace_output(tmp_file, output_file):
+    """Renames a completely written temporary file to its final name
+
+    The .minf file written by aims alongside the image is renamed too.
+    Renaming is atomic, so that readers never see a partial output.
+
+    Args:
+        tmp_file: name of the temporary file
+        output_file: final name
+    """
+    os.replace(tmp_file, output_file)
+    if os.path.exists(tmp_file + '.minf'):
+        os.replace(tmp_file + '.minf', output_file + '.minf')
+
+
+class CompletionManifest:
+    """Reads and writes the completion manifest of a run
+
+    Attributes:
+        manifest_file: name of the json file
+        journal_file: name of the journal of entries appended since
+            the last save
+        entries: dictionary whose keys are subjects and whose values are
+            completion entries
+    """
+
+    def __init__(self, manifest_file):
+        """Reads the manifest file and its journal if they exist
+
+        Args:
+            manifest_file: name of the json file
+        """
+        self.manifest_file = manifest_file
+        self.journal_file = manifest_file + _JOURNAL_EXTENSION
+        self.entries = {}
+        if os.path.exists(manifest_file):
+            with open(manifest_file, "r") as f:
+                self.entries = json.load(f)
+        if os.path.exists(self.journal_file):
+            with open(self.journal_file, "r") as f:
+                for line in f:
+                    try:
+                        subject, entry = json.loads(line)
+                    except ValueError:
+                        # Empty line, or line truncated by an interruption
+                        continue
+                    self.entries[subject] = entry
+
+    def is_complete(self, subject, inputs, params, output_file):
+        """Checks if the output of a subject is complete and up to date
+
+        Args:
+            subject: subject ID
+            inputs: dictionary whose keys are input names and whose values
+                are input file names
+            params: dictionary of parameters (json serializable)
+            output_file: output file name
+        """
+        entry = self.entries.get(subject)
+        if entry is None \
+                or entry['output'] != output_file \
+                or entry['params'] != json.loads(json.dumps(params)) \
+                or sorted(entry['inputs']) != sorted(inputs):
+            return False
+        if not all(is_unchanged(entry['inputs'][key], filename)
+                   for key, filename in inputs.items()):
+            return False
+        return os.path.exists(output_file) \
+            and file_hash(output_file) == entry['checksum']
+
+    def add(self, subject, entry):
+        """Adds or replaces the entry of a subject
+
+        Args:
+            subject: subject ID
+            entry: dictionary returned by completion_entry
+        """
+        self.entries[subject] = entry
+
+    def append(self, subject, entry):
+        """Adds the entry of a subject and appends it to the journal
+
+        The entry is kept if the run is interrupted before save.
+
+        Args:
+            subject: subject ID
+            entry: dictionary returned by completion_entry
+        """
+        self.add(subject, entry)
+        # Each entry starts a new line, even after a truncated one
+        with open(self.journal_file, "a") as f:
+            f.write('\n' + json.dumps([subject, entry], sort_keys=True))
+
+    def save(self):
+        """Writes the manifest file atomically and removes the journal
+        """
+        tmp_file = self.manifest_file + '.tmp'
+        with open(tmp_file, "w") as f:
+            f.write(json.dumps(self.entries, sort_keys=True, indent=4))
+        os.replace(tmp_file, self.manifest_file)
+        if os.path.exists(self.journal_file):
+            os.remove(self.journal_file)
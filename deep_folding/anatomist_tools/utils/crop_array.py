@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  This software and supporting documentation are distributed by
+#      Institut Federatif de Recherche 49
+#      CEA/NeuroSpin, Batiment 145,
+#      91191 Gif-sur-Yvette cedex
+#      France
+#
+# This software is governed by the CeCILL license version 2 under
+# French law and abiding by the rules of distribution of free software.
+# You can  use, modify and/or redistribute the software under the
+# terms of the CeCILL license version 2 as circulated by CEA, CNRS
+# and INRIA at the following URL "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license version 2 and that you accept its terms.
+
+"""
+The aim of this script is to write the crops of all subjects into a single
+memory-mapped array
+
+The array is a .npy file of shape (N, X, Y, Z), preallocated before the
+crops are computed. Each subject's crop is written into its own row,
+possibly from worker processes. A sidecar .csv file gives the subject of
+each row. Reading the array doesn't need soma.aims.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+# Data type of skeleton crops
+_CROP_DTYPE = np.int16
+
+
+def create_crop_array(array_file, nb_subjects, crop_shape,
+                      dtype=_CROP_DTYPE):
+    """Preallocates the array of crops, filled with zeros
+
+    Args:
+        array_file: name of the .npy file
+        nb_subjects: number of rows
+        crop_shape: shape (X, Y, Z) of one crop
+        dtype: data type of the array
+    """
+    array = np.lib.format.open_memmap(
+        array_file, mode='w+', dtype=dtype,
+        shape=(nb_subjects,) + tuple(int(s) for s in crop_shape))
+    array.flush()
+    del array
+
+
+def write_crop_row(array_file, row, crop):
+    """Writes the crop of one subject into its row of the array
+
+    Args:
+        array_file: name of the .npy file created by create_crop_array
+        row: row index of the subject
+        crop: array of shape (X, Y, Z) or (X, Y, Z, 1)
+
+    Raises:
+        ValueError: if the crop doesn't have the shape of the rows
+    """
+    crop = np.asarray(crop)
+    if crop.ndim == 4:
+        crop = crop[..., 0]
+    array = np.load(array_file, mmap_mode='r+')
+    if crop.shape != array.shape[1:]:
+        raise ValueError("crop of shape " + str(crop.shape)
+                         + " doesn't fit in rows of shape "
+                         + str(array.shape[1:]))
+    array[row] = crop
+    array.flush()
+    del array
+
+
+def compact_crop_array(array_file, rows):
+    """Keeps only the given rows of the array, in the given order
+
+    It is used to drop the rows of subjects whose crop couldn't be
+    computed. The array is rewritten only if some rows are dropped.
+
+    Args:
+        array_file: name of the .npy file
+        rows: list of row indices to keep
+    """
+    array = np.load(array_file, mmap_mode='r')
+    if list(rows) == list(range(array.shape[0])):
+        return
+    tmp_file = array_file + '.tmp.npy'
+    compacted = np.lib.format.open_memmap(
+        tmp_file, mode='w+', dtype=array.dtype,
+        shape=(len(rows),) + array.shape[1:])
+    for new_row, row in enumerate(rows):
+        compacted[new_row] = array[row]
+    compacted.flush()
+    del compacted
+    del array
+    os.replace(tmp_file, array_file)
+
+
+def write_subjects_index(index_file, subjects):
+    """Writes the sidecar file giving the subject of each row
+
+    Args:
+        index_file: name of the .csv file
+        subjects: list of subject IDs, in the order of the rows
+    """
+    pd.DataFrame(subjects).to_csv(index_file)
+
+
+def read_crop_array(array_file, index_file):
+    """Reads the array of crops and the subject of each row
+
+    The array is memory-mapped: crops are only read when accessed.
+
+    Args:
+        array_file: name of the .npy file
+        index_file: name of the sidecar .csv file
+
+    Returns:
+        array: read-only memory-mapped array of shape (N, X, Y, Z)
+        subjects: list of N subject IDs
+    """
+    subjects = list(pd.read_csv(index_file, dtype=str)['0'])
+    return np.load(array_file, mmap_mode='r'), subjects
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  This software and supporting documentation are distributed by
+#      Institut Federatif de Recherche 49
+#      CEA/NeuroSpin, Batiment 145,
+#      91191 Gif-sur-Yvette cedex
+#      France
+#
+# This software is governed by the CeCILL license version 2 under
+# French law and abiding by the rules of distribution of free software.
+# You can  use, modify and/or redistribute the software under the
+# terms of the CeCILL license version 2 as circulated by CEA, CNRS
+# and INRIA at the following URL "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license version 2 and that you accept its terms.
+
+"""
+The aim of this script is to cache on disk the index maps of
+nearest neighbour resampling
+
+The same transformation and target grid are used to resample many volumes
+(original and altered skeletons, reruns with new boxes). The gather and
+scatter index maps of nn_resample only depend on the transformation and on
+the geometries: they are stored as .npy files, named after a hash of these
+parameters, and read back as memory maps. The least recently used maps are
+evicted when the cache exceeds its size.
+"""
+
+import glob
+import hashlib
+import os
+
+import numpy as np
+
+# Maximal size of the cache on disk, in bytes
+_CACHE_SIZE_DEFAULT = 4 * 1024 ** 3
+
+# Suffixes of the two index maps of a key
+_GATHER_SUFFIX = '_gather.npy'
+_SCATTER_SUFFIX = '_scatter.npy'
+
+
+class GatherMapCache:
+    """Size-bounded directory of resampling index maps
+    """
+
+    def __init__(self, cache_dir, max_size=_CACHE_SIZE_DEFAULT):
+        """Inits the cache, creating its directory if needed
+
+        Args:
+            cache_dir: directory where the index maps are stored
+            max_size: maximal size of the cache, in bytes
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    @staticmethod
+    def key(matrix, in_shape, in_voxel_size, new_dim, out_voxel_size,
+            crop=None):
+        """Returns the key of the index maps of a resampling
+
+        Args:
+            matrix: (4,4) matrix from input space to output space, in mm
+            in_shape: dimensions of the input volume
+            in_voxel_size: voxel size of the input volume
+            new_dim: dimensions of the whole output grid
+            out_voxel_size: voxel size of the output volume
+            crop: (bbmin, bbmax) crop window, None for the whole grid
+
+        Returns:
+            hexadecimal sha1 of the parameters
+        """
+        sha1 = hashlib.sha1()
+        sha1.update(np.asarray(matrix, dtype=np.float64).tobytes())
+        for values in (in_shape[:3], new_dim[:3]):
+            sha1.update(np.asarray(values, dtype=np.int64).tobytes())
+        for values in (in_voxel_size[:3], out_voxel_size[:3]):
+            sha1.update(np.asarray(values, dtype=np.float64).tobytes())
+        if crop is not None:
+            sha1.update(np.asarray(crop, dtype=np.int64).tobytes())
+        return sha1.hexdigest()
+
+    def files(self, key):
+        """Returns the gather and scatter file names of a key"""
+        return (os.path.join(self.cache_dir, key + _GATHER_SUFFIX),
+                os.path.join(self.cache_dir, key + _SCATTER_SUFFIX))
+
+    def get(self, key):
+        """Returns the index maps of a key as read-only memory maps
+
+        Args:
+            key: key returned by key()
+
+        Returns:
+            (gather, scatter) index maps, None if they are not cached
+        """
+        files = self.files(key)
+        try:
+            # Modification time of the files gives the eviction order
+            for f in files:
+                os.utime(f, None)
+            return tuple(np.load(f, mmap_mode='r') for f in files)
+        except (IOError, OSError):
+            # Not cached, or evicted by another process
+            return None
+
+    def put(self, key, gather, scatter):
+        """Stores the index maps of a key, then evicts old maps if needed
+
+        Files are written under a temporary name and renamed,
+        so that concurrent processes never read partial maps.
+
+        Args:
+            key: key returned by key()
+            gather: index map returned by nn_resample.gather_index
+            scatter: index map returned by nn_resample.scatter_index
+        """
+        for f, index in zip(self.files(key), (gather, scatter)):
+            tmp_file = f[:-len('.npy')] + '.%d.tmp.npy' % os.getpid()
+            np.save(tmp_file, index)
+            os.replace(tmp_file, f)
+        self.evict(keep=key)
+
+    def size(self):
+        """Returns the size of the cache, in bytes"""
+        return sum(os.path.getsize(f)
+                   for f in glob.glob(os.path.join(self.cache_dir, '*.npy')))
+
+    def evict(self, keep=None):
+        """Removes the least recently used maps until the cache fits its size
+
+        Args:
+            keep: key never removed (the maps just stored)
+        """
+        entries = {}
+        for f in glob.glob(os.path.join(self.cache_dir, '*' + _GATHER_SUFFIX)):
+            key = os.path.basename(f)[:-len(_GATHER_SUFFIX)]
+            if key == keep or '.tmp' in key:
+                continue
+            try:
+                entries[key] = (os.path.getmtime(f),
+                                sum(os.path.getsize(g)
+                                    for g in self.files(key)
+                                    if os.path.exists(g)))
+            except OSError:
+                # Removed by another process
+                continue
+
+        size = self.size()
+        for key in sorted(entries, key=lambda k: entries[k][0]):
+            if size <= self.max_size:
+                break
+            for f in self.files(key):
+                if os.path.exists(f):
+                    os.remove(f)
+            size -= entries[key][1]
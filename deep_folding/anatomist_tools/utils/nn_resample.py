@@ -0,0 +1,559 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  This software and supporting documentation are distributed by
+#      Institut Federatif de Recherche 49
+#      CEA/NeuroSpin, Batiment 145,
+#      91191 Gif-sur-Yvette cedex
+#      France
+#
+# This software is governed by the CeCILL license version 2 under
+# French law and abiding by the rules of distribution of free software.
+# You can  use, modify and/or redistribute the software under the
+# terms of the CeCILL license version 2 as circulated by CEA, CNRS
+# and INRIA at the following URL "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license version 2 and that you accept its terms.
+
+"""
+The aim of this script is to resample label volumes (skeletons) with
+nearest neighbours, using numpy only
+
+It does in batched numpy operations what resample.resample does label
+by label with aims buckets:
+    - the inverse transformation is applied to the output grid, by slabs of
+      planes along z, and each output voxel takes the label of its nearest
+      input voxel (same labels as AimsApplyTransform). Slabs can be
+      processed by several threads;
+    - the forward transformation is applied to all nonzero input voxels
+      at once, so that thin structures are not lost when downsampling.
+      In each output voxel, the scattered labels and the gathered one are
+      merged in a defined priority order, as the aims buckets written
+      label by label over the gathered volume.
+
+Axis-aligned transformations (axis permutations, flips, translations and
+voxel size ratios) are detected: the gather step is then done with slices,
+flips and transposes of the input volume, with the same result.
+
+Both steps only depend on the transformation and on the geometries: they
+can be precomputed as index maps (gather_index and scatter_index), reused
+for all volumes sharing a transformation (see gather_cache).
+"""
+
+import numpy as np
+
+from deep_folding.anatomist_tools.utils.parallel import thread_map
+
+# Number of planes along z processed at once
+_SLAB_SIZE = 8
+
+
+def voxel_matrix(matrix, in_voxel_size, out_voxel_size):
+    """Returns the transformation between voxel indices
+
+    Args:
+        matrix: (4,4) matrix from input space to output space, in mm
+        in_voxel_size: voxel size of the input volume
+        out_voxel_size: voxel size of the output volume
+
+    Returns:
+        (4,4) matrix from input voxel indices to output voxel indices
+    """
+    scale_in = np.diag(list(np.asarray(in_voxel_size[:3], dtype=float))
+                       + [1.])
+    scale_out = np.diag(list(1. / np.asarray(out_voxel_size[:3], dtype=float))
+                        + [1.])
+    return scale_out.dot(np.asarray(matrix, dtype=float)).dot(scale_in)
+
+
+def nearest_index(coords):
+    """Rounds voxel coordinates to the nearest voxel index
+
+    Coordinates are shifted by one half and truncated towards zero:
+    coordinates in ]-1.5, 0.5[ give index 0. On the reference skeleton,
+    it gives the same labels as AimsApplyTransform with nearest neighbours
+    (see tests/test_resample.py).
+
+    Args:
+        coords: float array of voxel coordinates
+
+    Returns:
+        integer array of voxel indices
+    """
+    return (coords + 0.5).astype(int)
+
+
+def slabs(dim, slab_size=_SLAB_SIZE):
+    """Splits planes along z into slabs
+
+    Args:
+        dim: number of planes
+        slab_size: number of planes of a slab
+
+    Returns:
+        list of (first plane, last plane + 1)
+    """
+    return [(k, min(k + slab_size, dim)) for k in range(0, dim, slab_size)]
+
+
+def slab_sources(inv_matrix, in_shape, out_dim, offset, slab):
+    """Returns the nearest input voxels of one slab of output planes
+
+    Args:
+        inv_matrix: (4,4) matrix from output voxel indices
+            to input voxel indices
+        in_shape: dimensions of the input volume
+        out_dim: dimensions of the output grid (or crop window)
+        offset: voxel index of the first voxel of the window
+            in the whole output grid
+        slab: (first plane, last plane + 1) along z in the window
+
+    Returns:
+        coords: (3, X, Y, K) input voxel indices
+        inside: (X, Y, K) boolean array, True where coords are in the volume
+    """
+    inv_matrix = np.asarray(inv_matrix, dtype=float)
+    i, j, k = np.meshgrid(np.arange(out_dim[0]) + offset[0],
+                          np.arange(out_dim[1]) + offset[1],
+                          np.arange(slab[0], slab[1]) + offset[2],
+                          indexing='ij', sparse=True)
+    coords = nearest_index(inv_matrix[:3, 0, None, None, None] * i
+                           + inv_matrix[:3, 1, None, None, None] * j
+                           + inv_matrix[:3, 2, None, None, None] * k
+                           + inv_matrix[:3, 3, None, None, None])
+    in_shape = np.array(in_shape[:3]).reshape(3, 1, 1, 1)
+    inside = np.all((coords >= 0) & (coords < in_shape), axis=0)
+    return coords, inside
+
+
+def gather_labels(vol, inv_matrix, out_dim, offset=(0, 0, 0),
+                  background=0, out=None, threads=1):
+    """Gives each output voxel the label of its nearest input voxel
+
+    The output grid is processed by slabs of planes along z, so that
+    memory stays proportional to one slab. Slabs are written into the
+    shared output array, possibly from several threads.
+
+    Args:
+        vol: (X, Y, Z) array of labels
+        inv_matrix: (4,4) matrix from output voxel indices
+            to input voxel indices
+        out_dim: dimensions of the output grid (or crop window)
+        offset: voxel index of the first voxel of the window
+            in the whole output grid
+        background: label of voxels falling outside of the input volume
+        out: (X, Y, Z) output array; allocated if None
+        threads: number of threads processing the slabs
+
+    Returns:
+        out: (X, Y, Z) array of labels
+    """
+    out_dim = [int(d) for d in out_dim[:3]]
+    if out is None:
+        out = np.empty(out_dim, dtype=vol.dtype)
+
+    def gather_slab(slab):
+        coords, inside = slab_sources(inv_matrix, vol.shape, out_dim,
+                                      offset, slab)
+        values = np.full(inside.shape, background, dtype=out.dtype)
+        values[inside] = vol[coords[0][inside],
+                             coords[1][inside],
+                             coords[2][inside]]
+        out[:, :, slab[0]:slab[1]] = values
+
+    thread_map(gather_slab, slabs(out_dim[2]), threads=threads)
+    return out
+
+
+def axis_alignment(inv_matrix):
+    """Tells if a transformation maps each axis onto one axis
+
+    Args:
+        inv_matrix: (4,4) matrix from output voxel indices
+            to input voxel indices
+
+    Returns:
+        axes: list giving for each input axis the output axis it depends on,
+            None if the transformation is not axis-aligned
+    """
+    linear = np.asarray(inv_matrix, dtype=float)[:3, :3]
+    nonzero = linear != 0
+    if not (nonzero.sum(axis=0) == 1).all() or \
+            not (nonzero.sum(axis=1) == 1).all():
+        return None
+    return [int(np.flatnonzero(row)[0]) for row in nonzero]
+
+
+def axis_selection(index, size):
+    """Returns the voxels of one input axis read along one output axis
+
+    Args:
+        index: 1D array giving the input index of each output position
+        size: number of voxels of the input axis
+
+    Returns:
+        kept: slice of the output positions whose index is in the volume
+        selection: slice of the input axis (strided, possibly reversed)
+            if the indices are evenly spaced, array of indices otherwise
+    """
+    inside = np.flatnonzero((index >= 0) & (index < size))
+    if not len(inside):
+        return slice(0, 0), slice(0, 0)
+    # Indices are monotonic: the output positions inside form a range
+    kept = slice(inside[0], inside[-1] + 1)
+    index = index[kept]
+    steps = np.diff(index)
+    if len(index) == 1:
+        return kept, slice(index[0], index[0] + 1)
+    if steps[0] != 0 and (steps == steps[0]).all():
+        stop = index[-1] + steps[0]
+        return kept, slice(index[0], stop if stop >= 0 else None, steps[0])
+    return kept, index
+
+
+def gather_aligned(vol, inv_matrix, axes, out_dim, offset=(0, 0, 0),
+                   background=0):
+    """Gives each output voxel the label of its nearest input voxel,
+    for an axis-aligned transformation
+
+    Input indices only depend on one output axis: they are computed per
+    axis and the input volume is read with slices (or index arrays),
+    then transposed. The result is the same as with gather_labels.
+
+    Args:
+        vol: (X, Y, Z) array of labels
+        inv_matrix: (4,4) matrix from output voxel indices
+            to input voxel indices
+        axes: output axis of each input axis, returned by axis_alignment
+        out_dim: dimensions of the output grid (or crop window)
+        offset: voxel index of the first voxel of the window
+            in the whole output grid
+        background: label of voxels falling outside of the input volume
+
+    Returns:
+        out: (X, Y, Z) array of labels
+    """
+    inv_matrix = np.asarray(inv_matrix, dtype=float)
+    out_dim = [int(d) for d in out_dim[:3]]
+    out = np.full(out_dim, background, dtype=vol.dtype)
+
+    kept = [None] * 3
+    selected = vol
+    for d, p in enumerate(axes):
+        index = nearest_index(
+            inv_matrix[d, p] * (np.arange(out_dim[p]) + offset[p])
+            + inv_matrix[d, 3])
+        kept[p], selection = axis_selection(index, vol.shape[d])
+        if isinstance(selection, slice):
+            selected = selected[(slice(None),) * d + (selection,)]
+        else:
+            selected = np.take(selected, selection, axis=d)
+
+    # Axis d of the selection is the output axis axes[d]
+    out[tuple(kept)] = np.transpose(selected, np.argsort(axes))
+    return out
+
+
+def gather_index(in_shape, inv_matrix, out_dim, offset=(0, 0, 0),
+                 threads=1):
+    """Returns the flat index of the nearest input voxel of each output voxel
+
+    Output voxels falling outside of the input volume get the index
+    in_size (number of input voxels): gathering from the flattened volume
+    followed by the background value gives the output of gather_labels.
+
+    Args:
+        in_shape: dimensions of the input volume
+        inv_matrix: (4,4) matrix from output voxel indices
+            to input voxel indices
+        out_dim: dimensions of the output grid (or crop window)
+        offset: voxel index of the first voxel of the window
+            in the whole output grid
+        threads: number of threads processing the slabs
+
+    Returns:
+        (X, Y, Z) int32 array of flat input indices
+    """
+    in_shape = tuple(int(d) for d in in_shape[:3])
+    out_dim = [int(d) for d in out_dim[:3]]
+    index = np.empty(out_dim, dtype=np.int32)
+
+    def index_slab(slab):
+        coords, inside = slab_sources(inv_matrix, in_shape, out_dim,
+                                      offset, slab)
+        values = np.full(inside.shape, np.prod(in_shape), dtype=np.int32)
+        values[inside] = np.ravel_multi_index(
+            (coords[0][inside], coords[1][inside], coords[2][inside]),
+            in_shape)
+        index[:, :, slab[0]:slab[1]] = values
+
+    thread_map(index_slab, slabs(out_dim[2]), threads=threads)
+    return index
+
+
+def scatter_targets(coords, matrix, out_shape, new_dim, offset=(0, 0, 0)):
+    """Returns the flat index of the nearest output voxel of input voxels
+
+    Args:
+        coords: (3, N) input voxel indices
+        matrix: (4,4) matrix from input voxel indices
+            to output voxel indices
+        out_shape: dimensions of the output (whole grid or crop window)
+        new_dim: dimensions of the whole output grid
+        offset: voxel index of the first voxel of the window
+            in the whole output grid
+
+    Returns:
+        (N,) int32 array of flat output indices, -1 outside of the window
+    """
+    matrix = np.asarray(matrix, dtype=float)
+    coords = nearest_index(matrix[:3, :3].dot(coords) + matrix[:3, 3:])
+
+    # Negative indices are wrapped, as numpy indexing did in the voxel-wise
+    # loop; indices beyond the grid are dropped
+    new_dim = np.array([int(d) for d in new_dim[:3]]).reshape(3, 1)
+    kept = np.all((coords >= -new_dim) & (coords < new_dim), axis=0)
+    coords = np.where(coords < 0, coords + new_dim, coords)
+
+    # Keeps only the voxels of the window
+    coords = coords - np.array(offset, dtype=int).reshape(3, 1)
+    out_shape = tuple(int(d) for d in out_shape[:3])
+    kept &= np.all((coords >= 0)
+                   & (coords < np.array(out_shape).reshape(3, 1)), axis=0)
+
+    targets = np.full(coords.shape[1], -1, dtype=np.int32)
+    targets[kept] = np.ravel_multi_index(tuple(coords[:, kept]), out_shape)
+    return targets
+
+
+def scatter_index(in_shape, matrix, out_shape, new_dim, offset=(0, 0, 0),
+                  threads=1):
+    """Returns the flat index of the nearest output voxel of each input voxel
+
+    The input volume is processed by slabs of planes along z.
+
+    Args:
+        in_shape: dimensions of the input volume
+        matrix: (4,4) matrix from input voxel indices
+            to output voxel indices
+        out_shape: dimensions of the output (whole grid or crop window)
+        new_dim: dimensions of the whole output grid
+        offset: voxel index of the first voxel of the window
+            in the whole output grid
+        threads: number of threads processing the slabs
+
+    Returns:
+        (X, Y, Z) int32 array of flat output indices, -1 outside
+        of the window
+    """
+    in_shape = [int(d) for d in in_shape[:3]]
+    index = np.empty(in_shape, dtype=np.int32)
+
+    def index_slab(slab):
+        shape = in_shape[:2] + [slab[1] - slab[0]]
+        coords = np.indices(shape).reshape(3, -1)
+        coords[2] += slab[0]
+        index[:, :, slab[0]:slab[1]] = scatter_targets(
+            coords, matrix, out_shape, new_dim, offset=offset).reshape(shape)
+
+    thread_map(index_slab, slabs(in_shape[2]), threads=threads)
+    return index
+
+
+def label_ranks(labels, priority=None):
+    """Returns the rank of each label in the scatter order
+
+    Labels of higher rank overwrite labels of lower rank.
+
+    Args:
+        labels: array of labels
+        priority: sequence of labels, from the lowest to the highest
+            priority. Labels not listed have a lower priority than the
+            listed ones. If None, higher label values have higher priority
+
+    Returns:
+        ranks: integer array of the same shape as labels
+    """
+    values = np.unique(labels)
+    if priority is None:
+        order = list(values)
+    else:
+        priority = [v for v in priority if v in values]
+        order = [v for v in values if v not in priority] + priority
+    rank_of_value = np.empty(len(values), dtype=int)
+    rank_of_value[np.searchsorted(values, order)] = np.arange(len(order))
+    return rank_of_value[np.searchsorted(values, labels)]
+
+
+def write_labels(out, targets, labels, background=0, priority=None):
+    """Writes labels into their flat output indices, in priority order
+
+    When several labels fall into the same output voxel, the label of
+    highest priority is kept. The label already in the output voxel
+    (gathered label), if not background, takes part in the same merge.
+
+    Args:
+        out: output array, modified in place
+        targets: (N,) flat output indices, -1 for labels not written
+        labels: (N,) labels
+        background: label of output voxels that are always overwritten
+        priority: sequence of labels, from the lowest to the highest
+            priority (see label_ranks)
+
+    Returns:
+        out: output array
+    """
+    kept = targets >= 0
+    targets = targets[kept]
+    labels = labels[kept]
+    if not len(labels):
+        return out
+
+    # Appends the gathered labels of the target voxels
+    voxels = np.unique(targets)
+    gathered = out[np.unravel_index(voxels, out.shape[:3])]
+    foreground = gathered != background
+    targets = np.concatenate([targets, voxels[foreground]])
+    labels = np.concatenate([labels, gathered[foreground]])
+
+    # Sorts by priority, then keeps the last label of each output voxel
+    order = np.argsort(label_ranks(labels, priority), kind='stable')
+    flat, last = np.unique(targets[order][::-1], return_index=True)
+    out[np.unravel_index(flat, out.shape[:3])] = labels[order][::-1][last]
+    return out
+
+
+def scatter_labels(vol, matrix, out, new_dim, offset=(0, 0, 0),
+                   background=0, priority=None):
+    """Writes each nonzero input voxel into its nearest output voxel
+
+    When several labels fall into the same output voxel, including the
+    label already in it, the label of highest priority is kept.
+
+    Args:
+        vol: (X, Y, Z) array of labels
+        matrix: (4,4) matrix from input voxel indices
+            to output voxel indices
+        out: (X, Y, Z) output array (whole grid or crop window),
+            modified in place
+        new_dim: dimensions of the whole output grid
+        offset: voxel index of the first voxel of out in the whole grid
+        background: label not scattered
+        priority: sequence of labels, from the lowest to the highest
+            priority (see label_ranks)
+
+    Returns:
+        out: (X, Y, Z) array of labels
+    """
+    points = np.nonzero(vol != background)
+    targets = scatter_targets(np.vstack(points), matrix, out.shape, new_dim,
+                              offset=offset)
+    return write_labels(out, targets, vol[points], background=background,
+                        priority=priority)
+
+
+def apply_index(vol, gather, scatter, background=0, priority=None):
+    """Resamples a label volume with precomputed index maps
+
+    It gives the same result as resample_labels, with one np.take
+    for the gather step and a lookup of the nonzero voxels for the
+    scatter step.
+
+    Args:
+        vol: (X, Y, Z) array of labels
+        gather: output-shaped array returned by gather_index
+        scatter: input-shaped array returned by scatter_index
+        background: background label
+        priority: sequence of labels, from the lowest to the highest
+            priority (see label_ranks)
+
+    Returns:
+        resampled: (X, Y, Z) array of labels
+    """
+    flat = np.append(np.ravel(vol), np.array(background, dtype=vol.dtype))
+    out = np.take(flat, gather)
+    points = np.flatnonzero(flat[:-1] != background)
+    return write_labels(out, np.ravel(scatter)[points], flat[points],
+                        background=background, priority=priority)
+
+
+def resample_labels(vol, matrix, in_voxel_size, out_voxel_size, new_dim,
+                    crop=None, background=0, priority=None, cache=None,
+                    threads=1):
+    """Resamples a label volume with nearest neighbours
+
+    Args:
+        vol: (X, Y, Z) array of labels
+        matrix: (4,4) matrix from input space to output space, in mm
+        in_voxel_size: voxel size of the input volume
+        out_voxel_size: voxel size of the output volume
+        new_dim: dimensions of the whole output grid
+        crop: (bbmin, bbmax) voxel coordinates of a crop window,
+            bounds included; None for the whole grid
+        background: background label
+        priority: sequence of labels, from the lowest to the highest
+            priority (see label_ranks)
+        cache: GatherMapCache; if given, the index maps are read from it,
+            or computed and stored in it
+        threads: number of threads resampling slabs of planes along z
+
+    Returns:
+        resampled: (X, Y, Z) array of labels (whole grid or crop window)
+    """
+    vol = np.asarray(vol)
+    if vol.ndim == 4:
+        vol = vol[..., 0]
+    if crop is None:
+        offset = np.zeros(3, dtype=int)
+        out_dim = [int(d) for d in new_dim[:3]]
+    else:
+        offset = np.asarray(crop[0], dtype=int)
+        out_dim = list(np.asarray(crop[1], dtype=int) - offset + 1)
+
+    to_out = voxel_matrix(matrix, in_voxel_size, out_voxel_size)
+    inv_to_out = np.linalg.inv(to_out)
+
+    # Axis-aligned transformations are done with slices and transposes
+    axes = axis_alignment(inv_to_out)
+    if axes is not None:
+        resampled = gather_aligned(vol, inv_to_out, axes, out_dim,
+                                   offset=offset, background=background)
+        return scatter_labels(vol, to_out, resampled, new_dim, offset=offset,
+                              background=background, priority=priority)
+
+    if cache is not None:
+        key = cache.key(matrix, vol.shape, in_voxel_size, new_dim,
+                        out_voxel_size, crop)
+        maps = cache.get(key)
+        if maps is None:
+            maps = (gather_index(vol.shape, inv_to_out, out_dim,
+                                 offset=offset, threads=threads),
+                    scatter_index(vol.shape, to_out, out_dim, new_dim,
+                                  offset=offset, threads=threads))
+            cache.put(key, *maps)
+        return apply_index(vol, maps[0], maps[1], background=background,
+                           priority=priority)
+
+    resampled = gather_labels(vol, inv_to_out, out_dim,
+                              offset=offset, background=background,
+                              threads=threads)
+    return scatter_labels(vol, to_out, resampled, new_dim, offset=offset,
+                          background=background, priority=priority)
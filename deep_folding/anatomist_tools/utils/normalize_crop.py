@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  This software and supporting documentation are distributed by
+#      Institut Federatif de Recherche 49
+#      CEA/NeuroSpin, Batiment 145,
+#      91191 Gif-sur-Yvette cedex
+#      France
+#
+# This software is governed by the CeCILL license version 2 under
+# French law and abiding by the rules of distribution of free software.
+# You can  use, modify and/or redistribute the software under the
+# terms of the CeCILL license version 2 as circulated by CEA, CNRS
+# and INRIA at the following URL "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license version 2 and that you accept its terms.
+
+"""
+The aim of this script is to normalize and crop a volume within the python
+process
+
+It replaces the successive AimsApplyTransform and AimsSubVolume command
+lines: the volume is resampled onto the normalized SPM grid in memory,
+cropped with numpy, and only the crop is written to disk.
+"""
+
+import numpy as np
+from soma import aims, aimsalgo
+
+from deep_folding.anatomist_tools.utils.aims_io import read_header
+
+# Interpolation names accepted by AimsApplyTransform, in order 0 to 7
+# A name can be abbreviated (n, l, q, c, six...)
+_INTERP_NAMES = ('nearest', 'linear', 'quadratic', 'cubic',
+                 'quartic', 'quintic', 'sixthorder', 'seventhorder')
+
+
+def interp_order(interp):
+    """Returns the order of the resampler given an interpolation type
+
+    Args:
+        interp: interpolation name as for AimsApplyTransform
+            (n[earest], l[inear], q[uadratic], c[ubic], quartic, quintic,
+            six[thorder], seven[thorder]) or order number (0 to 7)
+
+    Returns:
+        order: integer between 0 and 7
+    """
+    interp = str(interp).lower()
+    if interp.isdigit() and int(interp) < len(_INTERP_NAMES):
+        return int(interp)
+    # Abbreviations resolve to the lowest order, as for AimsApplyTransform:
+    # q is quadratic, quartic and quintic must be given in full
+    matches = [order for order, name in enumerate(_INTERP_NAMES)
+               if name.startswith(interp)]
+    if not interp or not matches:
+        raise ValueError("Unknown interpolation type " + interp +
+                         ", must be one of " + str(_INTERP_NAMES))
+    return matches[0]
+
+
+def read_transformation(transformation):
+    """Returns an aims transformation from a file, a matrix or a transformation
+
+    Args:
+        transformation: .trm file name, (4,4) matrix,
+            aims.AffineTransformation3d or None (identity)
+    """
+    if isinstance(transformation, str):
+        return aims.read(transformation)
+    if transformation is None:
+        return aims.AffineTransformation3d(np.eye(4))
+    return aims.AffineTransformation3d(transformation)
+
+
+def shift_transformations(header, new_header, bbmin):
+    """Copies the referential transformations shifted to a crop origin
+
+    Args:
+        header: header of the whole volume
+        new_header: header of the cropped volume, modified in place
+        bbmin: voxel coordinates of the crop origin
+    """
+    if 'referentials' in header and 'transformations' in header:
+        shift = aims.AffineTransformation3d()
+        shift.setTranslation(
+            list(np.asarray(bbmin) * np.array(header['voxel_size'][:3])))
+        new_header['referentials'] = list(header['referentials'])
+        new_header['transformations'] = [
+            list((aims.AffineTransformation3d(t) * shift).toVector())
+            for t in header['transformations']]
+
+
+def crop_volume(vol, bbmin, bbmax):
+    """Crops a volume to a box, bounds included
+
+    Bounds are inclusive, as for AimsSubVolume. The referential
+    transformations of the header are shifted to the origin of the crop.
+
+    Args:
+        vol: aims volume
+        bbmin: minimum voxel coordinates of the box (3 integers)
+        bbmax: maximum voxel coordinates of the box (3 integers)
+
+    Returns:
+        cropped: aims volume
+    """
+    bbmin = np.asarray(bbmin, dtype=int)
+    bbmax = np.asarray(bbmax, dtype=int)
+    arr = np.asarray(vol)
+    crop = arr[bbmin[0]:bbmax[0] + 1,
+               bbmin[1]:bbmax[1] + 1,
+               bbmin[2]:bbmax[2] + 1]
+
+    cropped = aims.Volume(list(crop.shape[:3]), dtype=arr.dtype)
+    np.asarray(cropped)[:] = crop
+
+    cropped.header()['voxel_size'] = list(vol.header()['voxel_size'][:3])
+    shift_transformations(vol.header(), cropped.header(), bbmin)
+    return cropped
+
+
+def normalize_volume(vol, transformation, reference_image,
+                     interp='nearest', background=0, bbmin=None, bbmax=None):
+    """Resamples a volume onto the grid of a reference image
+
+    It does the same as AimsApplyTransform -r reference_image.
+    If a crop window is given, only the output voxels inside the window
+    are computed: the result is the same as resampling the whole grid
+    and cropping it with crop_volume.
+
+    Args:
+        vol: aims volume to resample
+        transformation: .trm file name, (4,4) matrix or
+            aims.AffineTransformation3d from vol space to reference space
+        reference_image: image giving the output grid; only its header is
+            read. Its header can be given instead, to share it between
+            several volumes
+        interp: interpolation type (see interp_order)
+        background: value of voxels outside of the input volume
+        bbmin: minimum voxel coordinates of the crop window (included),
+            None for the whole grid
+        bbmax: maximum voxel coordinates of the crop window (included)
+
+    Returns:
+        normalized: aims volume on the grid (or window) of reference_image
+    """
+    header = (read_header(reference_image)
+              if isinstance(reference_image, str) else reference_image)
+    inv_trm = read_transformation(transformation).inverse()
+    voxel_size = list(header['voxel_size'][:3])
+
+    if bbmin is None:
+        dims = list(header['volume_dimension'][:3])
+    else:
+        bbmin = np.asarray(bbmin, dtype=int)
+        dims = list(np.asarray(bbmax, dtype=int) - bbmin + 1)
+        # Output voxels of the window are shifted by the crop origin
+        shift = aims.AffineTransformation3d()
+        shift.setTranslation(list(bbmin * np.array(voxel_size)))
+        inv_trm = inv_trm * shift
+
+    normalized = aims.Volume(dims, dtype=np.asarray(vol).dtype)
+    normalized.header()['voxel_size'] = voxel_size
+    if bbmin is None:
+        for key in ('referentials', 'transformations'):
+            if key in header:
+                normalized.header()[key] = header[key]
+    else:
+        shift_transformations(header, normalized.header(), bbmin)
+
+    resampler = aimsalgo.ResamplerFactory(vol).getResampler(
+        interp_order(interp))
+    resampler.setDefaultValue(background)
+    resampler.setRef(vol)
+    resampler.resample_inv(vol, inv_trm, background, normalized)
+    return normalized
+
+
+def normalize_and_crop(input_image, output_image, transformation,
+                       reference_image, bbmin, bbmax,
+                       interp='nearest', background=0, crop_aware=False):
+    """Normalizes a volume and writes only its crop
+
+    Args:
+        input_image: file name of the volume to normalize (skeleton)
+        output_image: file name of the written crop; if None,
+            the crop is only returned
+        transformation: .trm file name, (4,4) matrix or
+            aims.AffineTransformation3d from input space to reference space
+        reference_image: image giving the normalized grid (normalized SPM)
+        bbmin: minimum voxel coordinates of the crop (included)
+        bbmax: maximum voxel coordinates of the crop (included)
+        interp: interpolation type (see interp_order)
+        background: value of voxels outside of the input volume
+        crop_aware: if True, only the voxels of the crop are resampled
+            instead of the whole normalized grid
+
+    Returns:
+        cropped: cropped aims volume
+    """
+    vol = aims.read(input_image)
+    if crop_aware:
+        cropped = normalize_volume(vol, transformation, reference_image,
+                                   interp=interp, background=background,
+                                   bbmin=bbmin, bbmax=bbmax)
+    else:
+        normalized = normalize_volume(vol, transformation, reference_image,
+                                      interp=interp, background=background)
+        cropped = crop_volume(normalized, bbmin, bbmax)
+    if output_image:
+        aims.write(cropped, output_image)
+    return cropped
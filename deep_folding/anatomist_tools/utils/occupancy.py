@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  This software and supporting documentation are distributed by
+#      Institut Federatif de Recherche 49
+#      CEA/NeuroSpin, Batiment 145,
+#      91191 Gif-sur-Yvette cedex
+#      France
+#
+# This software is governed by the CeCILL license version 2 under
+# French law and abiding by the rules of distribution of free software.
+# You can  use, modify and/or redistribute the software under the
+# terms of the CeCILL license version 2 as circulated by CEA, CNRS
+# and INRIA at the following URL "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license version 2 and that you accept its terms.
+
+"""
+The aim of this script is to accumulate, subject after subject, the voxel
+occupancy of a sulcus in the normalized SPM space, and to derive from it
+bounding boxes covering a chosen fraction of the voxels or of the subjects
+
+Contrary to the union of all subject boxes, such boxes are not inflated
+by a single outlier subject.
+"""
+
+import numpy as np
+
+# Coverage is computed either on the voxel occupancy or on subject boxes
+_COVERAGE_TYPES = ('voxels', 'subjects')
+
+
+class OccupancyAccumulator:
+    """Streaming occupancy histogram of a sulcus across subjects
+
+    The occupancy map counts, for each voxel, the number of subjects
+    in which the sulcus occupies this voxel. The map grows with the voxels
+    that are added, so that its size is the one of the union box.
+
+    Attributes:
+        origin: voxel coordinates of the first voxel of the map
+        counts: 3D numpy array of occupancy counts
+        list_bbmin: list of per-subject box min (voxels)
+        list_bbmax: list of per-subject box max (voxels)
+    """
+
+    def __init__(self):
+        self.origin = None
+        self.counts = None
+        self.list_bbmin = []
+        self.list_bbmax = []
+
+    @property
+    def nb_subjects(self):
+        """Number of subjects added to the accumulator"""
+        return len(self.list_bbmin)
+
+    def grow(self, vox_min, vox_max):
+        """Enlarges the occupancy map so that it contains the given box
+
+        Args:
+            vox_min: numpy array of the min voxel coordinates to contain
+            vox_max: numpy array of the max voxel coordinates to contain
+        """
+        if self.counts is None:
+            self.origin = vox_min.copy()
+            self.counts = np.zeros(vox_max - vox_min + 1, dtype=np.int32)
+            return
+        end = self.origin + np.array(self.counts.shape) - 1
+        new_origin = np.minimum(self.origin, vox_min)
+        new_end = np.maximum(end, vox_max)
+        if np.array_equal(new_origin, self.origin) \
+                and np.array_equal(new_end, end):
+            return
+        counts = np.zeros(new_end - new_origin + 1, dtype=np.int32)
+        offset = self.origin - new_origin
+        counts[offset[0]:offset[0] + self.counts.shape[0],
+               offset[1]:offset[1] + self.counts.shape[1],
+               offset[2]:offset[2] + self.counts.shape[2]] = self.counts
+        self.origin = new_origin
+        self.counts = counts
+
+    def add(self, voxels):
+        """Adds the voxels of the sulcus of one subject
+
+        Args:
+            voxels: (N,3) array of integer voxel coordinates
+                in the normalized SPM space
+        """
+        voxels = np.asarray(voxels, dtype=int).reshape(-1, 3)
+        if voxels.shape[0] == 0:
+            return
+        vox_min = np.min(voxels, axis=0)
+        vox_max = np.max(voxels, axis=0)
+        self.list_bbmin.append(vox_min)
+        self.list_bbmax.append(vox_max)
+
+        # A voxel is counted once per subject
+        self.grow(vox_min, vox_max)
+        local = np.unique(voxels - self.origin, axis=0)
+        self.counts[local[:, 0], local[:, 1], local[:, 2]] += 1
+
+    def coverage_box(self, coverage, coverage_type='voxels'):
+        """Returns the box covering a given fraction of the sulcus
+
+        With coverage_type 'voxels', along each axis, (1-coverage)/2 of the
+        occupancy mass is trimmed at each end of the marginal histogram.
+        With coverage_type 'subjects', along each axis, the box min is the
+        (1-coverage) quantile of the subject box mins and the box max
+        is the coverage quantile of the subject box maxs.
+
+        Args:
+            coverage: fraction between 0 and 1, for example 0.99
+            coverage_type: either 'voxels' or 'subjects'
+
+        Returns:
+            bbmin: numpy array of the min voxel coordinates of the box
+            bbmax: numpy array of the max voxel coordinates of the box
+        """
+        if coverage_type not in _COVERAGE_TYPES:
+            raise ValueError("coverage_type must be one of "
+                             + str(_COVERAGE_TYPES))
+        if not 0 < coverage <= 1:
+            raise ValueError("coverage must be in ]0, 1]")
+        if self.counts is None:
+            raise ValueError("No voxel has been added")
+
+        if coverage_type == 'subjects':
+            last = self.nb_subjects - 1
+            mins = np.sort(np.array(self.list_bbmin), axis=0)
+            maxs = np.sort(np.array(self.list_bbmax), axis=0)
+            bbmin = mins[int(np.floor((1 - coverage) * last))]
+            bbmax = maxs[int(np.ceil(coverage * last))]
+            return bbmin, bbmax
+
+        bbmin = np.zeros(3, dtype=int)
+        bbmax = np.zeros(3, dtype=int)
+        for axis in range(3):
+            other_axes = tuple(a for a in range(3) if a != axis)
+            marginal = self.counts.sum(axis=other_axes)
+            trim = marginal.sum() * (1 - coverage) / 2
+            low = np.searchsorted(np.cumsum(marginal), trim, side='right')
+            high = len(marginal) - 1 - np.searchsorted(
+                np.cumsum(marginal[::-1]), trim, side='right')
+            bbmin[axis] = self.origin[axis] + low
+            bbmax[axis] = self.origin[axis] + high
+        return bbmin, bbmax
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  This software and supporting documentation are distributed by
+#      Institut Federatif de Recherche 49
+#      CEA/NeuroSpin, Batiment 145,
+#      91191 Gif-sur-Yvette cedex
+#      France
+#
+# This software is governed by the CeCILL license version 2 under
+# French law and abiding by the rules of distribution of free software.
+# You can  use, modify and/or redistribute the software under the
+# terms of the CeCILL license version 2 as circulated by CEA, CNRS
+# and INRIA at the following URL "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license version 2 and that you accept its terms.
+
+"""
+The aim of this script is to run per-subject functions in a pool of worker
+processes while keeping the order of the results identical to a serial run,
+and to split the work on one volume between threads
+"""
+
+from __future__ import print_function
+
+import os
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+from threadpoolctl import threadpool_limits
+
+# Maximum number of threads of the current worker process,
+# set by limit_threads (None outside of a limited worker)
+_worker_threads = None
+
+
+def limit_threads(threads):
+    """Limits the number of threads used by numerical libraries
+
+    It is used as initializer of worker processes. Worker processes are
+    forked after the BLAS and OpenMP libraries have been loaded, so that
+    their thread pools are resized at runtime with threadpoolctl.
+    The limit is also the number of threads given by available_threads.
+
+    ITK (used by the aims resamplers) is limited through its environment
+    variable, which it reads when its thread pool is first created: the
+    limit thus holds for aims code first run in the worker, but not for
+    a pool already created in the parent process before the fork.
+
+    Args:
+        threads: maximum number of threads per process
+    """
+    global _worker_threads
+    _worker_threads = threads
+    threadpool_limits(limits=threads)
+    os.environ['ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS'] = str(threads)
+
+
+def parallel_map(function, items, jobs=1, threads=None, progress=False,
+                 callback=None):
+    """Applies function to every item, possibly in worker processes
+
+    Results are returned in the order of items, whatever the number of jobs,
+    so that outputs written from them are identical to the ones of a serial
+    run.
+
+    Args:
+        function: picklable function (or bound method) taking one item
+        items: list of items to process
+        jobs: number of worker processes; 1 means serial execution
+        threads: if given, maximum number of threads of numerical
+            libraries in each worker process
+        progress: if True, prints the number of processed items
+        callback: if given, function called in the main process with
+            (item, result) as soon as each result is available,
+            in the order of items
+
+    Returns:
+        results: list of function(item), in the same order as items
+    """
+    items = list(items)
+    if jobs is None or jobs <= 1 or len(items) <= 1:
+        results = []
+        for item in items:
+            results.append(function(item))
+            if callback is not None:
+                callback(item, results[-1])
+            if progress:
+                print("processed %d/%d" % (len(results), len(items)))
+        return results
+
+    pool = multiprocessing.Pool(
+        processes=min(jobs, len(items)),
+        initializer=None if threads is None else limit_threads,
+        initargs=() if threads is None else (threads,))
+    try:
+        results = []
+        # imap gives back results in the order of items
+        for item, result in zip(items,
+                                pool.imap(function, items, chunksize=1)):
+            results.append(result)
+            if callback is not None:
+                callback(item, result)
+            if progress:
+                print("processed %d/%d" % (len(results), len(items)))
+    finally:
+        pool.close()
+        pool.join()
+    return results
+
+
+def available_threads(threads=None):
+    """Returns the number of threads a process may use
+
+    In a worker of a process pool, the number of threads is limited to
+    the share of the cores given to limit_threads (one thread if no
+    limit has been set), so that threads don't oversubscribe the cores.
+
+    Args:
+        threads: requested number of threads; None for all available ones
+
+    Returns:
+        number of threads, at least 1
+    """
+    if _worker_threads is not None:
+        limit = _worker_threads
+    elif multiprocessing.current_process().daemon:
+        limit = 1
+    else:
+        limit = multiprocessing.cpu_count()
+    return max(1, min(limit, threads or limit))
+
+
+def thread_map(function, items, threads=1):
+    """Applies function to every item, possibly in a pool of threads
+
+    It suits functions spending their time in numpy operations that
+    release the GIL, writing into shared preallocated arrays.
+
+    Args:
+        function: function taking one item
+        items: list of items to process
+        threads: number of threads; 1 means serial execution
+
+    Returns:
+        results: list of function(item), in the same order as items
+    """
+    items = list(items)
+    if threads is None or threads <= 1 or len(items) <= 1:
+        return [function(item) for item in items]
+    pool = ThreadPool(processes=min(threads, len(items)))
+    try:
+        return pool.map(function, items)
+    finally:
+        pool.close()
+        pool.join()
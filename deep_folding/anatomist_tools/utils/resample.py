@@ -5,8 +5,83 @@ Script from https://github.com/BastienCagna/labelresample.git
 import numpy as np
 from soma import aims, aimsalgo
 
+from deep_folding.anatomist_tools.utils.affine import apply_affine
+from deep_folding.anatomist_tools.utils.nn_resample import resample_labels
+from deep_folding.anatomist_tools.utils.nn_resample import voxel_matrix
+from deep_folding.anatomist_tools.utils.parallel import available_threads
 
-def resample(input_image, output_image, transformation=None, output_vs=None, background=0):
+# Resampling methods: aims buckets (label by label) or vectorized numpy
+_METHODS = ('aims', 'numpy')
+_METHOD_DEFAULT = 'aims'
+
+
+def _window_coordinates(coords, new_dim, offset):
+    """
+        Coordinates of output voxels in the crop window
+
+        Negative coordinates are first wrapped as numpy indices of the
+        whole output volume, so that a crop gives the same voxels as
+        resampling the whole volume and cropping it afterwards.
+
+        Parameters
+        ----------
+        coords: array
+            (N, 3) or (3,) coordinates in the whole output volume
+        new_dim: list
+            Dimensions of the whole output volume
+        offset: array
+            Crop origin in the whole output volume
+
+        Return
+        ------
+        window_coords:
+            Coordinates relative to the crop origin
+    """
+    coords = np.asarray(coords)
+    return np.where(coords < 0, coords + new_dim, coords) - offset
+
+
+def _window_voxels(voxels, matrix, new_dim, offset, out_dim):
+    """
+        Selects input voxels whose image may fall in the crop window
+
+        Voxels are transformed forward to output voxel coordinates; the
+        window is dilated by one output voxel, plus half the image of
+        an input voxel, so that rounding never drops a voxel of the window.
+
+        Parameters
+        ----------
+        voxels: array
+            (N, 3) input voxel coordinates
+        matrix: array
+            (4, 4) transformation from input to output voxel coordinates
+        new_dim: list
+            Dimensions of the whole output volume
+        offset: array
+            Crop origin in the whole output volume
+        out_dim: list
+            Dimensions of the crop window
+
+        Return
+        ------
+        mask:
+            (N,) boolean array of the selected voxels
+    """
+    margin = 1. + 0.5 * np.abs(matrix[:3, :3]).sum(axis=1)
+    forward = apply_affine(matrix, voxels)
+    mask = np.zeros(len(voxels), dtype=bool)
+    # Coordinates are tested before and after wrapping,
+    # which depends on the rounding of forward
+    for coords in (forward - offset,
+                   _window_coordinates(forward, new_dim, offset)):
+        mask |= np.all((coords >= -margin)
+                       & (coords <= np.array(out_dim) - 1 + margin), axis=1)
+    return mask
+
+
+def resample(input_image, output_image, transformation=None, output_vs=None,
+             background=0, crop=None, method=_METHOD_DEFAULT, priority=None,
+             cache=None, threads=1):
     """
         Transform and resample a volume that as discret values
 
@@ -14,24 +89,56 @@ def resample(input_image, output_image, transformation=None, output_vs=None, bac
         ----------
         input_image: file
             Path to the input volume (.nii or .nii.gz file)
-        transformation: file
-            Linear transformation file (.trm file)
+        output_image: file
+            Path to the output volume; if None, it is not written
+        transformation: file, array or aims.AffineTransformation3d
+            Linear transformation file (.trm file), or (4, 4) matrix
+            (for example read from a transform store)
         output_vs: tuple
             Output voxel size (default: None, no resampling)
         background: int
             Background value (default: 0)
+        crop: tuple
+            (bbmin, bbmax) voxel coordinates of a crop window, bounds
+            included (default: None, whole volume). Only voxels inside the
+            window are computed; the result is the same as resampling
+            the whole volume and cropping it afterwards.
+        method: str
+            'aims' (aims resampler and one bucket per label) or 'numpy'
+            (vectorized nearest neighbours, see nn_resample)
+            (default: 'aims')
+        priority: list
+            With the numpy method, labels from the lowest to the highest
+            priority when several labels fall into the same voxel
+            (default: None, higher values have higher priority)
+        cache: GatherMapCache
+            With the numpy method, cache of the index maps: volumes sharing
+            the transformation and the geometries are then resampled with
+            a single np.take (default: None, no cache)
+        threads: int
+            With the numpy method, number of threads resampling slabs of
+            the output grid along z; None for all cores. It is limited to
+            the share of the cores of the process inside a process pool
+            (default: 1)
 
         Return
         ------
         resampled_vol:
             Transformed and resampled volume
     """
+    if method not in _METHODS:
+        raise ValueError("method must be one of " + str(_METHODS))
+    if cache is not None and method != 'numpy':
+        raise ValueError("the index map cache needs the numpy method")
+
     # Read inputs
     vol = aims.read(input_image)
     vol_dt = vol.__array__()
 
-    if transformation:
+    if isinstance(transformation, str):
         trm = aims.read(transformation)
+    elif transformation is not None:
+        trm = aims.AffineTransformation3d(transformation)
     else:
         trm = aims.AffineTransformation3d(np.eye(4))
     inv_trm = trm.inverse()
@@ -47,28 +154,62 @@ def resample(input_image, output_image, transformation=None, output_vs=None, bac
         output_vs = vol.header()['voxel_size'][:3]
         new_dim = vol.header()['volume_dimension'][:3]
 
+    # Output window: whole volume or crop
+    if crop is not None:
+        offset = np.array(crop[0], dtype=int)
+        out_dim = list(np.array(crop[1], dtype=int) - offset + 1)
+        # Output voxels of the window are shifted by the crop origin
+        shift = aims.AffineTransformation3d()
+        shift.setTranslation(list(offset * np.array(output_vs)))
+        inv_trm_out = inv_trm * shift
+    else:
+        offset = np.zeros(3, dtype=int)
+        out_dim = new_dim
+        inv_trm_out = inv_trm
+
+    resampled = aims.Volume(out_dim, dtype=vol_dt.dtype)
+    resampled.header()['voxel_size'] = output_vs
+
+    if method == 'numpy':
+        np.asarray(resampled)[..., 0] = resample_labels(
+            vol_dt, trm.toMatrix(), vol.header()['voxel_size'][:3],
+            output_vs, new_dim, crop=crop, background=background,
+            priority=priority, cache=cache,
+            threads=available_threads(threads))
+        if output_image:
+            aims.write(resampled, output_image)
+        return resampled
+
     # Transform the background
     # Using the inverse is more straightforward and supports non-linear
     # transforms
-    resampled = aims.Volume(new_dim, dtype=vol_dt.dtype)
-    resampled.header()['voxel_size'] = output_vs
     # 0 order (nearest neightbours) resampling
     resampler = aimsalgo.ResamplerFactory(vol).getResampler(0)
     resampler.setDefaultValue(background)
     resampler.setRef(vol)
-    resampler.resample_inv(vol, inv_trm, 0, resampled)
+    resampler.resample_inv(vol, inv_trm_out, 0, resampled)
     resampled_dt = np.asarray(resampled)
 
+    # Voxels of the labels (except background); with a crop, only the ones
+    # whose image may fall in the window are resampled
+    voxels = np.argwhere(vol_dt[..., 0] != background)
+    if crop is not None:
+        matrix = voxel_matrix(trm.toMatrix(), vol.header()['voxel_size'][:3],
+                              output_vs)
+        voxels = voxels[_window_voxels(voxels, matrix, new_dim, offset,
+                                       out_dim)]
+    voxel_values = vol_dt[voxels[:, 0], voxels[:, 1], voxels[:, 2], 0]
+
     # Create one bucket by value (except background)
     # FIXME: Create several buckets because I didn't understood how to add
     #  several bucket to a BucketMap
-    values = np.unique(vol_dt[vol_dt != background])
+    values = np.unique(voxel_values)
     # TODO: add pissiblity to order values by priority
     for i, v in enumerate(values):
         bck = aims.BucketMap_VOID()
         bck.setSizeXYZT(*vol.header()['voxel_size'][:3], 1.)
         bk0 = bck[0]
-        for p in np.vstack(np.where(vol_dt == v)[:3]).T:
+        for p in voxels[voxel_values == v]:
             bk0[list(p)] = v
 
         bck2 = aimsalgo.resampleBucket(bck, trm, inv_trm, output_vs)
@@ -81,9 +222,17 @@ def resample(input_image, output_image, transformation=None, output_vs=None, bac
         for p in bck2[0].keys():
             c = p.list()
             if c[0] < new_dim[0] and c[1] < new_dim[1] and c[2] < new_dim[2]:
-                resampled_dt[c[0], c[1], c[2]] = values[i]
+                if crop is None:
+                    resampled_dt[c[0], c[1], c[2]] = values[i]
+                    continue
+                # Same (wrapped) index as in the whole volume,
+                # kept only if it falls inside the window
+                c = _window_coordinates(c, new_dim, offset)
+                if all(0 <= ci < ni for ci, ni in zip(c, out_dim)):
+                    resampled_dt[c[0], c[1], c[2]] = values[i]
 
-    aims.write(resampled, output_image)
+    if output_image:
+        aims.write(resampled, output_image)
     return resampled
 
 
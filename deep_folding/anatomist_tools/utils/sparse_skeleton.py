@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  This software and supporting documentation are distributed by
+#      Institut Federatif de Recherche 49
+#      CEA/NeuroSpin, Batiment 145,
+#      91191 Gif-sur-Yvette cedex
+#      France
+#
+# This software is governed by the CeCILL license version 2 under
+# French law and abiding by the rules of distribution of free software.
+# You can  use, modify and/or redistribute the software under the
+# terms of the CeCILL license version 2 as circulated by CEA, CNRS
+# and INRIA at the following URL "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license version 2 and that you accept its terms.
+
+"""
+The aim of this script is to represent skeletons as lists of voxels
+
+A SparseSkeleton keeps only the coordinates (int16) and labels (uint8)
+of the nonzero voxels, with the voxel size and the affine of the volume.
+Crop, forward transformation, alteration and storage cost
+O(number of nonzero voxels) instead of O(volume). It is the storage
+format of the crops in the pickle file of load_data.fetch_data.
+soma.aims is only needed to convert to an aims volume.
+
+Whole skeletons stay dense in resample, dataset_gen_pipe and
+benchmark_generation: outside of the brain, they are labelled 11, not 0.
+The left skeleton of the test subject 100206 (260x311x260 voxels) has
+89.6% of voxels labelled 11 and 9.6% labelled 0; its sulci are only
+0.85% of the volume. Converting it costs O(volume) and its sparse form
+(7 bytes per voxel) is larger than the dense int16 volume, while the
+benchmark alterations already cost O(simple surface) through a numpy view.
+"""
+
+import numpy as np
+
+from deep_folding.anatomist_tools.utils.nn_resample import label_ranks
+from deep_folding.anatomist_tools.utils.nn_resample import nearest_index
+from deep_folding.anatomist_tools.utils.nn_resample import voxel_matrix
+
+# Data types of coordinates and labels
+_COORD_DTYPE = np.int16
+_LABEL_DTYPE = np.uint8
+
+
+class SparseSkeleton:
+    """Skeleton stored as the coordinates and labels of its nonzero voxels
+    """
+
+    def __init__(self, coords, labels, shape, voxel_size=(1, 1, 1),
+                 affine=None):
+        """Inits from coordinates and labels
+
+        Arrays already of the right data type are not copied.
+
+        Args:
+            coords: (N, 3) voxel coordinates
+            labels: (N,) labels, from 1 to 255
+            shape: dimensions (X, Y, Z) of the volume
+            voxel_size: voxel size in mm
+            affine: (4,4) matrix from voxel coordinates to mm;
+                by default, scaling by the voxel size
+        """
+        coords = np.asarray(coords)
+        labels = np.asarray(labels)
+        if len(coords) and (coords.min() < np.iinfo(_COORD_DTYPE).min
+                            or coords.max() > np.iinfo(_COORD_DTYPE).max):
+            raise ValueError("coordinates don't fit in "
+                             + np.dtype(_COORD_DTYPE).name)
+        if len(labels) and (labels.min() < 0 or
+                            labels.max() > np.iinfo(_LABEL_DTYPE).max):
+            raise ValueError("labels don't fit in "
+                             + np.dtype(_LABEL_DTYPE).name)
+        self.coords = coords.astype(_COORD_DTYPE, copy=False).reshape(-1, 3)
+        self.labels = labels.astype(_LABEL_DTYPE, copy=False).reshape(-1)
+        self.shape = tuple(int(s) for s in shape[:3])
+        self.voxel_size = tuple(float(v) for v in voxel_size[:3])
+        self.affine = (np.diag(list(self.voxel_size) + [1.])
+                       if affine is None else np.asarray(affine, dtype=float))
+
+    def __len__(self):
+        return len(self.labels)
+
+    @classmethod
+    def from_array(cls, arr, voxel_size=(1, 1, 1), affine=None,
+                   background=0):
+        """Creates a sparse skeleton from a dense array
+
+        Args:
+            arr: (X, Y, Z) or (X, Y, Z, 1) array
+            voxel_size: voxel size in mm
+            affine: (4,4) matrix from voxel coordinates to mm
+            background: value of voxels not kept
+
+        Returns:
+            SparseSkeleton
+        """
+        arr = np.asarray(arr)
+        if arr.ndim == 4:
+            arr = arr[..., 0]
+        coords = np.nonzero(arr != background)
+        return cls(np.stack(coords, axis=1), arr[coords], arr.shape,
+                   voxel_size=voxel_size, affine=affine)
+
+    @classmethod
+    def from_volume(cls, vol):
+        """Creates a sparse skeleton from an aims volume
+
+        The voxels are read through a numpy view of the volume. The affine
+        is the first transformation of the header (to the first referential),
+        applied to voxel coordinates.
+
+        Args:
+            vol: aims volume
+
+        Returns:
+            SparseSkeleton
+        """
+        header = vol.header()
+        voxel_size = list(header['voxel_size'][:3])
+        affine = None
+        if 'transformations' in header and len(header['transformations']):
+            affine = np.asarray(header['transformations'][0],
+                                dtype=float).reshape(4, 4)
+            affine = affine.dot(np.diag(voxel_size + [1.]))
+        return cls.from_array(np.asarray(vol), voxel_size=voxel_size,
+                              affine=affine)
+
+    def to_array(self, dtype=np.int16):
+        """Returns the dense (X, Y, Z) array
+
+        Args:
+            dtype: data type of the array
+        """
+        arr = np.zeros(self.shape, dtype=dtype)
+        arr[tuple(self.coords.T)] = self.labels
+        return arr
+
+    def to_volume(self, dtype=np.int16):
+        """Returns the dense aims volume
+
+        Args:
+            dtype: data type of the volume
+        """
+        from soma import aims
+
+        vol = aims.Volume(list(self.shape), dtype=dtype)
+        vol.header()['voxel_size'] = list(self.voxel_size)
+        arr = np.asarray(vol)
+        arr.fill(0)
+        arr[tuple(self.coords.T) + (0,)] = self.labels
+        return vol
+
+    def flat_index(self, coords=None):
+        """Returns the flat indices of voxel coordinates in the volume
+
+        Args:
+            coords: (N, 3) voxel coordinates; the skeleton voxels if None
+        """
+        coords = self.coords if coords is None else np.asarray(coords)
+        return np.ravel_multi_index(tuple(coords.T.astype(np.intp)),
+                                    self.shape)
+
+    def crop(self, bbmin, bbmax):
+        """Returns the skeleton cropped to a box, bounds included
+
+        Args:
+            bbmin: minimum voxel coordinates of the box
+            bbmax: maximum voxel coordinates of the box
+
+        Returns:
+            SparseSkeleton of shape bbmax - bbmin + 1
+        """
+        bbmin = np.asarray(bbmin, dtype=int)
+        bbmax = np.asarray(bbmax, dtype=int)
+        inside = np.all((self.coords >= bbmin) & (self.coords <= bbmax),
+                        axis=1)
+        shift = np.eye(4)
+        shift[:3, 3] = bbmin
+        return SparseSkeleton(self.coords[inside] - bbmin,
+                              self.labels[inside], bbmax - bbmin + 1,
+                              voxel_size=self.voxel_size,
+                              affine=self.affine.dot(shift))
+
+    def transform(self, matrix, out_voxel_size, shape, priority=None):
+        """Maps each voxel to its nearest voxel in another space
+
+        Voxels are moved with the forward transformation, as in the scatter
+        step of nn_resample: output voxels that no input voxel maps to stay
+        empty, so the output voxel size shouldn't be smaller than the input
+        one. When several labels fall into the same voxel, the label of
+        highest priority is kept.
+
+        Args:
+            matrix: (4,4) matrix from the skeleton space to the output
+                space, in mm
+            out_voxel_size: output voxel size in mm
+            shape: dimensions of the output volume
+            priority: sequence of labels, from the lowest to the highest
+                priority (see nn_resample.label_ranks)
+
+        Returns:
+            SparseSkeleton in the output space
+        """
+        to_out = voxel_matrix(matrix, self.voxel_size, out_voxel_size)
+        coords = nearest_index(self.coords.dot(to_out[:3, :3].T)
+                               + to_out[:3, 3])
+        shape = np.array([int(s) for s in shape[:3]])
+        inside = np.all((coords >= 0) & (coords < shape), axis=1)
+        coords = coords[inside]
+        labels = self.labels[inside]
+
+        # Sorts by priority, then keeps the last label of each voxel
+        order = np.argsort(label_ranks(labels, priority), kind='stable')
+        coords = coords[order][::-1]
+        labels = labels[order][::-1]
+        _, first = np.unique(np.ravel_multi_index(tuple(coords.T), shape),
+                             return_index=True)
+        return SparseSkeleton(coords[first], labels[first], shape,
+                              voxel_size=out_voxel_size)
+
+    def remove_voxels(self, coords):
+        """Removes voxels from the skeleton, in place
+
+        Args:
+            coords: (N, 3) voxel coordinates of the removed voxels
+        """
+        if not len(coords):
+            return
+        kept = ~np.isin(self.flat_index(), self.flat_index(coords))
+        self.coords = self.coords[kept]
+        self.labels = self.labels[kept]
+
+    def add_voxels(self, coords, label, protected=()):
+        """Sets the label of voxels, in place
+
+        Voxels already in the skeleton are relabelled, except those whose
+        label is protected; other voxels are added.
+
+        Args:
+            coords: (N, 3) voxel coordinates
+            label: label of the voxels
+            protected: labels that are not overwritten
+        """
+        coords = np.unique(np.asarray(coords).reshape(-1, 3), axis=0)
+        flat = self.flat_index(coords)
+        existing = self.flat_index()
+        relabelled = (np.isin(existing, flat)
+                      & ~np.isin(self.labels, list(protected)))
+        self.labels = self.labels.copy()
+        self.labels[relabelled] = label
+        added = ~np.isin(flat, existing)
+        self.coords = np.concatenate(
+            [self.coords, coords[added].astype(_COORD_DTYPE)])
+        self.labels = np.concatenate(
+            [self.labels, np.full(np.count_nonzero(added), label,
+                                  dtype=_LABEL_DTYPE)])
+
+    def save(self, sparse_file):
+        """Saves the skeleton to a .npz file
+
+        Args:
+            sparse_file: name of the .npz file
+        """
+        np.savez_compressed(sparse_file, coords=self.coords,
+                            labels=self.labels, shape=np.array(self.shape),
+                            voxel_size=np.array(self.voxel_size),
+                            affine=self.affine)
+
+    @classmethod
+    def load(cls, sparse_file):
+        """Loads a skeleton saved by save
+
+        Args:
+            sparse_file: name of the .npz file
+
+        Returns:
+            SparseSkeleton
+        """
+        with np.load(sparse_file) as data:
+            return cls(data['coords'], data['labels'], data['shape'],
+                       voxel_size=data['voxel_size'], affine=data['affine'])
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  This software and supporting documentation are distributed by
+#      Institut Federatif de Recherche 49
+#      CEA/NeuroSpin, Batiment 145,
+#      91191 Gif-sur-Yvette cedex
+#      France
+#
+# This software is governed by the CeCILL license version 2 under
+# French law and abiding by the rules of distribution of free software.
+# You can  use, modify and/or redistribute the software under the
+# terms of the CeCILL license version 2 as circulated by CEA, CNRS
+# and INRIA at the following URL "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license version 2 and that you accept its terms.
+
+"""
+The aim of this script is to read and write a store of the transformations
+from native space to normalized SPM space of a whole cohort
+
+The store is a single .npz file holding an (N,4,4) float64 array of
+matrices and the array of the N subject IDs. It replaces one .trm file
+per subject: consumers open it once. Matrices are rounded like the values
+written in .trm files, so that the store and the .trm files give the same
+results. Reading the store doesn't need soma.aims.
+"""
+
+import os
+
+import numpy as np
+
+# Name of the store file in the transform directory
+_TRANSFORM_STORE_FILE = 'natif_to_template_spm.npz'
+
+# Name of the per-subject .trm files written by the exporter
+_TRM_FILE = 'natif_to_template_spm_%(subject)s.trm'
+
+
+def round_as_trm(matrix):
+    """Rounds a matrix as its coefficients are written in .trm files
+
+    .trm files keep 6 significant digits.
+
+    Args:
+        matrix: (4,4) affine matrix
+    """
+    return np.array([[float('%g' % value) for value in row]
+                     for row in np.asarray(matrix, dtype=np.float64)])
+
+
+def write_trm(trm_file, matrix):
+    """Writes a (4,4) affine matrix to a .trm file
+
+    The first line is the translation, the three others are
+    the rows of the linear part.
+
+    Args:
+        trm_file: name of the .trm file to write
+        matrix: (4,4) affine matrix
+    """
+    matrix = np.asarray(matrix, dtype=np.float64)
+    lines = [matrix[:3, 3]] + [matrix[i, :3] for i in range(3)]
+    with open(trm_file, "w") as f:
+        for line in lines:
+            f.write(' '.join('%g' % value for value in line) + '\n')
+
+
+def read_trm(trm_file):
+    """Reads a .trm file and returns the (4,4) affine matrix
+
+    Args:
+        trm_file: name of the .trm file
+    """
+    values = np.loadtxt(trm_file, dtype=np.float64).reshape(4, 3)
+    matrix = np.eye(4)
+    matrix[:3, 3] = values[0]
+    matrix[:3, :3] = values[1:]
+    return matrix
+
+
+def write_transform_store(store_file, subjects, matrices):
+    """Writes the transformations of all subjects to a store file
+
+    The file is first written under a temporary name and then renamed,
+    so that readers never see a partially written store.
+
+    Args:
+        store_file: name of the .npz file to write
+        subjects: list of subject IDs
+        matrices: list of (4,4) matrices, in the order of subjects
+    """
+    matrices = np.array([round_as_trm(matrix) for matrix in matrices],
+                        dtype=np.float64).reshape(-1, 4, 4)
+    tmp_file = store_file + '.tmp'
+    with open(tmp_file, "wb") as f:
+        np.savez(f, subjects=np.array(subjects, dtype=np.str_),
+                 matrices=matrices)
+    os.replace(tmp_file, store_file)
+
+
+class TransformStore:
+    """Gives access to the transformations of a store file
+
+    Attributes:
+        store_file: name of the .npz file
+        subjects: list of subject IDs
+        matrices: (N,4,4) array of matrices, in the order of subjects
+    """
+
+    def __init__(self, store_file):
+        """Reads the store file
+
+        Args:
+            store_file: name of the .npz file written by write_transform_store
+        """
+        self.store_file = store_file
+        with np.load(store_file) as content:
+            self.subjects = [str(subject) for subject in content['subjects']]
+            self.matrices = content['matrices']
+        self.index = {subject: i for i, subject in enumerate(self.subjects)}
+
+    def __contains__(self, subject):
+        return subject in self.index
+
+    def matrix(self, subject):
+        """Returns the (4,4) matrix from native to normalized SPM space
+
+        Args:
+            subject: subject ID
+        """
+        if subject not in self.index:
+            raise KeyError("Subject " + subject + " is not in transform "
+                           "store " + self.store_file)
+        return self.matrices[self.index[subject]].copy()
+
+    def export_trm(self, tgt_dir, subjects=None):
+        """Writes one .trm file per subject, for tools that need them
+
+        Args:
+            tgt_dir: directory in which .trm files are written
+            subjects: list of subject IDs; all subjects if None
+
+        Returns:
+            trm_files: list of written file names
+        """
+        if not os.path.exists(tgt_dir):
+            os.makedirs(tgt_dir)
+        trm_files = []
+        for subject in (self.subjects if subjects is None else subjects):
+            trm_file = os.path.join(tgt_dir, _TRM_FILE % {'subject': subject})
+            write_trm(trm_file, self.matrix(subject))
+            trm_files.append(trm_file)
+        return trm_files
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  This software and supporting documentation are distributed by
+#      Institut Federatif de Recherche 49
+#      CEA/NeuroSpin, Batiment 145,
+#      91191 Gif-sur-Yvette cedex
+#      France
+#
+# This software is governed by the CeCILL license version 2 under
+# French law and abiding by the rules of distribution of free software.
+# You can  use, modify and/or redistribute the software under the
+# terms of the CeCILL license version 2 as circulated by CEA, CNRS
+# and INRIA at the following URL "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license version 2 and that you accept its terms.
+
+"""
+The aim of this script is to read and write compact per-subject stores of
+sulcal voxels
+
+A store is a compressed .npz file extracted once from a labelled graph.
+For each label, it keeps the voxels of all its buckets as a (N,3) int16
+array, together with the voxel size and the Talairach affine of the graph.
+Reading a store doesn't need soma.aims.
+"""
+
+import hashlib
+import os
+
+import numpy as np
+
+from deep_folding.anatomist_tools.utils.affine import apply_affine
+
+# Extension of store files
+_STORE_EXTENSION = '.npz'
+
+
+def store_file_name(store_dir, graph_filename):
+    """Returns the store file name corresponding to a graph file
+
+    The store is named after the graph and a hash of its directory:
+    /db/subject/.../Lsubject_session.arg gives Lsubject_session_<hash>.npz,
+    so that graphs of the same name in different source directories
+    get different stores.
+
+    Args:
+        store_dir: directory containing the stores
+        graph_filename: graph file name (.arg), with full path
+    """
+    graph_filename = os.path.abspath(graph_filename)
+    basename = os.path.splitext(os.path.basename(graph_filename))[0]
+    dir_hash = hashlib.sha1(
+        os.path.dirname(graph_filename).encode('utf-8')).hexdigest()[:12]
+    return os.path.join(store_dir,
+                        basename + '_' + dir_hash + _STORE_EXTENSION)
+
+
+def write_voxel_store(store_file, label_voxels, voxel_size, tal_affine,
+                      graph_filename=''):
+    """Writes the voxels of all labels of one graph to a store file
+
+    Args:
+        store_file: name of the .npz file to write
+        label_voxels: dictionary whose keys are label names and whose
+            values are (N,3) arrays of voxel coordinates
+        voxel_size: voxel size of the graph (3 values)
+        tal_affine: (4,4) matrix from graph space (mm) to AIMS Talairach
+        graph_filename: name of the graph out of which voxels are extracted
+    """
+    labels = sorted(label_voxels)
+    arrays = {'voxels_%d' % i: np.asarray(label_voxels[label],
+                                          dtype=np.int16).reshape(-1, 3)
+              for i, label in enumerate(labels)}
+    if graph_filename:
+        stat = os.stat(graph_filename)
+        graph_signature = np.array([stat.st_size, stat.st_mtime])
+    else:
+        graph_signature = np.zeros(2)
+
+    store_dir = os.path.dirname(os.path.abspath(store_file))
+    if not os.path.exists(store_dir):
+        os.makedirs(store_dir)
+    np.savez_compressed(store_file,
+                        labels=np.array(labels, dtype=np.str_),
+                        voxel_size=np.asarray(voxel_size,
+                                              dtype=np.float64)[:3],
+                        tal_affine=np.asarray(tal_affine, dtype=np.float64),
+                        graph_file=np.array(graph_filename, dtype=np.str_),
+                        graph_signature=graph_signature,
+                        **arrays)
+
+
+class SulcalVoxelStore:
+    """Reads and queries the sulcal voxels of one subject
+
+    Attributes:
+        labels: list of label names contained in the store
+        voxel_size: numpy array of the graph voxel size
+        tal_affine: (4,4) numpy array from graph space (mm)
+            to AIMS Talairach space
+    """
+
+    def __init__(self, store_file):
+        """Loads the store file
+
+        Args:
+            store_file: name of the .npz store file
+        """
+        self.store_file = store_file
+        with np.load(store_file) as data:
+            self.labels = [str(label) for label in data['labels']]
+            self.voxel_size = data['voxel_size']
+            self.tal_affine = data['tal_affine']
+            self.graph_file = str(data['graph_file'])
+            self.graph_signature = data['graph_signature']
+            self._voxels = {label: data['voxels_%d' % i]
+                            for i, label in enumerate(self.labels)}
+
+    def is_up_to_date(self, graph_filename):
+        """Returns True if the graph didn't change since the extraction
+
+        Args:
+            graph_filename: graph file name, with full path
+        """
+        stat = os.stat(graph_filename)
+        return (self.graph_signature[0] == stat.st_size
+                and self.graph_signature[1] == stat.st_mtime)
+
+    def voxels(self, label):
+        """Returns the (N,3) int16 voxel coordinates of a label
+
+        Args:
+            label: label name; an empty array is returned if absent
+        """
+        return self._voxels.get(label, np.zeros((0, 3), dtype=np.int16))
+
+    def talairach_voxels(self, label):
+        """Returns the voxels of a label in AIMS Talairach space (mm)
+
+        Args:
+            label: label name
+        """
+        return apply_affine(self.tal_affine,
+                            self.voxels(label) * self.voxel_size)
+
+    def bounding_boxes(self, sulci=None):
+        """Returns the AIMS Talairach bounding boxes of labels
+
+        Boxes are identical to the ones computed from the graph buckets
+        by BoundingBoxMax.
+
+        Args:
+            sulci: list of label names; if None, all labels of the store
+
+        Returns:
+            boxes: dictionary whose keys are label names and whose values
+                are tuples (bbox_min, bbox_max) of numpy arrays.
+                Labels absent from the store or empty are not keys.
+        """
+        boxes = {}
+        for label in (self.labels if sulci is None else sulci):
+            if self.voxels(label).shape[0] == 0:
+                continue
+            voxels = self.talairach_voxels(label)
+            boxes[label] = (np.min(voxels, axis=0), np.max(voxels, axis=0))
+        return boxes
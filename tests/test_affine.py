@@ -0,0 +1,41 @@
+import numpy as np
+
+from deep_folding.anatomist_tools.utils.affine import apply_affine
+from deep_folding.anatomist_tools.utils.affine import bucket_to_array
+
+
+def test_apply_affine_per_point():
+    """Tests that apply_affine is bit-identical to a per-point transform
+
+    The reference emulates AffineTransformation3d.transform() on each
+    point: m[r,0]*x + m[r,1]*y + m[r,2]*z + m[r,3], summed left to right.
+    """
+    rng = np.random.RandomState(0)
+    matrix = np.eye(4)
+    matrix[:3, :] = rng.uniform(-2., 2., size=(3, 4))
+    points = rng.uniform(-300., 300., size=(1000, 3))
+
+    transformed = apply_affine(matrix, points)
+
+    assert transformed.shape == (1000, 3)
+    for point, result in zip(points, transformed):
+        x, y, z = point
+        expected = [matrix[r, 0] * x + matrix[r, 1] * y + matrix[r, 2] * z
+                    + matrix[r, 3] for r in range(3)]
+        assert result.tolist() == expected
+
+
+def test_bucket_to_array():
+    """Tests the conversion of fake buckets, including empty ones
+    """
+    voxels = bucket_to_array([{(1, 2, 3): None, (4, 5, 6): None}])
+    assert voxels.shape == (2, 3)
+    assert voxels.dtype.kind == 'i'
+    assert sorted(voxels.tolist()) == [[1, 2, 3], [4, 5, 6]]
+
+    voxels = bucket_to_array([{(1, 2, 3): None}])
+    assert voxels.tolist() == [[1, 2, 3]]
+
+    voxels = bucket_to_array([{}])
+    assert voxels.shape == (0, 3)
+    assert voxels.dtype.kind == 'i'
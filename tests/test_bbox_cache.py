@@ -0,0 +1,31 @@
+import os
+
+import numpy as np
+
+from deep_folding.anatomist_tools.utils.bbox_cache import BoundingBoxCache
+
+
+def test_bbox_cache(tmpdir):
+    """Tests that cached boxes are kept between runs until the graph changes
+    """
+    graph_file = os.path.join(str(tmpdir), 'Lsubject.arg')
+    with open(graph_file, 'w') as f:
+        f.write('graph')
+    cache_file = os.path.join(str(tmpdir), 'cache', 'bbox_cache.json')
+
+    boxes = {'S.C._left': (np.array([0.1, -2., 3.]), np.array([4., 5., 6.3]))}
+    cache = BoundingBoxCache(cache_file)
+    assert cache.get(graph_file) is None
+    cache.set(graph_file, boxes)
+    cache.save()
+
+    # A new cache object reads back exactly the same boxes
+    cached = BoundingBoxCache(cache_file).get(graph_file)
+    assert list(cached.keys()) == ['S.C._left']
+    assert np.array_equal(cached['S.C._left'][0], boxes['S.C._left'][0])
+    assert np.array_equal(cached['S.C._left'][1], boxes['S.C._left'][1])
+
+    # Modifying the graph invalidates the entry
+    with open(graph_file, 'a') as f:
+        f.write(' modified')
+    assert BoundingBoxCache(cache_file).get(graph_file) is None
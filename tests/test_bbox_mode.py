@@ -0,0 +1,63 @@
+import os
+
+import numpy as np
+import pytest
+
+from deep_folding.anatomist_tools.bounding_box import BoundingBoxMax
+
+# Maximal difference (mm) between vertex and voxel boxes of the test graph:
+# Tal_boundingbox attributes are not the boxes of the bucket voxels,
+# from which they differ by up to 4.8 mm
+_VERTEX_TOLERANCE = 5.
+
+_GRAPH_FILE = os.path.join(
+    'data/source/supervised/sujet01/t1mri/t1/default_analysis/folds/3.3',
+    'base2018_manual/Lsujet01_base2018_manual.arg')
+
+
+def test_compare_boxes():
+    """Tests that compare_boxes reports differing and missing sulci
+    """
+    boxes_ref = {'S.C._left': (np.array([1., 2., 3.]), np.array([4., 5., 6.])),
+                 'F.I.P._left': (np.zeros(3), np.ones(3))}
+    boxes_test = {key: (bbmin.copy(), bbmax.copy())
+                  for key, (bbmin, bbmax) in boxes_ref.items()}
+    assert BoundingBoxMax.compare_boxes(boxes_ref, boxes_test) == []
+
+    boxes_test['S.C._left'][1][2] += 0.5
+    boxes_test['S.T.s._left'] = (np.zeros(3), np.ones(3))
+    assert BoundingBoxMax.compare_boxes(boxes_ref, boxes_test) == \
+        [('S.C._left', 0.5), ('S.T.s._left', np.inf)]
+
+
+def test_vertex_boxes(tmpdir, capsys):
+    """Tests that vertex boxes match voxel boxes and that verify reports
+    disagreements
+    """
+    aims = pytest.importorskip('soma.aims')
+    graph_file = os.path.join(os.getcwd(), _GRAPH_FILE)
+    graph = aims.read(graph_file)
+
+    voxel_boxes = BoundingBoxMax.get_graph_voxel_boxes(graph)
+    vertex_boxes = BoundingBoxMax.get_graph_vertex_boxes(graph)
+    assert vertex_boxes is not None
+    assert sorted(vertex_boxes) == sorted(voxel_boxes)
+    for sulcus, max_diff in BoundingBoxMax.compare_boxes(voxel_boxes,
+                                                         vertex_boxes):
+        assert max_diff <= _VERTEX_TOLERANCE, sulcus
+
+    sulcus = 'S.C._left'
+    box = BoundingBoxMax(src_dir=os.path.dirname(graph_file),
+                         tgt_dir=str(tmpdir), sulcus=None, side='L',
+                         bbox_mode='verify')
+    # Moves one vertex box away from the voxels of its sulcus
+    for vertex in graph.vertices():
+        if vertex.get('name') == sulcus:
+            vertex['Tal_boundingbox_max'] = \
+                list(voxel_boxes[sulcus][1] + 100.)
+            break
+    boxes = box.get_graph_boxes(graph, graph_file, [sulcus])
+    assert BoundingBoxMax.compare_boxes(
+        {sulcus: voxel_boxes[sulcus]}, boxes) == []
+    assert "Disagreement between voxel and vertex boxes in " + graph_file \
+        + " for " + sulcus in capsys.readouterr().out
@@ -68,3 +68,39 @@ def test_bounding_box():
 		box_target = {k: data_ref[k] for k in selected_keys}
 
 	assert box_target == box_ref
+
+
+def test_bounding_boxes_single_pass():
+	"""Tests that the single-pass API gives the boxes of repeated calls
+
+	bounding_boxes reads each graph once for all sulci; its boxes must be
+	the ones given by one bounding_box call per sulcus.
+	"""
+
+	src_dir = [os.path.abspath(
+		os.path.join(os.getcwd(), 'data/source/supervised'))]
+	tgt_dir = os.path.abspath(
+		os.path.join(os.getcwd(), 'data/target/bbox_single_pass'))
+	path_to_graph = ["t1mri/t1/default_analysis/folds/3.3/base2018_manual"]
+	norm_dir = os.path.abspath(
+		os.path.join(os.getcwd(), 'data/source/unsupervised'))
+	image_normalized_spm = os.path.join(
+		norm_dir,
+		"ANALYSIS/3T_morphologist/100206/t1mri/default_acquisition",
+		"normalized_SPM_100206.nii")
+	sulci = ['S.T.s.ter.asc.ant.', 'S.C.', 'F.I.P.']
+	side = 'L'
+
+	boxes = bounding_box.bounding_boxes(
+		src_dir=src_dir, tgt_dir=tgt_dir, path_to_graph=path_to_graph,
+		sulci=sulci, sides=[side],
+		image_normalized_spm=image_normalized_spm)[side]
+
+	for sulcus in sulci:
+		bbmin, bbmax = bounding_box.bounding_box(
+			src_dir=src_dir, tgt_dir=tgt_dir, path_to_graph=path_to_graph,
+			sulcus=sulcus, side=side,
+			image_normalized_spm=image_normalized_spm)
+		bbmin_pass, bbmax_pass = boxes[sulcus + '_left']
+		assert list(bbmin_pass) == list(bbmin)
+		assert list(bbmax_pass) == list(bbmax)
@@ -0,0 +1,68 @@
+import os
+
+from deep_folding.anatomist_tools.utils.completion import CompletionManifest
+from deep_folding.anatomist_tools.utils.completion import completion_entry
+
+
+def test_completion_manifest(tmpdir):
+    """Tests that a complete output is detected until an input changes
+    """
+    input_file = str(tmpdir.join('input.txt'))
+    output_file = str(tmpdir.join('output.txt'))
+    manifest_file = str(tmpdir.join('completion.json'))
+    with open(input_file, 'w') as f:
+        f.write('input')
+    with open(output_file, 'w') as f:
+        f.write('output')
+    inputs = {'skeleton': input_file}
+    params = {'bbmin': [1, 2, 3], 'interp': 'nearest'}
+
+    manifest = CompletionManifest(manifest_file)
+    assert not manifest.is_complete('100206', inputs, params, output_file)
+    manifest.add('100206', completion_entry(inputs, params, output_file))
+    manifest.save()
+
+    manifest = CompletionManifest(manifest_file)
+    assert manifest.is_complete('100206', inputs, params, output_file)
+    assert not manifest.is_complete('100206', inputs,
+                                    {'bbmin': [1, 2, 4], 'interp': 'nearest'},
+                                    output_file)
+
+    # Same content with a new modification time: still complete
+    os.utime(input_file, (0, 0))
+    assert manifest.is_complete('100206', inputs, params, output_file)
+
+    # Modified input or output: not complete any more
+    with open(input_file, 'w') as f:
+        f.write('modified')
+    assert not manifest.is_complete('100206', inputs, params, output_file)
+    manifest.add('100206', completion_entry(inputs, params, output_file))
+    with open(output_file, 'w') as f:
+        f.write('partial')
+    assert not manifest.is_complete('100206', inputs, params, output_file)
+
+
+def test_completion_journal(tmpdir):
+    """Tests that appended entries are read back before and after save
+    """
+    output_file = str(tmpdir.join('output.txt'))
+    manifest_file = str(tmpdir.join('completion.json'))
+    with open(output_file, 'w') as f:
+        f.write('output')
+
+    manifest = CompletionManifest(manifest_file)
+    manifest.append('100206', completion_entry({}, {}, output_file))
+    manifest.append('100307', completion_entry({}, {}, output_file))
+    # Interrupted run: the journal is read back
+    with open(manifest.journal_file, 'a') as f:
+        f.write('\n["100408", {"out')
+    manifest = CompletionManifest(manifest_file)
+    assert sorted(manifest.entries) == ['100206', '100307']
+    manifest.append('100408', completion_entry({}, {}, output_file))
+    manifest = CompletionManifest(manifest_file)
+    assert sorted(manifest.entries) == ['100206', '100307', '100408']
+
+    manifest.save()
+    assert not os.path.exists(manifest.journal_file)
+    manifest = CompletionManifest(manifest_file)
+    assert manifest.is_complete('100307', {}, {}, output_file)
@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+
+from deep_folding.anatomist_tools.utils.crop_array import compact_crop_array
+from deep_folding.anatomist_tools.utils.crop_array import create_crop_array
+from deep_folding.anatomist_tools.utils.crop_array import read_crop_array
+from deep_folding.anatomist_tools.utils.crop_array import write_crop_row
+from deep_folding.anatomist_tools.utils.crop_array import \
+    write_subjects_index
+
+
+def test_crop_array(tmpdir):
+    """Tests that crops are written in their rows and compacted
+    """
+    array_file = str(tmpdir.join('Lskeleton.npy'))
+    index_file = str(tmpdir.join('Lskeleton_subjects.csv'))
+    create_crop_array(array_file, 3, (4, 5, 6))
+
+    crop = np.arange(4 * 5 * 6, dtype=np.int16).reshape(4, 5, 6, 1)
+    write_crop_row(array_file, 0, crop)
+    write_crop_row(array_file, 2, np.ones((4, 5, 6), dtype=np.int16))
+    # A crop of another shape is an error
+    with pytest.raises(ValueError):
+        write_crop_row(array_file, 1, np.ones((4, 5, 3), dtype=np.int16))
+
+    # Second subject has failed
+    compact_crop_array(array_file, [0, 2])
+    write_subjects_index(index_file, ['100206', '100307'])
+
+    array, subjects = read_crop_array(array_file, index_file)
+    assert subjects == ['100206', '100307']
+    assert array.shape == (2, 4, 5, 6)
+    assert (array[0] == crop[..., 0]).all()
+    assert (array[1] == 1).all()
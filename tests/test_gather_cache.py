@@ -0,0 +1,48 @@
+import os
+
+import numpy as np
+
+from deep_folding.anatomist_tools.utils.gather_cache import GatherMapCache
+from deep_folding.anatomist_tools.utils.nn_resample import resample_labels
+
+
+def test_gather_cache_resampling(tmpdir):
+    """Tests that cached index maps give the same resampling
+    """
+    rng = np.random.RandomState(0)
+    vol = ((rng.rand(10, 11, 12) > 0.9) * rng.choice([11, 30, 60],
+                                                     (10, 11, 12))
+           ).astype(np.int16)
+    matrix = np.array([[0.9, 0.1, 0., 1.],
+                       [-0.1, 0.95, 0.05, -2.],
+                       [0., -0.05, 1.05, 0.5],
+                       [0., 0., 0., 1.]])
+    cache = GatherMapCache(str(tmpdir.join('cache')))
+    for crop in (None, ((1, 2, 3), (6, 8, 9))):
+        expected = resample_labels(vol, matrix, (1, 1, 1), (2, 2, 2),
+                                   (5, 6, 6), crop=crop)
+        # First call computes the maps, second call reads them
+        for _ in range(2):
+            resampled = resample_labels(vol, matrix, (1, 1, 1), (2, 2, 2),
+                                        (5, 6, 6), crop=crop, cache=cache)
+            assert (resampled == expected).all()
+    assert len(os.listdir(cache.cache_dir)) == 4
+
+
+def test_gather_cache_eviction(tmpdir):
+    """Tests that the least recently used maps are evicted first
+    """
+    cache = GatherMapCache(str(tmpdir), max_size=0)
+    index = np.zeros((10, 10, 10), dtype=np.int32)
+    cache.put('a', index, index)
+    cache.put('b', index, index)
+    # Only the maps just stored are kept
+    assert cache.get('a') is None
+    assert cache.get('b') is not None
+
+    cache.max_size = 2 * cache.size()
+    cache.put('c', index, index)
+    os.utime(cache.files('b')[0], (0, 0))
+    cache.put('d', index, index)
+    assert cache.get('b') is None
+    assert cache.get('c') is not None
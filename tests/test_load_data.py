@@ -0,0 +1,32 @@
+import os
+
+from deep_folding.anatomist_tools.load_data import crop_subject
+
+
+def test_crop_subject(tmpdir):
+    """Tests that only complete crops are taken from the crop directory
+
+    Crops being written and temporary files must not be loaded, even when
+    their name contains a subject id.
+    """
+    # The directory name contains both 'normalized' and digits
+    cropped_dir = str(tmpdir.mkdir('normalized_20210101').mkdir('Lcrops'))
+    names = ['100206_normalized.nii.gz', '100307_normalized.nii',
+             '100206_normalized.nii.gz.minf', '100408_partial.nii.gz',
+             '100408_partial.nii.gz.minf', 'tmp5k2_9183.nii.gz',
+             'tmpqz0a1b2c.nii.gz', 'Lskeleton_100500.nii.gz']
+    for name in names:
+        open(os.path.join(cropped_dir, name), 'w').close()
+
+    subjects = {name: crop_subject(os.path.join(cropped_dir, name))
+                for name in names}
+    assert subjects == {'100206_normalized.nii.gz': '100206',
+                        '100307_normalized.nii': '100307',
+                        '100206_normalized.nii.gz.minf': None,
+                        '100408_partial.nii.gz': None,
+                        '100408_partial.nii.gz.minf': None,
+                        'tmp5k2_9183.nii.gz': None,
+                        'tmpqz0a1b2c.nii.gz': None,
+                        'Lskeleton_100500.nii.gz': None}
+    # Directories are not crops
+    assert crop_subject(cropped_dir) is None
@@ -0,0 +1,54 @@
+import os
+
+from deep_folding.anatomist_tools.bounding_box import BoundingBoxMax
+from deep_folding.anatomist_tools.manifest import build_manifest
+from deep_folding.anatomist_tools.manifest import DatasetManifest
+from deep_folding.anatomist_tools.manifest import supervised_patterns
+
+
+def test_manifest(tmpdir):
+    """Tests that the manifest records the morphologist files of the subjects
+    """
+    src_dir = os.path.join(os.getcwd(),
+                           'data/source/unsupervised/ANALYSIS/3T_morphologist')
+    manifest_file = str(tmpdir.join('manifest.json'))
+    manifest = build_manifest(src_dir=src_dir, manifest_file=manifest_file,
+                              threads=2)
+
+    loaded = DatasetManifest(manifest_file)
+    assert loaded.subjects == manifest.subjects == ['100206', '100307']
+    skeleton = loaded.path('100206', 'Lskeleton')
+    assert os.path.exists(skeleton)
+    assert loaded.record('100206', 'Lskeleton')['size'] == \
+        os.path.getsize(skeleton)
+    assert loaded.path('100206', 'unknown_key') is None
+    # Only the first subject has a left skeleton
+    assert loaded.subjects_with('Lskeleton', 'Rskeleton') == ['100206']
+
+
+def test_manifest_path_to_graph(tmpdir):
+    """Tests that the manifest graphs are used only for their path_to_graph
+
+    Otherwise, subjects are listed from the source directory.
+    """
+    src_dir = os.path.join(os.getcwd(), 'data/source/supervised')
+    path_to_graph = "t1mri/t1/default_analysis/folds/3.3/base2018_manual"
+    manifest_file = str(tmpdir.join('manifest.json'))
+    build_manifest(src_dir=src_dir, manifest_file=manifest_file,
+                   patterns=supervised_patterns(path_to_graph), threads=2)
+
+    box = BoundingBoxMax(src_dir=src_dir, tgt_dir=str(tmpdir),
+                         path_to_graph=path_to_graph, sulcus=None, side='L',
+                         manifest=manifest_file)
+    subjects = box.list_all_subjects()
+    assert [sub['subject'] for sub in subjects] == ['sujet01']
+    assert os.path.exists(subjects[0]['graph'])
+
+    other_path = "t1mri/t1/default_analysis/folds/3.3/other_manual"
+    box = BoundingBoxMax(src_dir=src_dir, tgt_dir=str(tmpdir),
+                         path_to_graph=other_path, sulcus=None, side='L',
+                         manifest=manifest_file)
+    subjects = box.list_all_subjects()
+    assert [sub['subject'] for sub in subjects] == ['sujet01']
+    assert 'graph' not in subjects[0]
+    assert other_path in subjects[0]['graph_file']
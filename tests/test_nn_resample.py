@@ -0,0 +1,167 @@
+import numpy as np
+
+from deep_folding.anatomist_tools.utils.nn_resample import apply_index
+from deep_folding.anatomist_tools.utils.nn_resample import axis_alignment
+from deep_folding.anatomist_tools.utils.nn_resample import gather_aligned
+from deep_folding.anatomist_tools.utils.nn_resample import gather_index
+from deep_folding.anatomist_tools.utils.nn_resample import gather_labels
+from deep_folding.anatomist_tools.utils.nn_resample import resample_labels
+from deep_folding.anatomist_tools.utils.nn_resample import scatter_index
+from deep_folding.anatomist_tools.utils.nn_resample import scatter_targets
+from deep_folding.anatomist_tools.utils.nn_resample import voxel_matrix
+
+
+def test_resample_labels_identity():
+    """Tests that the identity transformation gives back the volume
+    """
+    rng = np.random.RandomState(0)
+    vol = rng.randint(0, 3, size=(6, 7, 8)).astype(np.int16)
+    resampled = resample_labels(vol, np.eye(4), (1, 1, 1), (1, 1, 1),
+                                vol.shape)
+    assert resampled.dtype == vol.dtype
+    assert (resampled == vol).all()
+
+
+def test_resample_labels_translation():
+    """Tests that a translation of 2 mm shifts the labels of one voxel
+    """
+    vol = np.zeros((5, 5, 5), dtype=np.int16)
+    vol[1, 2, 3] = 7
+    matrix = np.eye(4)
+    matrix[0, 3] = 2
+    resampled = resample_labels(vol, matrix, (2, 2, 2), (2, 2, 2),
+                                vol.shape)
+    assert resampled[2, 2, 3] == 7
+    assert np.count_nonzero(resampled) == 1
+
+
+def test_resample_labels_priority():
+    """Tests that downsampling keeps thin labels with the given priority
+    """
+    vol = np.zeros((8, 8, 8), dtype=np.int16)
+    vol[1, 2, 2] = 30
+    vol[2, 2, 2] = 60
+    resampled = resample_labels(vol, np.eye(4), (1, 1, 1), (2, 2, 2),
+                                (4, 4, 4))
+    assert resampled[1, 1, 1] == 60
+    resampled = resample_labels(vol, np.eye(4), (1, 1, 1), (2, 2, 2),
+                                (4, 4, 4), priority=[60, 30])
+    assert resampled[1, 1, 1] == 30
+
+
+def test_resample_labels_gathered_priority():
+    """Tests that gathered labels take part in the priority merge
+
+    As the aims buckets written in ascending label order over the
+    gathered volume, a higher gathered label is kept over a lower
+    scattered one, and a higher scattered label over a lower gathered one.
+    """
+    vol = np.zeros((8, 8, 8), dtype=np.int16)
+    vol[1, 2, 2] = 30
+    vol[2, 2, 2] = 60
+    # Output voxel (1, 1, 1) gathers input voxel (2, 2, 2)
+    resampled = resample_labels(vol, np.eye(4), (1, 1, 1), (2, 2, 2),
+                                (4, 4, 4))
+    assert resampled[1, 1, 1] == 60
+    vol[1, 2, 2], vol[2, 2, 2] = 60, 30
+    resampled = resample_labels(vol, np.eye(4), (1, 1, 1), (2, 2, 2),
+                                (4, 4, 4))
+    assert resampled[1, 1, 1] == 60
+    resampled = resample_labels(vol, np.eye(4), (1, 1, 1), (2, 2, 2),
+                                (4, 4, 4), priority=[60, 30])
+    assert resampled[1, 1, 1] == 30
+
+    # Under a rotation, some voxels gather an input voxel scattered
+    # elsewhere: each voxel keeps the highest label among its gathered
+    # label and its scattered labels
+    angle = 0.3
+    matrix = np.array([[np.cos(angle), -np.sin(angle), 0., 1.],
+                       [np.sin(angle), np.cos(angle), 0., -0.5],
+                       [0., 0., 1., 0.3],
+                       [0., 0., 0., 1.]])
+    rng = np.random.RandomState(0)
+    vol = rng.randint(0, 4, size=(10, 11, 12)).astype(np.int16) * 10
+    new_dim = vol.shape
+    to_out = voxel_matrix(matrix, (1, 1, 1), (1, 1, 1))
+    expected = gather_labels(vol, np.linalg.inv(to_out), new_dim)
+    points = np.nonzero(vol)
+    targets = scatter_targets(np.vstack(points), to_out, new_dim, new_dim)
+    kept = targets >= 0
+    np.maximum.at(expected.reshape(-1), targets[kept], vol[points][kept])
+
+    resampled = resample_labels(vol, matrix, (1, 1, 1), (1, 1, 1), new_dim)
+    assert (resampled == expected).all()
+    indexed = apply_index(
+        vol, gather_index(vol.shape, np.linalg.inv(to_out), new_dim),
+        scatter_index(vol.shape, to_out, new_dim, new_dim))
+    assert (indexed == expected).all()
+
+
+def test_resample_labels_crop():
+    """Tests that resampling a window is the same as cropping afterwards
+    """
+    rng = np.random.RandomState(0)
+    vol = (rng.rand(10, 11, 12) > 0.9).astype(np.int16) * 30
+    matrix = np.array([[0.9, 0.1, 0., 1.],
+                       [-0.1, 0.95, 0.05, -2.],
+                       [0., -0.05, 1.05, 0.5],
+                       [0., 0., 0., 1.]])
+    whole = resample_labels(vol, matrix, (1, 1, 1), (1, 1, 1), vol.shape)
+    bbmin, bbmax = (2, 3, 1), (7, 9, 10)
+    window = resample_labels(vol, matrix, (1, 1, 1), (1, 1, 1), vol.shape,
+                             crop=(bbmin, bbmax))
+    assert (window == whole[2:8, 3:10, 1:11]).all()
+
+
+def test_resample_labels_threads():
+    """Tests that slabs resampled by several threads give the same result
+    """
+    rng = np.random.RandomState(0)
+    vol = (rng.rand(12, 13, 30) > 0.9).astype(np.int16) * 30
+    matrix = np.array([[0.9, 0.1, 0., 1.],
+                       [-0.1, 0.95, 0.05, -2.],
+                       [0., -0.05, 1.05, 0.5],
+                       [0., 0., 0., 1.]])
+    serial = resample_labels(vol, matrix, (1, 1, 1), (1, 1, 1), vol.shape)
+    threaded = resample_labels(vol, matrix, (1, 1, 1), (1, 1, 1), vol.shape,
+                               threads=4)
+    assert (threaded == serial).all()
+
+
+def test_gather_aligned():
+    """Tests that axis-aligned transformations give the generic result
+
+    Transformations are axis permutations, flips, translations and
+    voxel size ratios, on the whole grid and on a crop window.
+    """
+    rng = np.random.RandomState(0)
+    vol = rng.randint(0, 4, size=(10, 11, 12)).astype(np.int16)
+    flip = np.diag([-1., 1., 1., 1.])
+    flip[0, 3] = 9
+    permutation = np.array([[0., 1., 0., 2.],
+                            [0., 0., -1., 11.],
+                            [1., 0., 0., -3.],
+                            [0., 0., 0., 1.]])
+    translation = np.eye(4)
+    translation[:3, 3] = [1.5, -2., 0.25]
+    for matrix, out_voxel_size in ((flip, (1, 1, 1)),
+                                   (permutation, (1, 1, 1)),
+                                   (translation, (2, 2, 2)),
+                                   (permutation, (0.5, 1, 2))):
+        inv_matrix = np.linalg.inv(voxel_matrix(matrix, (1, 1, 1),
+                                                out_voxel_size))
+        axes = axis_alignment(inv_matrix)
+        assert axes is not None
+        for out_dim, offset in (((12, 13, 14), (0, 0, 0)),
+                                ((5, 6, 7), (2, 1, 3))):
+            expected = gather_labels(vol, inv_matrix, out_dim, offset=offset)
+            aligned = gather_aligned(vol, inv_matrix, axes, out_dim,
+                                     offset=offset)
+            assert (aligned == expected).all()
+
+    # Rotations are not axis-aligned
+    rotation = np.array([[0.9, 0.1, 0., 1.],
+                         [-0.1, 0.95, 0.05, -2.],
+                         [0., -0.05, 1.05, 0.5],
+                         [0., 0., 0., 1.]])
+    assert axis_alignment(rotation) is None
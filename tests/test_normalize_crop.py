@@ -0,0 +1,48 @@
+import os
+
+import numpy as np
+import pytest
+from soma import aims
+
+from deep_folding.anatomist_tools.utils.normalize_crop import crop_volume
+from deep_folding.anatomist_tools.utils.normalize_crop import interp_order
+from deep_folding.anatomist_tools.utils.normalize_crop import normalize_volume
+
+
+def test_interp_order():
+    """Tests that interpolation names are understood as AimsApplyTransform
+    """
+    assert interp_order('nearest') == 0
+    assert interp_order('n') == 0
+    assert interp_order('l') == 1
+    assert interp_order('q') == 2
+    assert interp_order('c') == 3
+    assert interp_order('quartic') == 4
+    assert interp_order('quintic') == 5
+    assert interp_order('six') == 6
+    assert interp_order('seven') == 7
+    assert interp_order(1) == 1
+    with pytest.raises(ValueError):
+        interp_order('bilinear')
+
+
+def test_crop_aware_normalization():
+    """Tests that crop-aware resampling equals resampling then cropping
+    """
+    subject_dir = os.path.join(os.getcwd(),
+                               'data/source/unsupervised/ANALYSIS/'
+                               '3T_morphologist/100206/t1mri/'
+                               'default_acquisition')
+    skeleton = aims.read(os.path.join(
+        subject_dir, 'default_analysis/segmentation/Rskeleton_100206.nii.gz'))
+    file_SPM = os.path.join(subject_dir, 'normalized_SPM_100206.nii')
+    file_transform = os.path.join(os.getcwd(), 'data/reference/transform/'
+                                  'natif_to_template_spm_100206.trm')
+    bbmin, bbmax = [20, 30, 25], [50, 70, 60]
+
+    normalized = normalize_volume(skeleton, file_transform, file_SPM)
+    cropped = np.asarray(crop_volume(normalized, bbmin, bbmax))
+    window = np.asarray(normalize_volume(skeleton, file_transform, file_SPM,
+                                         bbmin=bbmin, bbmax=bbmax))
+    assert window.shape == cropped.shape
+    assert (window == cropped).all()
@@ -0,0 +1,29 @@
+import numpy as np
+
+from deep_folding.anatomist_tools.utils.occupancy import OccupancyAccumulator
+
+
+def test_occupancy_coverage_box():
+    """Tests that an outlier subject doesn't inflate coverage boxes
+    """
+    acc = OccupancyAccumulator()
+    grid = np.array(np.meshgrid(range(10, 20), range(30, 40), range(5, 10),
+                                indexing='ij')).reshape(3, -1).T
+    for _ in range(100):
+        acc.add(grid)
+    # Outlier subject, far away, with a single voxel
+    acc.add([[100, 100, 100]])
+    assert acc.nb_subjects == 101
+    assert acc.counts.max() == 100
+
+    bbmin, bbmax = acc.coverage_box(1.)
+    assert bbmin.tolist() == [10, 30, 5]
+    assert bbmax.tolist() == [100, 100, 100]
+
+    bbmin, bbmax = acc.coverage_box(0.99, 'voxels')
+    assert bbmin.tolist() == [10, 30, 5]
+    assert bbmax.tolist() == [19, 39, 9]
+
+    bbmin, bbmax = acc.coverage_box(0.95, 'subjects')
+    assert bbmin.tolist() == [10, 30, 5]
+    assert bbmax.tolist() == [19, 39, 9]
@@ -0,0 +1,60 @@
+import os
+
+from deep_folding.anatomist_tools.utils import parallel
+
+# Items processed in the current process by record_item
+_processed = []
+
+
+def square(item):
+    """Picklable function returning the square of item and the pid
+    """
+    return item * item, os.getpid()
+
+
+def record_item(item):
+    """Records item in module state, visible only in the same process
+    """
+    _processed.append(item)
+    return item
+
+
+def test_parallel_map_order():
+    """Tests that results keep the order of items with several jobs
+    """
+    items = list(range(20))
+    results = parallel.parallel_map(square, items, jobs=3)
+    assert [r[0] for r in results] == [i * i for i in items]
+
+
+def test_parallel_map_callback_order():
+    """Tests that callbacks are called in the order of items with jobs > 1
+    """
+    calls = []
+    items = list(range(20))
+    parallel.parallel_map(square, items, jobs=2,
+                          callback=lambda item, result:
+                          calls.append((item, result[0])))
+    assert calls == [(i, i * i) for i in items]
+
+
+def test_parallel_map_serial_in_process():
+    """Tests that jobs=1 runs in the calling process
+    """
+    del _processed[:]
+    results = parallel.parallel_map(square, [1, 2, 3], jobs=1)
+    assert {r[1] for r in results} == {os.getpid()}
+
+    parallel.parallel_map(record_item, [1, 2, 3], jobs=1)
+    assert _processed == [1, 2, 3]
+
+
+def test_parallel_map_workers():
+    """Tests that jobs > 1 runs the function in worker processes
+    """
+    del _processed[:]
+    results = parallel.parallel_map(square, [1, 2, 3], jobs=2)
+    assert os.getpid() not in {r[1] for r in results}
+
+    parallel.parallel_map(record_item, [1, 2, 3], jobs=2)
+    assert _processed == []
@@ -0,0 +1,89 @@
+import os
+import json
+
+import numpy as np
+import pytest
+
+from soma import aims
+
+from deep_folding.anatomist_tools.utils.nn_resample import gather_labels
+from deep_folding.anatomist_tools.utils.nn_resample import voxel_matrix
+from deep_folding.anatomist_tools.utils.resample import resample
+
+_SEGMENTATION_DIR = ('data/source/unsupervised/ANALYSIS/3T_morphologist/'
+                     '100206/t1mri/default_acquisition/default_analysis/'
+                     'segmentation/')
+_TRANSFORM_FILE = 'data/reference/transform/natif_to_template_spm_100206.trm'
+
+
+def test_gather_reference_crop():
+    """Tests that the numpy nearest neighbours give the reference crop
+
+    The reference crop has been normalized with AimsApplyTransform
+    (nearest neighbours) and cropped with AimsSubVolume.
+    Measured difference: 0 voxel (5429 nonzero voxels).
+    """
+    vol = aims.read(os.path.join(os.getcwd(), _SEGMENTATION_DIR,
+                                 'Lskeleton_100206.nii.gz'))
+    trm = aims.read(os.path.join(os.getcwd(), _TRANSFORM_FILE))
+    ref = aims.read(os.path.join(os.getcwd(), 'data/reference/data/nearest/'
+                                 'Lcrops/100206_normalized.nii.gz'))
+    with open(os.path.join(os.getcwd(), 'data/reference/bbox/L/'
+                           'S.T.s.ter.asc.ant._left.json')) as f:
+        bbmin = json.load(f)['bbmin_voxel']
+
+    arr_ref = np.asarray(ref)[..., 0]
+    to_out = voxel_matrix(trm.toMatrix(), vol.header()['voxel_size'][:3],
+                          ref.header()['voxel_size'][:3])
+    arr_numpy = gather_labels(np.asarray(vol)[..., 0],
+                              np.linalg.inv(to_out), arr_ref.shape,
+                              offset=bbmin)
+
+    assert np.array_equal(arr_numpy, arr_ref)
+
+
+@pytest.mark.parametrize('side', ['L', 'R'])
+@pytest.mark.parametrize('output_vs', [(1, 1, 1), (2, 2, 2)])
+def test_resample_numpy_method(side, output_vs):
+    """Tests that the numpy resampling gives the same skeleton as aims
+
+    Both methods are compared on the reference skeletons, resampled
+    in the normalized SPM space.
+    """
+    file_skeleton = os.path.join(os.getcwd(), _SEGMENTATION_DIR,
+                                 side + 'skeleton_100206.nii.gz')
+    file_transform = os.path.join(os.getcwd(), _TRANSFORM_FILE)
+
+    arr_aims = np.asarray(resample(file_skeleton, None, output_vs=output_vs,
+                                   transformation=file_transform))
+    arr_numpy = np.asarray(resample(file_skeleton, None, output_vs=output_vs,
+                                    transformation=file_transform,
+                                    method='numpy'))
+
+    assert arr_numpy.shape == arr_aims.shape
+    assert np.array_equal(arr_numpy, arr_aims)
+
+
+@pytest.mark.parametrize('output_vs', [(1, 1, 1), (2, 2, 2)])
+def test_resample_aims_crop(output_vs):
+    """Tests that the aims method gives the same crop as a whole resampling
+
+    With a crop, only the voxels whose image falls near the window are
+    resampled.
+    """
+    file_skeleton = os.path.join(os.getcwd(), _SEGMENTATION_DIR,
+                                 'Lskeleton_100206.nii.gz')
+    file_transform = os.path.join(os.getcwd(), _TRANSFORM_FILE)
+    scale = 1 if output_vs[0] == 1 else 2
+    bbmin = np.array([112, 129, 33]) // scale
+    bbmax = bbmin + np.array([25, 24, 45]) // scale
+
+    arr_whole = np.asarray(resample(file_skeleton, None, output_vs=output_vs,
+                                    transformation=file_transform))
+    arr_crop = np.asarray(resample(file_skeleton, None, output_vs=output_vs,
+                                   transformation=file_transform,
+                                   crop=(bbmin, bbmax)))
+
+    assert np.array_equal(
+        arr_crop, arr_whole[bbmin[0]:bbmax[0] + 1, bbmin[1]:bbmax[1] + 1,
+                            bbmin[2]:bbmax[2] + 1])
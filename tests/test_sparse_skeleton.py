@@ -0,0 +1,72 @@
+import numpy as np
+
+from deep_folding.anatomist_tools.utils.nn_resample import resample_labels
+from deep_folding.anatomist_tools.utils.sparse_skeleton import SparseSkeleton
+
+
+def random_skeleton(shape=(10, 11, 12)):
+    """Returns a random dense skeleton"""
+    rng = np.random.RandomState(0)
+    return ((rng.rand(*shape) > 0.9) * rng.choice([11, 30, 60], shape)
+            ).astype(np.int16)
+
+
+def test_sparse_skeleton_dense_round_trip(tmpdir):
+    """Tests conversions to and from dense arrays and the .npz storage
+    """
+    arr = random_skeleton()
+    skeleton = SparseSkeleton.from_array(arr, voxel_size=(2, 2, 2))
+    assert len(skeleton) == np.count_nonzero(arr)
+    assert skeleton.coords.dtype == np.int16
+    assert skeleton.labels.dtype == np.uint8
+    assert (skeleton.to_array() == arr).all()
+
+    sparse_file = str(tmpdir.join('skeleton.npz'))
+    skeleton.save(sparse_file)
+    loaded = SparseSkeleton.load(sparse_file)
+    assert loaded.shape == arr.shape
+    assert loaded.voxel_size == (2., 2., 2.)
+    assert (loaded.to_array() == arr).all()
+
+
+def test_sparse_skeleton_crop():
+    """Tests that the sparse crop is the dense crop
+    """
+    arr = random_skeleton()
+    cropped = SparseSkeleton.from_array(arr).crop((2, 3, 1), (7, 9, 10))
+    assert cropped.shape == (6, 7, 10)
+    assert (cropped.to_array() == arr[2:8, 3:10, 1:11]).all()
+    assert (cropped.affine[:3, 3] == [2, 3, 1]).all()
+
+
+def test_sparse_skeleton_transform():
+    """Tests that downsampling gives the dense result where labels are mapped
+    """
+    arr = random_skeleton((12, 12, 12))
+    matrix = np.eye(4)
+    matrix[:3, 3] = [1, -1, 0]
+    transformed = SparseSkeleton.from_array(arr).transform(
+        matrix, (2, 2, 2), (6, 6, 6))
+    dense = resample_labels(arr, matrix, (1, 1, 1), (2, 2, 2), (6, 6, 6))
+    sparse = transformed.to_array()
+    assert (dense[sparse != 0] == sparse[sparse != 0]).all()
+
+
+def test_sparse_skeleton_alteration():
+    """Tests removal and addition of voxels
+    """
+    arr = np.zeros((5, 5, 5), dtype=np.int16)
+    arr[1, 1, 1] = 30
+    arr[2, 2, 2] = 11
+    skeleton = SparseSkeleton.from_array(arr)
+
+    skeleton.add_voxels([[1, 1, 1], [2, 2, 2], [3, 3, 3]], 60,
+                        protected=[11])
+    expected = arr.copy()
+    expected[1, 1, 1] = 60
+    expected[3, 3, 3] = 60
+    assert (skeleton.to_array() == expected).all()
+
+    skeleton.remove_voxels([[1, 1, 1], [4, 4, 4]])
+    expected[1, 1, 1] = 0
+    assert (skeleton.to_array() == expected).all()
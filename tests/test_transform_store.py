@@ -0,0 +1,33 @@
+import os
+
+import numpy as np
+
+from deep_folding.anatomist_tools.utils.transform_store import TransformStore
+from deep_folding.anatomist_tools.utils.transform_store import read_trm
+from deep_folding.anatomist_tools.utils.transform_store import \
+    write_transform_store
+
+
+def test_transform_store(tmpdir):
+    """Tests that the store gives back the reference .trm file
+
+    The matrix read from the store and the exported .trm file
+    must be identical to the reference ones
+    """
+    ref_file = os.path.join(os.getcwd(), 'data/reference/transform/'
+                            'natif_to_template_spm_100206.trm')
+    matrix = read_trm(ref_file)
+
+    store_file = str(tmpdir.join('natif_to_template_spm.npz'))
+    write_transform_store(store_file, ['100206', '100307'],
+                          [matrix, np.eye(4)])
+
+    store = TransformStore(store_file)
+    assert store.subjects == ['100206', '100307']
+    assert store.matrices.shape == (2, 4, 4)
+    assert (store.matrix('100206') == matrix).all()
+    assert '100408' not in store
+
+    trm_file, = store.export_trm(str(tmpdir.join('trm')), ['100206'])
+    with open(trm_file) as f, open(ref_file) as ref:
+        assert f.read() == ref.read()
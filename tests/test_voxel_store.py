@@ -0,0 +1,58 @@
+import os
+
+import numpy as np
+
+from deep_folding.anatomist_tools.bounding_box import BoundingBoxMax
+from deep_folding.anatomist_tools.utils.voxel_store import SulcalVoxelStore
+from deep_folding.anatomist_tools.utils.voxel_store import store_file_name
+from deep_folding.anatomist_tools.utils.voxel_store import write_voxel_store
+
+
+def test_voxel_store(tmpdir):
+    """Tests writing a voxel store and computing boxes from it
+    """
+    voxel_size = [1.2, 1.2, 1.5]
+    tal_affine = np.array([[0.9, 0.1, 0., -80.],
+                           [-0.1, 0.9, 0.05, -120.],
+                           [0., -0.05, 1.1, -60.],
+                           [0., 0., 0., 1.]])
+    label_voxels = {'S.C._left': np.array([[10, 20, 30], [12, 25, 31]]),
+                    'F.C.M._left': np.array([[50, 60, 70]])}
+    store_file = store_file_name(str(tmpdir), '/db/Lsujet01_manual.arg')
+    assert os.path.basename(store_file).startswith('Lsujet01_manual_')
+    assert store_file != store_file_name(str(tmpdir),
+                                         '/db2/Lsujet01_manual.arg')
+
+    write_voxel_store(store_file, label_voxels, voxel_size, tal_affine)
+    store = SulcalVoxelStore(store_file)
+
+    assert sorted(store.labels) == ['F.C.M._left', 'S.C._left']
+    assert store.voxels('S.C._left').dtype == np.int16
+    assert store.voxels('absent').shape == (0, 3)
+
+    boxes = store.bounding_boxes(['S.C._left', 'absent'])
+    assert list(boxes.keys()) == ['S.C._left']
+
+    # Expected box: each voxel transformed one by one
+    points = [tal_affine.dot(np.append(np.array(v) * voxel_size, 1.))[:3]
+              for v in label_voxels['S.C._left']]
+    assert np.allclose(boxes['S.C._left'][0], np.min(points, axis=0))
+    assert np.allclose(boxes['S.C._left'][1], np.max(points, axis=0))
+
+
+def test_voxel_store_boxes(tmpdir):
+    """Tests that BoundingBoxMax computes boxes from an up-to-date store
+    """
+    graph_file = str(tmpdir.mkdir('db').join('Lsujet01_manual.arg'))
+    with open(graph_file, 'w') as f:
+        f.write('graph')
+    store_dir = str(tmpdir.join('store'))
+    label_voxels = {'S.C._left': np.array([[10, 20, 30], [12, 25, 31]])}
+    write_voxel_store(store_file_name(store_dir, graph_file), label_voxels,
+                      [1., 1., 1.], np.eye(4), graph_filename=graph_file)
+
+    box = BoundingBoxMax(src_dir=str(tmpdir), tgt_dir=str(tmpdir),
+                         sulcus=None, store_dir=store_dir)
+    boxes = box.get_sulci_bounding_boxes(graph_file, ['S.C._left'])
+    assert boxes['S.C._left'][0].tolist() == [10, 20, 30]
+    assert boxes['S.C._left'][1].tolist() == [12, 25, 31]